@@ -1,239 +1,345 @@
 from contextlib import asynccontextmanager
-import json
 import os
-from fastapi import FastAPI, HTTPException, Query, Depends
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session
-from fuzzywuzzy import fuzz
+from fastapi import FastAPI, HTTPException, Query, Depends, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
-from datetime import datetime
+from pydantic import ValidationError
+from collections import Counter
+from datetime import datetime, timezone
+import json
 import logging
-from models import Activity, User, Reservation, ActivityDTO, ActivityResponseDTO, ActivityStatus, UserType
-from consumer import RabbitMQConsumer
-from config import RabbitMQConnectionConfig
-from connection_manager import RabbitMQConnectionManager
-from publisher import RabbitMQPublisher
-
-logging.basicConfig(level=logging.INFO, format='%(levelname)s:   %(message)s')
+import threading
+from models import Activity, User, Reservation, ActivityDTO, ActivityResponseDTO, ActivityStatus, UserType, OutboxEvent, Page
+from messaging import ACTIVITY_EVENT, RESERVATION_EVENT, USER_EVENT, RabbitMQConnection, RabbitMQConnectionConfig, RabbitMQConsumer, RabbitMQPublisher, latest_events
+from servicekit.outbox import Outbox, OutboxRelay
+from servicekit.bulk import bulk_report, read_chunks, validation_detail
+from response_cache import InMemoryBackend, RedisBackend, ResponseCache
+from search import ActivitySearchIndex
+from servicekit.user_cache import UserCache
+from servicekit.logs import LogSample, configure_logging
+from servicekit.instrumentation import PROMETHEUS, InstrumentationMiddleware, render_consumers, request_metrics, run_in_threadpool
+from servicekit.database import SessionLocal, async_engine, get_db, get_async_db, read_session, replicas, upsert, pool_metrics, async_pool_metrics
+
+configure_logging()
 logger = logging.getLogger(__name__)
-pika_logger = logging.getLogger("pika")
-pika_logger.setLevel(logging.WARNING)
+message_log = LogSample(logger)
+
+
+RABBITMQ_PREFETCH_COUNT = int(os.environ.get('RABBITMQ_PREFETCH_COUNT', 400))
+RABBITMQ_CONSUMER_WORKERS = int(os.environ.get('RABBITMQ_CONSUMER_WORKERS', 4))
+RABBITMQ_BATCH_SIZE = int(os.environ.get('RABBITMQ_BATCH_SIZE', 100))
+RABBITMQ_BATCH_TIMEOUT = int(os.environ.get('RABBITMQ_BATCH_TIMEOUT_MS', 50)) / 1000
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL_SECONDS', 60))
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 1000))
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL_SECONDS', 30))
+# Set to share cached responses and their invalidation between replicas
+RESPONSE_CACHE_REDIS_URL = os.environ.get('RESPONSE_CACHE_REDIS_URL')
+
+search_index = ActivitySearchIndex()
+search_index_refresh = threading.Lock()
+user_cache = UserCache(User, USER_CACHE_SIZE, USER_CACHE_TTL)
+outbox = Outbox(OutboxEvent)
+response_cache = ResponseCache(
+    RedisBackend(RESPONSE_CACHE_REDIS_URL) if RESPONSE_CACHE_REDIS_URL else InMemoryBackend(RESPONSE_CACHE_SIZE),
+    RESPONSE_CACHE_TTL
+)
+connection = None
+publisher = None
+outbox_relay = None
+consumers = []
+
+STREAM_BATCH_SIZE = 500
+
+
+def activity_dto(activity, username):
+    return ActivityResponseDTO(
+        id=activity.id,
+        category=activity.category,
+        date=activity.date,
+        price=activity.price,
+        name=activity.name,
+        description=activity.description,
+        total_places=activity.total_places,
+        status=activity.status,
+        user_id=activity.user_id,
+        username=username,
+        version=activity.version
+    )
 
 
-RABBITMQ_HOSTNAME = os.environ.get('RABBITMQ_HOSTNAME')
-RABBITMQ_PORT = os.environ.get('RABBITMQ_PORT')
-RABBITMQ_USERNAME = os.environ.get('RABBITMQ_USERNAME')
-RABBITMQ_PASSWORD = os.environ.get('RABBITMQ_PASSWORD')
-DATABASE_URL = f"postgresql://{os.getenv('DATABASE_USERNAME')}:{os.getenv('DATABASE_PASSWORD')}@{os.getenv('DATABASE_HOSTNAME')}:{os.getenv('DATABASE_PORT')}/{os.getenv('DATABASE_NAME')}"
+async def reserved_places(db, activity_id):
+    # Reservations replicated here that total_places already went down for, the
+    # reservation service adds them back to get the capacity. The activity row has
+    # to be locked so a reservation batch cannot change one without the other.
+    return await db.scalar(select(func.count()).select_from(Reservation).where(Reservation.activity_id == activity_id))
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async def organizer_username(db, user_id):
+    user = await user_cache.get_by_id(db, user_id)
+    return user.username if user is not None else None
+
+
+def parse_date(value):
+    # Activity dates are stored as timestamptz, naive input is taken as UTC
+    date = datetime.fromisoformat(value)
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+
+async def paginate(db, query, id_column, cursor, limit):
+    # Keyset pagination: rows after the cursor id in id order, plus one extra row
+    # to find out whether there is a next page
+    if cursor is not None:
+        query = query.where(id_column > cursor)
+    rows = (await db.execute(query.order_by(id_column).limit(limit + 1))).all()
+    return rows[:limit], len(rows) > limit
 
 @asynccontextmanager
 async def lifespan(app):
-    global publisher
-    logger.info("Waiting for RabbitMQ connection...")
-    config = RabbitMQConnectionConfig(RABBITMQ_HOSTNAME, RABBITMQ_PORT, RABBITMQ_USERNAME, RABBITMQ_PASSWORD)
-    user_connection_manager = RabbitMQConnectionManager(config)
-    reservation_connection_manager = RabbitMQConnectionManager(config)
-    publisher_connection_manager = RabbitMQConnectionManager(config)
-    publisher = RabbitMQPublisher(publisher_connection_manager, 'activity')
-    user_consumer = RabbitMQConsumer(user_connection_manager, user_callback, 'user', ['created', 'deleted', 'updated'])
-    reservation_consumer = RabbitMQConsumer(reservation_connection_manager, reservation_callback, 'reservation', ['created', 'deleted', 'updated'])
-    user_consumer.start_consuming()
-    reservation_consumer.start_consuming()
+    global connection, publisher, outbox_relay, consumers
+    refresh_search_index()
+    # One broker connection for the publisher and every consumer, each on its own channel
+    connection = RabbitMQConnection(RabbitMQConnectionConfig.from_env())
+    publisher = RabbitMQPublisher(connection, 'activity')
+    outbox_relay = OutboxRelay(SessionLocal, publisher, outbox)
+    consumers = [
+        RabbitMQConsumer(connection, user_callback, 'user', ['created', 'deleted', 'updated'], 'activity-service.user', RABBITMQ_PREFETCH_COUNT, RABBITMQ_CONSUMER_WORKERS, batch_callback=apply_user_events, batch_size=RABBITMQ_BATCH_SIZE, batch_timeout=RABBITMQ_BATCH_TIMEOUT, schema=USER_EVENT),
+        RabbitMQConsumer(connection, reservation_callback, 'reservation', ['created', 'deleted', 'updated', 'cancelled'], 'activity-service.reservation', RABBITMQ_PREFETCH_COUNT, RABBITMQ_CONSUMER_WORKERS, batch_callback=apply_reservation_events, batch_size=RABBITMQ_BATCH_SIZE, batch_timeout=RABBITMQ_BATCH_TIMEOUT, schema=RESERVATION_EVENT),
+        SearchIndexConsumer(connection, activity_callback, 'activity', ['created', 'deleted', 'updated'], '', RABBITMQ_PREFETCH_COUNT, RABBITMQ_CONSUMER_WORKERS, batch_callback=index_activity_events, batch_size=RABBITMQ_BATCH_SIZE, batch_timeout=RABBITMQ_BATCH_TIMEOUT, schema=ACTIVITY_EVENT),
+    ]
+    for consumer in consumers:
+        consumer.start_consuming()
+    connection.start()
+    outbox_relay.start_relaying()
     try:
         yield
     finally:
-        user_connection_manager.close()
-        reservation_connection_manager.close()
-        publisher_connection_manager.close()
+        outbox_relay.close()
+        connection.close()
+        await async_engine.dispose()
+        await replicas.dispose()
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(InstrumentationMiddleware)
 
 
     
 
-def user_callback(ch, method, properties, body):
-    logger.info(f"Message recieved")
-    logger.info(f"Method:{method}")
-    logger.info(f"Properties:{properties}")
-    user = parse_user_message(body)
-    if method.routing_key == 'created':
-        logger.info(f"Parsing user created message")
-        save_user(user)
-    elif method.routing_key == 'deleted':
-        logger.info(f"Parsing user deleted message")
-        delete_user(user)
-    elif method.routing_key == 'updated':
-        logger.info(f"Parsing user updated message")
-        update_user(user)
-
-
-def save_user(user):
+def refresh_search_index(ids=None):
+    # Serialized, so the refresh that read the table last also writes the index
+    # last. Without ids the whole index is rebuilt.
+    with search_index_refresh:
+        db = next(get_db())
+        try:
+            activities = db.query(Activity.id, Activity.name, Activity.description)
+            if ids is None:
+                search_index.build(activities.yield_per(1000))
+            else:
+                search_index.refresh(ids, activities.filter(Activity.id.in_(ids)).all())
+        finally:
+            db.close()
+
+
+class SearchIndexConsumer(RabbitMQConsumer):
+    # Every replica gets the activity events of all of them, its own included, on a
+    # server-named queue. Events sent while that queue did not exist are lost, so the
+    # index is rebuilt each time it is declared.
+    def setup(self, connection):
+        super().setup(connection)
+        threading.Thread(target=refresh_search_index, daemon=True).start()
+
+
+def activity_callback(ch, method, properties, event):
+    if message_log():
+        logger.debug("Message received from exchange %s with routing key %s", method.exchange, method.routing_key)
+    index_activity_events([(method.routing_key, event)])
+
+
+def index_activity_events(messages):
+    # The events only tell which activities changed, their rows are read again, so
+    # events arriving out of order cannot bring back an older name or a deleted one
+    refresh_search_index({event['id'] for _, event in messages})
+
+
+def user_callback(ch, method, properties, event):
+    if message_log():
+        logger.debug("Message received from exchange %s with routing key %s", method.exchange, method.routing_key)
+    apply_user_events([(method.routing_key, event)])
+
+
+def apply_user_events(messages):
+    events = latest_events(messages, parse_user_message)
+    users = [user for routing_key, user in events if routing_key != 'deleted']
+    deleted = [user for routing_key, user in events if routing_key == 'deleted']
+    logger.debug("Applying %s user upserts and %s deletes", len(users), len(deleted))
     db = next(get_db())
     try:
-        db.add(user)
+        renamed = []
+        if users:
+            stale = len(users) - upsert(db, User, users)
+            if stale:
+                logger.debug("Skipped %s stale user events", stale)
+            # Their activities are served with the organizer's username
+            renamed = db.scalars(select(Activity.id).where(Activity.user_id.in_([user['id'] for user in users]))).all()
+        activity_ids = delete_users(db, deleted) if deleted else []
         db.commit()
-        db.refresh(user)
     except Exception as e:
         db.rollback()
-        logger.error(f"Error adding user to database: {e}")
+        logger.error("Error applying user events to database: %s", e)
+        raise
     finally:
         db.close()
-
-
-def update_user(user):
+    user_cache.invalidate([user['id'] for user in users + deleted])
+    if renamed or activity_ids:
+        response_cache.invalidate([*renamed, *activity_ids])
+    if activity_ids:
+        outbox_relay.notify()
+    for activity_id in activity_ids:
+        search_index.remove(activity_id)
+
+
+def delete_users(db, users):
+    # Removes the users with their reservations and activities, and queues a
+    # deleted event for each activity
+    usernames = {user['id']: user['username'] for user in users}
+    ids = list(usernames)
+    activities = db.query(Activity).filter(Activity.user_id.in_(ids)).all()
+    for activity in activities:
+        outbox.add_event(db, 'deleted', ACTIVITY_EVENT, activity_dto(activity, usernames[activity.user_id]).model_dump())
+    db.query(Reservation).filter(Reservation.participant_id.in_(ids)).delete()
+    db.query(Activity).filter(Activity.user_id.in_(ids)).delete()
+    db.query(User).filter(User.id.in_(ids)).delete()
+    return [activity.id for activity in activities]
+
+
+def parse_user_message(event):
+    # USER_EVENT fields are the users columns
+    return dict(event, user_type=UserType(event['user_type']))
+
+
+
+
+def reservation_callback(ch, method, properties, event):
+    if message_log():
+        logger.debug("Message received from exchange %s with routing key %s", method.exchange, method.routing_key)
+    apply_reservation_events([(method.routing_key, event)])
+
+
+def apply_reservation_events(messages):
+    # Free places follow the rows: every reservation inserted here takes a place
+    # and every reservation deleted gives one back, so replays do not drift
+    events = latest_events(messages, parse_reservation_message)
+    reservations = [reservation for routing_key, reservation in events if routing_key not in ('deleted', 'cancelled')]
+    removed = [reservation['id'] for routing_key, reservation in events if routing_key in ('deleted', 'cancelled')]
+    logger.debug("Applying %s reservation upserts and %s deletes", len(reservations), len(removed))
+    places = Counter()
     db = next(get_db())
     try:
-        db.query(User).filter(User.id == user.id).update(
-            {User.username: user.username, User.email: user.email, User.user_type: user.user_type})
+        if reservations:
+            inserted = db.execute(
+                insert(Reservation).values(reservations)
+                .on_conflict_do_nothing(index_elements=[Reservation.id])
+                .returning(Reservation.id, Reservation.activity_id)
+            ).all()
+            for _, activity_id in inserted:
+                places[activity_id] -= 1
+            inserted_ids = {id for id, _ in inserted}
+            existing = [reservation for reservation in reservations if reservation['id'] not in inserted_ids]
+            if existing:
+                # A reservation moved to another activity gives its place back to the old one
+                previous = dict(db.execute(
+                    select(Reservation.id, Reservation.activity_id).where(Reservation.id.in_([reservation['id'] for reservation in existing]))
+                ).all())
+                for reservation in existing:
+                    if previous.get(reservation['id'], reservation['activity_id']) != reservation['activity_id']:
+                        places[previous[reservation['id']]] += 1
+                        places[reservation['activity_id']] -= 1
+                db.execute(update(Reservation), existing)
+        if removed:
+            for activity_id, in db.execute(delete(Reservation).where(Reservation.id.in_(removed)).returning(Reservation.activity_id)):
+                places[activity_id] += 1
+        for activity_id, change in places.items():
+            if change:
+                db.query(Activity).filter(Activity.id == activity_id).update(
+                    {Activity.total_places: Activity.total_places + change})
         db.commit()
-        db.refresh(user)
     except Exception as e:
         db.rollback()
-        logger.error(f"Error updating user in database: {e}")
+        logger.error("Error applying reservation events to database: %s", e)
+        raise
     finally:
         db.close()
+    changed = [activity_id for activity_id, change in places.items() if change]
+    if changed:
+        response_cache.invalidate(changed)
 
 
-def delete_user(user):
-    db = next(get_db())
-    try:
-        db.query(User).filter(User.id == user.id).delete()
-        db.query(Reservation).filter(Reservation.participant_id == user.id).delete()
-        activity = db.query(Activity).filter(Activity.user_id == user.id).first()
-        dto = ActivityResponseDTO(
-            id=activity.id,
-            category=activity.category,
-            date=activity.date,
-            price=activity.price,
-            name=activity.name,
-            description=activity.description,
-            total_places=activity.total_places,
-            status=activity.status,
-            user_id=activity.user_id
-        )
-        db.query(Activity).filter(Activity.user_id == user.id).delete()
-        publisher.publish(dto.model_dump_json(), 'deleted')
-        db.commit()
-        
-    except Exception as e:
-        db.rollback()
-        logger.error(f"Error deleting user from database: {e}")
-    finally:
-        db.close()
-
-
-def parse_user_message(body):
-    user_data = json.loads(body)
-    return User(id = user_data['id'],username=user_data['username'], email=user_data['email'], user_type=UserType(user_data['user_type']))
+def parse_reservation_message(event):
+    return dict(
+        id=event['id'],
+        participant_id=event['participant_id'],
+        activity_id=event['activity_id'],
+        date=event['date']
+    )
 
 
 
 
-def reservation_callback(ch, method, properties, body):
-    logger.info(f"Message received")
-    logger.info(f"Method:{method}")
-    logger.info(f"Properties:{properties}")
-    reservation = parse_reservation_message(body)
-    if method.routing_key == 'created':
-        logger.info(f"Parsing reservation created message")
-        save_reservation(reservation)
-    elif method.routing_key == 'deleted':
-        logger.info(f"Parsing reservation deleted message")
-        delete_reservation(reservation)
-    elif method.routing_key == 'updated':
-        logger.info(f"Parsing reservation updated message")
-        update_reservation(reservation)
+@app.get("/metrics")
+async def read_metrics():
+    return Response(request_metrics.render() + render_consumers(consumers), media_type=PROMETHEUS)
 
 
-def update_reservation(reservation):
-    db = next(get_db())
-    try:
-        db.query(Reservation).filter(Reservation.id == reservation.id).update(
-            {Reservation.participant_id: reservation.participant_id, Reservation.activity_id: reservation.activity_id, Reservation.date: reservation.date})
-        db.commit()
-        db.refresh(reservation)
-    except Exception as e:
-        db.rollback()
-        logger.error(f"Error updating reservation in database: {e}")
-    finally:
-        db.close()
+@app.get("/metrics/messaging")
+async def read_messaging_metrics():
+    return connection.snapshot()
 
 
-def delete_reservation(reservation):
-    db = next(get_db())
-    try:
-        db.query(Activity).filter(Activity.id == reservation.activity_id).update(
-            {Activity.total_places: Activity.total_places + 1})
-        db.commit()
-        db.query(Reservation).filter(Reservation.id == reservation.id).delete()
-        db.commit()
-    except Exception as e:
-        db.rollback()
-        logger.error(f"Error deleting reservation from database: {e}")
-    finally:
-        db.close()
+@app.get("/metrics/outbox")
+async def read_outbox_metrics(db: AsyncSession = Depends(get_async_db)):
+    return {**outbox_relay.metrics.snapshot(), **(await outbox.backlog(db))}
 
 
-def save_reservation(reservation):
-    db = next(get_db())
-    try:
-        db.query(Activity).filter(Activity.id == reservation.activity_id).update(
-            {Activity.total_places: Activity.total_places - 1})
-        db.commit()
-        db.add(reservation)
-        db.commit()
-        db.refresh(reservation)
-    except Exception as e:
-        db.rollback()
-        logger.error(f"Error adding reservation to database: {e}")
-    finally:
-        db.close()
+@app.get("/metrics/pool")
+async def read_pool_metrics():
+    return {"sync": pool_metrics.snapshot(), "async": async_pool_metrics.snapshot(), **replicas.snapshot()}
 
 
-def parse_reservation_message(body):
-    reservation_data = json.loads(body)
-    return Reservation(
-        participant_id=reservation_data['participant_id'],
-        activity_id=reservation_data['activity_id'],
-        date=datetime.strptime(reservation_data['date'], "%Y-%m-%dT%H:%M:%S")
-    )
+@app.get("/metrics/user-cache")
+async def read_user_cache_metrics():
+    return user_cache.snapshot()
 
 
+@app.get("/metrics/response-cache")
+async def read_response_cache_metrics():
+    return response_cache.snapshot()
 
 
 @app.get("/activities/{id}")
-def read_activity(id: int, db: Session = Depends(get_db)):
-    activity = db.query(Activity).filter(Activity.id == id).first()
-    if activity is None:
+async def read_activity(id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    key = response_cache.activity_key(id)
+    cached = response_cache.lookup(key, request)
+    if cached is not None:
+        return cached
+    generation = response_cache.generation()
+    row = (await db.execute(
+        select(Activity, User.username)
+        .join(User, User.id == Activity.user_id)
+        .where(Activity.id == id)
+    )).first()
+    if row is None:
         raise HTTPException(status_code=404, detail="Activity not found")
-    user = db.query(User).filter(User.id == activity.user_id).first()
-    response = ActivityResponseDTO(
-        id=activity.id,
-        category=activity.category,
-        date=activity.date,
-        price=activity.price,
-        name=activity.name,
-        description=activity.description,
-        total_places=activity.total_places,
-        status=activity.status,
-        user_id=activity.user_id,
-        username=user.username
-    )
-    return response
+    activity, organizer = row
+    return response_cache.store(key, generation, activity_dto(activity, organizer), request)
 
 @app.get("/activities")
-def read_activities(
+async def read_activities(
+    request: Request,
     username: Optional[str] = None,
     user_id: Optional[int] = None,
     category: Optional[List[str]] = Query(None),
@@ -243,51 +349,119 @@ def read_activities(
     to_price: Optional[float] = None,
     search: Optional[str] = None,
     similarity_threshold: int = 70,
-    db: Session = Depends(get_db),
     available: Optional[bool] = None,
-    status: Optional[ActivityStatus] = None
+    status: Optional[ActivityStatus] = None,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[int] = None,
+    stream: bool = False
 ):
-    query = db.query(Activity)
+    # Organizer usernames are fetched in the same query instead of one lookup per activity
+    query = select(Activity, User.username).join(User, User.id == Activity.user_id)
     if username is not None:
-        query = query.join(User, User.id == Activity.user_id).filter(User.username == username)
+        query = query.where(User.username == username)
     if user_id is not None:
-        query = query.filter(Activity.user_id == user_id)
+        query = query.where(Activity.user_id == user_id)
     if category is not None:
-        query = query.filter(Activity.category.in_(category))
-    if from_date is not None:
-        from_date_dt = datetime.strptime(from_date, "%Y-%m-%dT%H:%M:%S%z")
-        query = query.filter(datetime.strptime(Activity.date, "%Y-%m-%dT%H:%M:%S%z") >= from_date_dt)
-    if to_date is not None:
-        to_date_dt = datetime.strptime(to_date, "%Y-%m-%dT%H:%M:%S%z")
-        query = query.filter(datetime.strptime(Activity.date, "%Y-%m-%dT%H:%M:%S%z") <= to_date_dt)
+        query = query.where(Activity.category.in_(category))
+    try:
+        from_date_dt = parse_date(from_date) if from_date is not None else None
+        to_date_dt = parse_date(to_date) if to_date is not None else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DDTHH:MM:SS[+HH:MM]")
+    if from_date_dt is not None:
+        query = query.where(Activity.date >= from_date_dt)
+    if to_date_dt is not None:
+        query = query.where(Activity.date <= to_date_dt)
     if from_price is not None:
-        query = query.filter(Activity.price >= from_price)
+        query = query.where(Activity.price >= from_price)
     if to_price is not None:
-        query = query.filter(Activity.price <= to_price)
+        query = query.where(Activity.price <= to_price)
     if available is not None:
-        query = query.filter(Activity.total_places > 0)
+        query = query.where(Activity.total_places > 0)
     if status is not None:
-        query = query.filter(Activity.status == status)
+        query = query.where(Activity.status == status)
+    if stream:
+        # NDJSON of every matching activity after the cursor, limit does not apply
+        return StreamingResponse(
+            stream_activities(query, search, similarity_threshold, cursor),
+            media_type="application/x-ndjson"
+        )
+    # Keyed on the parsed filters, so equivalent query strings share an entry. A hit
+    # does not touch the database, the read session is only opened on a miss.
+    generation = response_cache.generation()
+    key = response_cache.listing_key(generation, json.dumps(dict(
+        username=username,
+        user_id=user_id,
+        category=sorted(set(category)) if category is not None else None,
+        from_date=from_date_dt,
+        to_date=to_date_dt,
+        from_price=from_price,
+        to_price=to_price,
+        search=search,
+        similarity_threshold=similarity_threshold if search is not None else None,
+        available=available is not None,
+        status=status,
+        limit=limit,
+        cursor=cursor,
+    ), sort_keys=True, default=str))
+    cached = response_cache.lookup(key, request)
+    if cached is not None:
+        return cached
+    async with read_session() as db:
+        page = await activity_page(db, query, search, similarity_threshold, cursor, limit)
+    return response_cache.store(key, generation, page, request)
+
+
+async def activity_page(db, query, search, similarity_threshold, cursor, limit):
     if search is not None:
-        activities = query.all()
-        filtered_activities = list(filter(
-            lambda x: fuzz.partial_ratio(search.lower(), x.name.lower()) >= similarity_threshold or 
-                      fuzz.partial_ratio(search.lower(), x.description.lower()) >= similarity_threshold, 
-            activities
-        ))
+        rows = []
+        async for row in search_rows(db, query, search, similarity_threshold, cursor, limit + 1):
+            rows.append(row)
+            if len(rows) > limit:
+                break
+        rows, has_more = rows[:limit], len(rows) > limit
     else:
-        filtered_activities = query.all()
-    if len(filtered_activities) == 0:
-        return []
-    for activity in filtered_activities:
-        user = db.query(User).filter(User.id == activity.user_id).first()
-        activity.username = user.username
-    return [ActivityResponseDTO.model_validate(activity) for activity in filtered_activities]
+        rows, has_more = await paginate(db, query, Activity.id, cursor, limit)
+    for activity, organizer in rows:
+        activity.username = organizer
+    return Page(
+        items=[ActivityResponseDTO.model_validate(activity) for activity, _ in rows],
+        next_cursor=rows[-1].Activity.id if has_more else None
+    )
 
-@app.post("/activities")
-def create(activity: ActivityDTO, db: Session = Depends(get_db)):
-    if activity is None:
-        raise HTTPException(status_code=400, detail="Invalid request body")
+
+async def search_rows(db, query, search, similarity_threshold, cursor, batch_size):
+    # Search results are ordered by (score desc, id), the cursor is the id of the
+    # last activity on the previous page. Rows are loaded batch_size ids at a time.
+    # Fuzzy scoring is CPU bound, so it runs off the event loop.
+    ranked = await run_in_threadpool(search_index.search, search, similarity_threshold)
+    if cursor is not None:
+        last = (-search_index.score(search, cursor), cursor)
+        ranked = [(id, score) for id, score in ranked if (-score, id) > last]
+    for start in range(0, len(ranked), batch_size):
+        chunk = [id for id, _ in ranked[start:start + batch_size]]
+        found = {row.Activity.id: row for row in await db.execute(query.where(Activity.id.in_(chunk)))}
+        for id in chunk:
+            if id in found:
+                yield found[id]
+
+
+async def stream_activities(query, search, similarity_threshold, cursor):
+    # The body is sent after the handler returns, so the stream reads through its
+    # own session with a server-side cursor
+    async with read_session() as db:
+        if search is not None:
+            rows = search_rows(db, query, search, similarity_threshold, cursor, STREAM_BATCH_SIZE)
+        else:
+            if cursor is not None:
+                query = query.where(Activity.id > cursor)
+            rows = await db.stream(query.order_by(Activity.id).execution_options(yield_per=STREAM_BATCH_SIZE))
+        async for activity, organizer in rows:
+            activity.username = organizer
+            yield ActivityResponseDTO.model_validate(activity).model_dump_json() + "\n"
+
+def check_activity(activity):
+    # Returns the parsed date of a new activity
     if  activity.category is None or activity.date is None or activity.price is None or activity.name is None or activity.description is None:
         raise HTTPException(status_code=400, detail="Invalid request body")
     if activity.price < 0:
@@ -295,143 +469,178 @@ def create(activity: ActivityDTO, db: Session = Depends(get_db)):
     if activity.total_places < 0:
         raise HTTPException(status_code=400, detail="Total places cannot be negative")
     try :
-        datetime.strptime(activity.date, "%Y-%m-%dT%H:%M:%S")
+        return parse_date(activity.date)
     except ValueError:
-        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
-    user = db.query(User).filter(User.username == activity.username).first()
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DDTHH:MM:SS[+HH:MM]")
+
+@app.post("/activities")
+async def create(activity: ActivityDTO, db: AsyncSession = Depends(get_async_db)):
+    if activity is None:
+        raise HTTPException(status_code=400, detail="Invalid request body")
+    date = check_activity(activity)
+    user = await user_cache.get_by_username(db, activity.username)
     if user is None:
         raise HTTPException(status_code=400, detail="User not found")
-    logger.info(f"User found: {user.username}")
     db_activity = Activity(
         user_id=user.id,
         category=activity.category,
-        date=activity.date,
+        date=date,
         price=activity.price,
         name=activity.name,
         description=activity.description,
         total_places=activity.total_places,
     )
     db.add(db_activity)
-    db.commit()
-    db.refresh(db_activity)
-    dto = ActivityResponseDTO(
-        id=db_activity.id,
-        category=db_activity.category,
-        date=db_activity.date,
-        price=db_activity.price,
-        name=db_activity.name,
-        description=db_activity.description,
-        total_places=db_activity.total_places,
-        status=db_activity.status,
-        user_id=db_activity.user_id,
-        username=user.username
-    )
-    publisher.publish(dto.model_dump_json(), 'created')
+    await db.flush()
+    dto = activity_dto(db_activity, user.username)
+    outbox.add_event(db, 'created', ACTIVITY_EVENT, dict(dto.model_dump(), reserved=0))
+    await db.commit()
+    outbox_relay.notify()
+    search_index.add(db_activity)
+    response_cache.invalidate([db_activity.id])
     return dto
 
+@app.post("/activities/bulk")
+async def create_bulk(request: Request, db: AsyncSession = Depends(get_async_db)):
+    # Takes a JSON array or NDJSON of activities and reports a status per item.
+    # Every BULK_CHUNK_SIZE items are checked together, inserted with one multi-row
+    # INSERT and committed with their events, a failing chunk does not undo the others.
+    report = []
+    async for chunk in read_chunks(request):
+        valid = []
+        for index, item in chunk:
+            try:
+                if isinstance(item, ValueError):
+                    raise HTTPException(status_code=400, detail="Invalid JSON")
+                activity = ActivityDTO.model_validate(item)
+                valid.append((index, activity, check_activity(activity)))
+            except ValidationError as e:
+                report.append({"index": index, "status": 400, "detail": validation_detail(e)})
+            except HTTPException as e:
+                report.append({"index": index, "status": e.status_code, "detail": e.detail})
+        organizers = dict((await db.execute(
+            select(User.username, User.id).where(User.username.in_({activity.username for _, activity, _ in valid}))
+        )).all()) if valid else {}
+        rows = []
+        for index, activity, date in valid:
+            if activity.username not in organizers:
+                report.append({"index": index, "status": 400, "detail": "User not found"})
+                continue
+            rows.append((index, activity.username, dict(
+                user_id=organizers[activity.username],
+                category=activity.category,
+                date=date,
+                price=activity.price,
+                name=activity.name,
+                description=activity.description,
+                total_places=activity.total_places,
+            )))
+        if not rows:
+            continue
+        try:
+            activities = (await db.scalars(
+                insert(Activity).returning(Activity, sort_by_parameter_order=True),
+                [row for _, _, row in rows]
+            )).all()
+            for db_activity, (_, username, _) in zip(activities, rows):
+                outbox.add_event(db, 'created', ACTIVITY_EVENT, dict(activity_dto(db_activity, username).model_dump(), reserved=0))
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            logger.error("Error saving %s activities: %s", len(rows), e)
+            report.extend({"index": index, "status": 500, "detail": "Could not save activity"} for index, _, _ in rows)
+            continue
+        outbox_relay.notify()
+        response_cache.invalidate([db_activity.id for db_activity in activities])
+        for db_activity, (index, _, _) in zip(activities, rows):
+            search_index.add(db_activity)
+            report.append({"index": index, "status": 201, "id": db_activity.id})
+        logger.info("Created %s activities in bulk", len(rows))
+    return bulk_report(report)
+
 @app.delete("/activities/{activity_id}")
-def delete_activity(activity_id: int, db: Session = Depends(get_db)):
+async def delete_activity(activity_id: int, db: AsyncSession = Depends(get_async_db)):
     if activity_id is None:
         raise HTTPException(status_code=400, detail="Activity ID is required")
-    db_activity = db.query(Activity).filter(Activity.id == activity_id).first()
-    dto = ActivityResponseDTO(
-        id=db_activity.id,
-        category=db_activity.category,
-        date=db_activity.date,
-        price=db_activity.price,
-        name=db_activity.name,
-        description=db_activity.description,
-        total_places=db_activity.total_places,
-        status=db_activity.status,
-        user_id=db_activity.user
-    )
-    if db_activity is None:
+    row = (await db.execute(
+        select(Activity, User.username)
+        .join(User, User.id == Activity.user_id)
+        .where(Activity.id == activity_id)
+    )).first()
+    if row is None:
         raise HTTPException(status_code=404, detail="Activity not found")
-    db.delete(db_activity)
-    db.commit()
-    publisher.publish(dto.model_dump_json(), 'deleted')
+    db_activity, organizer = row
+    outbox.add_event(db, 'deleted', ACTIVITY_EVENT, activity_dto(db_activity, organizer).model_dump())
+    await db.delete(db_activity)
+    await db.commit()
+    outbox_relay.notify()
+    search_index.remove(activity_id)
+    response_cache.invalidate([activity_id])
     return {"message": "Activity deleted successfully"}
 
 
 @app.put("/activities/{activity_id}")
-def update_activity(activity_id: int, activity: ActivityDTO, db: Session = Depends(get_db)):
+async def update_activity(activity_id: int, activity: ActivityDTO, db: AsyncSession = Depends(get_async_db)):
     if activity_id is None:
         raise HTTPException(status_code=400, detail="Activity ID is required")
     if activity is None:
         raise HTTPException(status_code=400, detail="Invalid request body")
         
-    db_activity = db.query(Activity).filter(Activity.id == activity_id).first()
+    try:
+        date = parse_date(activity.date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DDTHH:MM:SS[+HH:MM]")
+    db_activity = await db.scalar(select(Activity).where(Activity.id == activity_id).with_for_update())
     if db_activity is None:
         raise HTTPException(status_code=404, detail="Activity not found")
     db_activity.user_id = activity.user_id
     db_activity.category = activity.category
-    db_activity.date = activity.date
+    db_activity.date = date
     db_activity.price = activity.price
     db_activity.name = activity.name
     db_activity.description = activity.description
     db_activity.total_places = activity.total_places
     db_activity.status = activity.status
-    db.commit()
-    db.refresh(db_activity)
-    dto = ActivityResponseDTO(
-        id=db_activity.id,
-        category=db_activity.category,
-        date=db_activity.date,
-        price=db_activity.price,
-        name=db_activity.name,
-        description=db_activity.description,
-        total_places=db_activity.total_places,
-        status=db_activity.status,
-        user_id=db_activity.user_id
-    )
-    publisher.publish(dto.model_dump_json(), 'updated')
+    # Flushing bumps the version before it goes into the event
+    await db.flush()
+    organizer = await organizer_username(db, db_activity.user_id)
+    dto = activity_dto(db_activity, organizer)
+    outbox.add_event(db, 'updated', ACTIVITY_EVENT, dict(dto.model_dump(), reserved=await reserved_places(db, activity_id)))
+    await db.commit()
+    outbox_relay.notify()
+    search_index.add(db_activity)
+    response_cache.invalidate([db_activity.id])
     return dto
 
 @app.put("/activities/cancel/{activity_id}")
-def cancel_activity(activity_id: int, db: Session = Depends(get_db)):
+async def cancel_activity(activity_id: int, db: AsyncSession = Depends(get_async_db)):
     if activity_id is None:
         raise HTTPException(status_code=400, detail="Activity ID is required")
-    db_activity = db.query(Activity).filter(Activity.id == activity_id).first()
+    db_activity = await db.scalar(select(Activity).where(Activity.id == activity_id).with_for_update())
     if db_activity is None:
         raise HTTPException(status_code=404, detail="Activity not found")
     db_activity.status = ActivityStatus.CANCELED
-    db.commit()
-    db.refresh(db_activity)
-    dto = ActivityResponseDTO(
-        id=db_activity.id,
-        category=db_activity.category,
-        date=db_activity.date,
-        price=db_activity.price,
-        name=db_activity.name,
-        description=db_activity.description,
-        total_places=db_activity.total_places,
-        status=db_activity.status,
-        user_id=db_activity.user
-    )
-    publisher.publish(dto.model_dump_json(), 'updated')
+    await db.flush()
+    organizer = await organizer_username(db, db_activity.user_id)
+    outbox.add_event(db, 'updated', ACTIVITY_EVENT, dict(activity_dto(db_activity, organizer).model_dump(), reserved=await reserved_places(db, activity_id)))
+    await db.commit()
+    outbox_relay.notify()
+    response_cache.invalidate([activity_id])
     return {"message": "Activity canceled successfully"}
 
 @app.put("/activities/{activity_id}")
-def finish_activity(activity_id: int, db: Session = Depends(get_db)):
+async def finish_activity(activity_id: int, db: AsyncSession = Depends(get_async_db)):
     if activity_id is None:
         raise HTTPException(status_code=400, detail="Activity ID is required")
-    db_activity = db.query(Activity).filter(Activity.id == activity_id).first()
+    db_activity = await db.scalar(select(Activity).where(Activity.id == activity_id).with_for_update())
     if db_activity is None:
         raise HTTPException(status_code=404, detail="Activity not found")
     db_activity.status = ActivityStatus.FINISHED
-    db.commit()
-    db.refresh(db_activity)
-    dto = ActivityResponseDTO(
-        id=db_activity.id,
-        category=db_activity.category,
-        date=db_activity.date,
-        price=db_activity.price,
-        name=db_activity.name,
-        description=db_activity.description,
-        total_places=db_activity.total_places,
-        status=db_activity.status,
-        user_id=db_activity.user
-    )
-    publisher.publish(dto.model_dump_json(), 'updated')
+    await db.flush()
+    organizer = await organizer_username(db, db_activity.user_id)
+    outbox.add_event(db, 'updated', ACTIVITY_EVENT, dict(activity_dto(db_activity, organizer).model_dump(), reserved=await reserved_places(db, activity_id)))
+    await db.commit()
+    outbox_relay.notify()
+    response_cache.invalidate([activity_id])
     return {"message": "Activity finished successfully"}
     
\ No newline at end of file
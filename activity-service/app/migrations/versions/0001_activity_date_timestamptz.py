@@ -0,0 +1,36 @@
+"""activity date as timestamptz
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 10:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    columns = {column['name']: column for column in sa.inspect(op.get_bind()).get_columns('activities')}
+    if not isinstance(columns['date']['type'], sa.DateTime):
+        # Existing rows hold "YYYY-MM-DDTHH:MM:SS" strings, read as UTC
+        op.alter_column(
+            'activities', 'date',
+            type_=sa.DateTime(timezone=True),
+            postgresql_using="date::timestamp AT TIME ZONE 'UTC'"
+        )
+    op.create_index('ix_activities_date', 'activities', ['date'], if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_activities_date', table_name='activities')
+    op.alter_column(
+        'activities', 'date',
+        type_=sa.String(),
+        postgresql_using="to_char(date AT TIME ZONE 'UTC', 'YYYY-MM-DD\"T\"HH24:MI:SS')"
+    )
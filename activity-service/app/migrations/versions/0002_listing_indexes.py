@@ -0,0 +1,34 @@
+"""indexes for listing and replication filters
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 11:00:00
+
+"""
+from alembic import op
+
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+INDEXES = [
+    ('ix_activities_user_id_id', 'activities', ['user_id', 'id']),
+    ('ix_activities_category_id', 'activities', ['category', 'id']),
+    ('ix_activities_status_id', 'activities', ['status', 'id']),
+    ('ix_users_username', 'users', ['username']),
+    ('ix_reservations_participant_id', 'reservations', ['participant_id']),
+    ('ix_reservations_activity_id', 'reservations', ['activity_id']),
+]
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, if_not_exists=True)
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table, if_exists=True)
@@ -0,0 +1,30 @@
+"""outbox events table
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 12:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not sa.inspect(op.get_bind()).has_table('outbox_events'):
+        op.create_table(
+            'outbox_events',
+            sa.Column('id', sa.BigInteger(), primary_key=True),
+            sa.Column('routing_key', sa.String()),
+            sa.Column('payload', sa.Text()),
+            sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+
+
+def downgrade():
+    op.drop_table('outbox_events')
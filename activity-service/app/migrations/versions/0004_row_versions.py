@@ -0,0 +1,33 @@
+"""row versions for replicated tables
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 13:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+VERSION_COLUMNS = [
+    ('activities', '1'),
+    ('users', '0'),
+]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for table, default in VERSION_COLUMNS:
+        if 'version' not in {column['name'] for column in inspector.get_columns(table)}:
+            op.add_column(table, sa.Column('version', sa.Integer(), nullable=False, server_default=default))
+
+
+def downgrade():
+    for table, _ in reversed(VERSION_COLUMNS):
+        op.drop_column(table, 'version')
@@ -0,0 +1,30 @@
+"""binary outbox payloads with a content type
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 14:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    columns = {column['name']: column for column in sa.inspect(op.get_bind()).get_columns('outbox_events')}
+    # Rows still waiting for the relay are JSON text
+    if not isinstance(columns['payload']['type'], sa.LargeBinary):
+        op.alter_column('outbox_events', 'payload', type_=sa.LargeBinary(), postgresql_using="convert_to(payload, 'UTF8')")
+    if 'content_type' not in columns:
+        op.add_column('outbox_events', sa.Column('content_type', sa.String(), nullable=False, server_default='application/json'))
+
+
+def downgrade():
+    # Only works while every pending row is JSON, msgpack payloads are not text
+    op.drop_column('outbox_events', 'content_type')
+    op.alter_column('outbox_events', 'payload', type_=sa.Text(), postgresql_using="convert_from(payload, 'UTF8')")
@@ -0,0 +1,47 @@
+"""republish every activity with its reserved places
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19 10:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from messaging import ACTIVITY_EVENT
+
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Reservation-service only books activities it has seat rows for, and seeds them
+    # from activity events that carry reserved. Activities not updated since those
+    # events were introduced get one now through the outbox, with their current
+    # version, so activities already seeded there keep their rows.
+    bind = op.get_bind()
+    activities = bind.execute(sa.text(
+        "SELECT a.id, a.user_id, a.category, a.date, a.price, a.name, a.description, a.total_places, "
+        "lower(a.status::text) AS status, u.username, a.version, "
+        "(SELECT count(*) FROM reservations r WHERE r.activity_id = a.id) AS reserved "
+        "FROM activities a LEFT JOIN users u ON u.id = a.user_id ORDER BY a.id"
+    )).mappings().all()
+    outbox_events = sa.table(
+        'outbox_events',
+        sa.column('routing_key', sa.String),
+        sa.column('payload', sa.LargeBinary),
+        sa.column('content_type', sa.String),
+    )
+    rows = []
+    for activity in activities:
+        payload, content_type = ACTIVITY_EVENT.encode(dict(activity))
+        rows.append({'routing_key': 'updated', 'payload': payload, 'content_type': content_type})
+    if rows:
+        op.bulk_insert(outbox_events, rows)
+
+
+def downgrade():
+    # The events may already be relayed, there is nothing to take back
+    pass
@@ -1,22 +1,16 @@
+from datetime import datetime
 from enum import Enum
-import os
-from typing import Optional
+from typing import Generic, List, Optional, TypeVar
 from pydantic import BaseModel
-from sqlalchemy import Column, Integer, String, Float, Enum as SQLAlchemyEnum, create_engine
+from sqlalchemy import BigInteger, Column, Index, Integer, String, Float, DateTime, LargeBinary, Enum as SQLAlchemyEnum, func
 from sqlalchemy.ext.declarative import declarative_base
+from servicekit.database import engine
 
 
-
-DATABASE_HOSTNAME=os.environ.get('DATABASE_HOSTNAME')
-DATABASE_PORT=os.environ.get('DATABASE_PORT')
-DATABASE_NAME=os.environ.get('DATABASE_NAME')
-DATABASE_USERNAME=os.environ.get('DATABASE_USERNAME')
-DATABASE_PASSWORD=os.environ.get('DATABASE_PASSWORD')
-DATABASE_URL=f"postgresql://{DATABASE_USERNAME}:{DATABASE_PASSWORD}@{DATABASE_HOSTNAME}:{DATABASE_PORT}/{DATABASE_NAME}"
-engine = create_engine(DATABASE_URL)
-
 Base = declarative_base()
 
+T = TypeVar("T")
+
 class ActivityStatus(str, Enum):
     AVAILABLE = "available"
     FINISHED = "finished"
@@ -44,7 +38,7 @@ class ActivityDTO(BaseModel):
 class ActivityResponseDTO(BaseModel):
     id: int
     category: str
-    date: str
+    date: datetime
     price: float
     name: str
     total_places: int
@@ -52,18 +46,24 @@ class ActivityResponseDTO(BaseModel):
     status: ActivityStatus
     user_id: int
     username: str
+    version: Optional[int] = None
 
 
     class Config:
         from_attributes = True
 
 
+class Page(BaseModel, Generic[T]):
+    items: List[T]
+    next_cursor: Optional[int] = None
+
+
 class Reservation(Base):
     __tablename__ = "reservations"
 
     id = Column(Integer, primary_key=True)
-    participant_id = Column(Integer)
-    activity_id = Column(Integer)
+    participant_id = Column(Integer, index=True)
+    activity_id = Column(Integer, index=True)
     date = Column(String)
 
 
@@ -72,23 +72,47 @@ class User(Base):
     __tablename__ = "users"
 
     id = Column(Integer, primary_key=True)
-    username = Column(String)
+    username = Column(String, index=True)
     email = Column(String)
     user_type = Column(SQLAlchemyEnum(UserType))
+    # Version of the last applied user event, 0 when the event carried none
+    version = Column(Integer, nullable=False, server_default="0")
 
 
 class Activity(Base):
     __tablename__ = "activities"
+    # Listing filters paired with id so keyset pages come straight off the index
+    __table_args__ = (
+        Index("ix_activities_user_id_id", "user_id", "id"),
+        Index("ix_activities_category_id", "category", "id"),
+        Index("ix_activities_status_id", "status", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer)
     category = Column(String)
-    date = Column(String)
+    date = Column(DateTime(timezone=True), index=True)
     price = Column(Float)
     name = Column(String)
     description = Column(String)
     total_places = Column(Integer)
     status = Column(SQLAlchemyEnum(ActivityStatus), default=ActivityStatus.AVAILABLE)
+    # Bumped by the ORM on every update and sent with the events, replicas use it
+    # to skip stale ones
+    version = Column(Integer, nullable=False, server_default="1")
+
+    __mapper_args__ = {"version_id_col": version}
+
+
+class OutboxEvent(Base):
+    __tablename__ = "outbox_events"
+    # Written in the same transaction as the change it describes, the relay
+    # drains it in id order
+    id = Column(BigInteger, primary_key=True)
+    routing_key = Column(String)
+    payload = Column(LargeBinary)
+    content_type = Column(String, nullable=False, server_default="application/json")
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 
 Base.metadata.create_all(bind=engine)
\ No newline at end of file
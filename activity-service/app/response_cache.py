@@ -0,0 +1,160 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from fastapi import Response
+
+
+class ResponseCacheMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.invalidations = 0
+
+    def increment(self, name, count=1):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + count)
+
+    def snapshot(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "not_modified": self.not_modified,
+                "invalidations": self.invalidations,
+            }
+
+
+class InMemoryBackend:
+    # LRU of (etag, body) entries with an expiry each, plus named counters. A shared
+    # backend has to offer the same get/set/delete/counter/incr calls, thread safe,
+    # since consumer threads invalidate too.
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.counters = {}
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def counter(self, name):
+        with self.lock:
+            return self.counters.get(name, 0)
+
+    def incr(self, name):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+            return self.counters[name]
+
+    def size(self):
+        with self.lock:
+            return len(self.entries)
+
+
+class RedisBackend:
+    # Shares the cache between replicas, so an invalidation by whichever replica
+    # made or consumed the change reaches all of them. Needs the redis package.
+    def __init__(self, url, prefix="activity-service:response-cache:"):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            return None
+        etag, body = value.split(b"\n", 1)
+        return etag.decode(), body
+
+    def set(self, key, value, ttl):
+        etag, body = value
+        self.client.set(self.prefix + key, etag.encode() + b"\n" + body, px=int(ttl * 1000))
+
+    def delete(self, keys):
+        if keys:
+            self.client.delete(*(self.prefix + key for key in keys))
+
+    def counter(self, name):
+        return int(self.client.get(self.prefix + name) or 0)
+
+    def incr(self, name):
+        return self.client.incr(self.prefix + name)
+
+    def size(self):
+        return None
+
+
+class ResponseCache:
+    # Serialized GET responses with their ETag. Listing keys carry a generation
+    # that every activity change bumps, so one increment drops every cached page;
+    # single activities are deleted by id. A response is only stored when no
+    # change happened while it was computed. Listings can be read from a replica
+    # that lags behind the change, ttl bounds how long such a page is served.
+    def __init__(self, backend, ttl=30):
+        self.backend = backend
+        self.ttl = ttl
+        self.metrics = ResponseCacheMetrics()
+
+    def generation(self):
+        return self.backend.counter("generation")
+
+    def listing_key(self, generation, params):
+        return f"activities:{generation}:{params}"
+
+    def activity_key(self, id):
+        return f"activity:{id}"
+
+    def lookup(self, key, request):
+        value = self.backend.get(key)
+        if value is None:
+            self.metrics.increment("misses")
+            return None
+        self.metrics.increment("hits")
+        return self._respond(*value, request)
+
+    def store(self, key, generation, model, request):
+        body = model.model_dump_json().encode()
+        etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        if self.generation() == generation:
+            self.backend.set(key, (etag, body), self.ttl)
+        return self._respond(etag, body, request)
+
+    def invalidate(self, activity_ids):
+        self.backend.incr("generation")
+        self.backend.delete([self.activity_key(id) for id in activity_ids])
+        self.metrics.increment("invalidations")
+
+    def snapshot(self):
+        return {"ttl_seconds": self.ttl, "size": self.backend.size(), "generation": self.generation(), **self.metrics.snapshot()}
+
+    def _respond(self, etag, body, request):
+        if etag in request.headers.get("if-none-match", ""):
+            self.metrics.increment("not_modified")
+            return Response(status_code=304, headers={"ETag": etag})
+        return Response(content=body, media_type="application/json", headers={"ETag": etag})
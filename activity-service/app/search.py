@@ -0,0 +1,136 @@
+import math
+import threading
+import logging
+from collections import Counter, defaultdict
+from fuzzywuzzy import fuzz
+
+logger = logging.getLogger(__name__)
+
+NGRAM_SIZE = 3
+
+
+def ngrams(text, n=NGRAM_SIZE):
+    if len(text) < n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class ActivitySearchIndex:
+    # Inverted n-gram index over activity names and descriptions. It only narrows
+    # the candidate set, the final decision is still fuzz.partial_ratio >= threshold.
+    # Each process keeps its own copy, refresh() brings in the writes of the others.
+    def __init__(self, n=NGRAM_SIZE):
+        self.n = n
+        self.postings = defaultdict(set)
+        self.documents = {}
+        # Documents by the length of their shorter non-empty field
+        self.lengths = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def build(self, activities):
+        with self.lock:
+            self.postings.clear()
+            self.documents.clear()
+            self.lengths.clear()
+            for activity in activities:
+                self._add(activity.id, activity.name, activity.description)
+        logger.info("Search index built with %s activities", len(self.documents))
+
+    def add(self, activity):
+        with self.lock:
+            self._remove(activity.id)
+            self._add(activity.id, activity.name, activity.description)
+
+    def remove(self, activity_id):
+        with self.lock:
+            self._remove(activity_id)
+
+    def refresh(self, ids, activities):
+        # activities are the rows of ids still in the table, the others are removed
+        with self.lock:
+            for id in ids:
+                self._remove(id)
+            for activity in activities:
+                self._add(activity.id, activity.name, activity.description)
+
+    def search(self, text, similarity_threshold):
+        text = text.lower()
+        with self.lock:
+            candidates = self._candidates(text, similarity_threshold)
+            documents = [(id, self.documents[id]) for id in candidates]
+        results = []
+        for id, (name, description) in documents:
+            score = max(fuzz.partial_ratio(text, name), fuzz.partial_ratio(text, description))
+            if score >= similarity_threshold:
+                results.append((id, score))
+        results.sort(key=lambda x: (-x[1], x[0]))
+        return results
+
+    def score(self, text, id):
+        with self.lock:
+            document = self.documents.get(id)
+        if document is None:
+            return 0
+        name, description = document
+        text = text.lower()
+        return max(fuzz.partial_ratio(text, name), fuzz.partial_ratio(text, description))
+
+    def _candidates(self, text, similarity_threshold):
+        if len(text) < self.n:
+            return list(self.documents)
+        # partial_ratio compares the shorter string s of the query and a field with
+        # windows of the longer one, as 2 * M / (len(s) + len(window)) where M
+        # characters match in runs. The score is rounded, so passing the threshold
+        # takes a ratio of at least t. The unmatched characters of both are at most
+        # 2 * M * (1 - t) / t, the runs at most one more, and each run loses n - 1 of
+        # its n-grams. Counting every position of the query whose n-gram the document
+        # has, a match shares at least M * (t * (2n - 1) - 2(n - 1)) / t - (n - 1)
+        # of them, and M is at least len(s) * t / (2 - t).
+        t = (similarity_threshold - 0.5) / 100
+        per_char = (t * (2 * self.n - 1) - 2 * (self.n - 1)) / (2 - t)
+        if per_char <= 0:
+            return list(self.documents)
+
+        def min_shared(length):
+            return math.ceil(min(len(text), length) * per_char - (self.n - 1) - 1e-9)
+
+        grams = Counter(text[i:i + self.n] for i in range(len(text) - self.n + 1))
+        counts = Counter()
+        for gram, occurrences in grams.items():
+            for id in self.postings.get(gram, ()):
+                counts[id] += occurrences
+        # Documents with a field too short to share any n-gram may share none
+        candidates = {
+            id for length, ids in self.lengths.items() if min_shared(length) <= 0 for id in ids
+        }
+        candidates.update(id for id, count in counts.items() if count >= min_shared(self._length(id)))
+        return list(candidates)
+
+    def _add(self, id, name, description):
+        name = (name or "").lower()
+        description = (description or "").lower()
+        self.documents[id] = (name, description)
+        self.lengths[self._length(id)].add(id)
+        for gram in ngrams(name, self.n) | ngrams(description, self.n):
+            self.postings[gram].add(id)
+
+    def _remove(self, id):
+        if id not in self.documents:
+            return
+        length = self._length(id)
+        self.lengths[length].discard(id)
+        if not self.lengths[length]:
+            del self.lengths[length]
+        document = self.documents.pop(id)
+        name, description = document
+        for gram in ngrams(name, self.n) | ngrams(description, self.n):
+            ids = self.postings.get(gram)
+            if ids is not None:
+                ids.discard(id)
+                if not ids:
+                    del self.postings[gram]
+
+    def _length(self, id):
+        # Empty fields score 0, documents with only empty fields never match
+        lengths = [len(field) for field in self.documents[id] if field]
+        return min(lengths) if lengths else math.inf
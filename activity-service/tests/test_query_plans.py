@@ -0,0 +1,38 @@
+from datetime import datetime, timezone
+import pytest
+from sqlalchemy import text
+
+
+@pytest.mark.parametrize("url, params, index", [
+    ("/activities", {}, None),
+    ("/activities", {"user_id": 1}, "ix_activities_user_id_id"),
+    ("/activities", {"username": "organizer1"}, "ix_users_username"),
+    ("/activities", {"category": ["sport"]}, "ix_activities_category_id"),
+    ("/activities", {"category": ["sport", "music"]}, None),
+    ("/activities", {"status": "available"}, "ix_activities_status_id"),
+    ("/activities", {"user_id": 1, "cursor": 10}, "ix_activities_user_id_id"),
+    ("/activities", {"stream": True}, None),
+    ("/activities/1", {}, None),
+])
+def test_listing_queries_do_not_scan_tables(main, db, client, query_plans, url, params, index):
+    # Enough organizers, categories and statuses, analyzed, that the planner sees
+    # the filters as selective, as they are in production
+    db.add_all(main.User(id=id, username=f"organizer{id}", email=f"organizer{id}@example.com", user_type=main.UserType.ORGANIZER) for id in range(1, 51))
+    db.add_all(
+        main.Activity(id=id, user_id=id % 50 + 1, category="sport" if id % 25 == 0 else f"category{id % 25}", date=datetime(2026, 5, 1, tzinfo=timezone.utc),
+                      price=10.0, name=f"activity {id}", description="", total_places=10,
+                      status=main.ActivityStatus.AVAILABLE if id % 50 == 1 else main.ActivityStatus.FINISHED)
+        for id in range(1, 1001)
+    )
+    db.commit()
+    db.execute(text("ANALYZE activities, users"))
+    db.commit()
+    # Listings are cached, a hit would not reach the database
+    main.response_cache.invalidate([])
+    plans = query_plans(lambda: client("GET", url, params=params))
+    for statement, plan in plans:
+        assert "Seq Scan" not in plan, f"{statement}\n{plan}"
+    # An id order scan that filters every row is no seq scan either, so the
+    # single column filters must use their own index
+    if index is not None:
+        assert any(f" {index} " in plan for _, plan in plans), "\n\n".join(plan for _, plan in plans)
@@ -0,0 +1,46 @@
+import json
+from datetime import datetime, timezone
+import pytest
+from sqlalchemy import event
+
+
+def add_activities(main, db, count):
+    # Every activity has its own organizer, so the usernames cannot come from a
+    # single user lookup
+    db.add_all(main.User(id=index, username=f"organizer{index}", email=f"organizer{index}@example.com", user_type=main.UserType.ORGANIZER) for index in range(1, count + 1))
+    db.add_all(
+        main.Activity(user_id=index, category="sport", date=datetime(2026, 5, 1, tzinfo=timezone.utc), price=10.0,
+                 name=f"activity {index}", description="", total_places=10, status=main.ActivityStatus.AVAILABLE)
+        for index in range(1, count + 1)
+    )
+    db.commit()
+    # The rows did not come through the endpoints or consumers that invalidate it
+    main.response_cache.invalidate([])
+
+
+def statements_for(main, send):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(main.async_engine.sync_engine, "before_cursor_execute", record)
+    try:
+        response = send()
+    finally:
+        event.remove(main.async_engine.sync_engine, "before_cursor_execute", record)
+    assert response.status_code == 200
+    return response, statements
+
+
+@pytest.mark.parametrize("params", [{"limit": 100}, {"limit": 100, "stream": True}], ids=["page", "stream"])
+def test_listing_runs_the_same_statements_for_any_number_of_organizers(main, db, client, params):
+    counts = {}
+    for organizers in (1, 50):
+        db.execute(main.Activity.__table__.delete())
+        db.execute(main.User.__table__.delete())
+        add_activities(main, db, organizers)
+        response, statements = statements_for(main, lambda: client("GET", "/activities", params=params))
+        items = [json.loads(line) for line in response.text.splitlines()] if params.get("stream") else response.json()["items"]
+        assert [item["username"] for item in items] == [f"organizer{index}" for index in range(1, organizers + 1)]
+        counts[organizers] = len(statements)
+    assert counts[1] == counts[50]
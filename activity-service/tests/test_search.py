@@ -0,0 +1,78 @@
+import random
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from fuzzywuzzy import fuzz
+
+WORDS = ["chess", "bike", "tour", "bake", "yoga", "run", "swim", "art", "go", "a", "city", "night", "trail", "cook"]
+
+
+def random_text(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def misspell(rng, text):
+    # Drops, repeats or replaces a few characters
+    text = list(text)
+    for _ in range(rng.randint(0, 3)):
+        if not text:
+            break
+        i = rng.randrange(len(text))
+        text[i:i + 1] = rng.choice([[], [text[i]] * 2, [rng.choice("abcdefghijklmnopqrstuvwxyz ")]])
+    return "".join(text)
+
+
+def full_scan(activities, text, similarity_threshold):
+    text = text.lower()
+    results = []
+    for activity in activities:
+        score = max(fuzz.partial_ratio(text, (activity.name or "").lower()), fuzz.partial_ratio(text, (activity.description or "").lower()))
+        if score >= similarity_threshold:
+            results.append((activity.id, score))
+    return sorted(results, key=lambda x: (-x[1], x[0]))
+
+
+def test_index_finds_what_a_full_scan_finds(main):
+    from search import ActivitySearchIndex
+    rng = random.Random(2)
+    # Names of one word are shorter than most queries, a match may share no n-gram with them
+    activities = [
+        SimpleNamespace(id=id, name=random_text(rng, rng.randint(1, 3)), description=rng.choice(["", None, random_text(rng, rng.randint(2, 12))]))
+        for id in range(1, 151)
+    ]
+    index = ActivitySearchIndex()
+    index.build(activities)
+
+    for _ in range(200):
+        activity = rng.choice(activities)
+        source = rng.choice([activity.name, activity.description or activity.name, random_text(rng, rng.randint(1, 4))])
+        start = rng.randrange(len(source))
+        text = misspell(rng, source[start:start + rng.randint(3, 30)])
+        similarity_threshold = rng.randint(50, 100)
+        assert index.search(text, similarity_threshold) == full_scan(activities, text, similarity_threshold), (text, similarity_threshold)
+
+
+def test_index_follows_activity_events_of_other_replicas(main, db):
+    main.search_index.build([])
+    db.add(main.User(id=1, username="organizer", email="organizer@example.com", user_type=main.UserType.ORGANIZER, version=1))
+    db.add(main.Activity(
+        id=1, user_id=1, category="sport", date=datetime(2026, 5, 1, 10, tzinfo=timezone.utc), price=10.0,
+        name="Chess night", description="", total_places=10, status=main.ActivityStatus.AVAILABLE, version=1
+    ))
+    db.commit()
+    event = {"id": 1, "name": "Chess night", "version": 1}
+
+    # Another replica created it, the event names it but the row is what is indexed
+    main.index_activity_events([("created", event)])
+    assert [id for id, _ in main.search_index.search("chess", 90)] == [1]
+
+    db.query(main.Activity).filter(main.Activity.id == 1).update({"name": "Bike tour", "version": 2})
+    db.commit()
+    # An older event arriving late does not bring the old name back
+    main.index_activity_events([("updated", event)])
+    assert main.search_index.search("chess", 90) == []
+    assert [id for id, _ in main.search_index.search("bike", 90)] == [1]
+
+    db.query(main.Activity).delete()
+    db.commit()
+    main.index_activity_events([("deleted", dict(event, version=3))])
+    assert main.search_index.search("bike", 90) == []
@@ -0,0 +1,61 @@
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import text
+from common import load_service, report, run
+
+# Date-range listings of activity-service on a seeded activities table, with the
+# index on activities.date and again without it.
+#   ROWS      activities to seed, one a minute from 2026-01-01 (1000000)
+#   REQUESTS  listings per window and case (50)
+ROWS = int(os.environ.get("ROWS", 1000000))
+REQUESTS = int(os.environ.get("REQUESTS", 50))
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+WINDOWS = [("1 hour", timedelta(hours=1)), ("1 day", timedelta(days=1)), ("1 week", timedelta(weeks=1))]
+
+main = load_service("activity")
+from servicekit.database import engine
+
+
+def seed():
+    with engine.begin() as db:
+        db.execute(text("TRUNCATE activities, users RESTART IDENTITY"))
+        db.execute(text("INSERT INTO users (id, username, email, user_type) VALUES (1, 'organizer', 'organizer@example.com', 'ORGANIZER')"))
+        db.execute(text(
+            "INSERT INTO activities (user_id, category, date, price, name, description, total_places, status) "
+            "SELECT 1, 'sport', :start + g * interval '1 minute', 10, 'activity ' || g, '', 10, 'AVAILABLE' "
+            "FROM generate_series(0, :rows - 1) g"
+        ), {"start": START, "rows": ROWS})
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as db:
+        db.execute(text("VACUUM ANALYZE activities"))
+
+
+async def listings(client):
+    # Entries of the previous case would answer the same windows
+    main.response_cache.invalidate([])
+    span = timedelta(minutes=ROWS) - max(window for _, window in WINDOWS)
+    for label, window in WINDOWS:
+        seconds = []
+        for request in range(REQUESTS):
+            # A different window every time, so the response cache does not answer
+            from_date = START + span * request / REQUESTS
+            params = {"from_date": from_date.isoformat(), "to_date": (from_date + window).isoformat(), "limit": 50}
+            started_at = time.perf_counter()
+            response = await client.get("/activities", params=params)
+            seconds.append(time.perf_counter() - started_at)
+            assert response.status_code == 200, response.text
+        report(f"{label} window", seconds)
+
+
+print(f"seeding {ROWS} activities")
+seed()
+print("with ix_activities_date")
+run(main, listings)
+with engine.begin() as db:
+    db.execute(text("DROP INDEX ix_activities_date"))
+try:
+    print("without ix_activities_date")
+    run(main, listings)
+finally:
+    with engine.begin() as db:
+        db.execute(text("CREATE INDEX ix_activities_date ON activities (date)"))
@@ -0,0 +1,28 @@
+import os
+import timeit
+from datetime import datetime, timezone
+from messaging import ACTIVITY_EVENT, JSON, MSGPACK, RESERVATION_EVENT, USER_EVENT
+
+# Bytes per event and encode and decode cost of the event schemas in JSON and msgpack.
+# Needs only the messaging package.
+#   ROUNDS  encodes and decodes timed per case (50000)
+ROUNDS = int(os.environ.get("ROUNDS", 50000))
+
+activity = {
+    "id": 123456, "user_id": 4242, "category": "hiking", "date": datetime(2026, 5, 1, 10, tzinfo=timezone.utc),
+    "price": 1499.99, "name": "Sunrise hike on Fruska Gora", "total_places": 25, "status": "available",
+    "username": "organizer_42", "version": 7, "reserved": 3,
+}
+cases = [
+    ("user", USER_EVENT, {"id": 4242, "username": "organizer_42", "email": "organizer_42@example.com", "user_type": "organizer", "version": 3}),
+    ("activity, 40 char description", ACTIVITY_EVENT, dict(activity, description="x" * 40)),
+    ("activity, 500 char description", ACTIVITY_EVENT, dict(activity, description="x" * 500)),
+    ("reservation", RESERVATION_EVENT, {"id": 99, "participant_id": 7, "activity_id": 123456, "date": "2026-10-18T08:06:24", "participant_username": "ana"}),
+]
+
+for label, schema, event in cases:
+    for content_type in (JSON, MSGPACK):
+        body, _ = schema.encode(event, content_type)
+        encode = timeit.timeit(lambda: schema.encode(event, content_type), number=ROUNDS) / ROUNDS
+        decode = timeit.timeit(lambda: schema.decode(body, content_type), number=ROUNDS) / ROUNDS
+        print(f"{label:32} {content_type:22} {len(body):5d} bytes  encode {encode * 1e6:6.2f} us  decode {decode * 1e6:6.2f} us")
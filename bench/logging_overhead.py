@@ -0,0 +1,62 @@
+import os
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from sqlalchemy import text
+from common import load_service, report, run, run_cases
+
+# Cost of logging on reservation-service's hot paths, POST /reservations/ and the
+# user event callback, with logging off, at the default INFO level with sampled
+# per-message logs, and at DEBUG with every message logged. Logs go to stderr,
+# redirect it so the terminal does not slow the listener thread down.
+#   REQUESTS  bookings per case, one after the other (1000)
+#   MESSAGES  user events handled one at a time per case (1000)
+REQUESTS = int(os.environ.get("REQUESTS", 1000))
+MESSAGES = int(os.environ.get("MESSAGES", 1000))
+
+if run_cases({
+    "logging off": {"LOG_LEVEL": "CRITICAL"},
+    "INFO, sampled": {"LOG_LEVEL": "INFO"},
+    "DEBUG, every message": {"LOG_LEVEL": "DEBUG", "LOG_SAMPLE_EVERY": "1"},
+}) is None:
+    raise SystemExit
+
+main = load_service("reservation")
+from servicekit.database import engine
+
+
+def user(id):
+    return {"id": id, "username": f"participant{id}", "email": f"participant{id}@example.com", "user_type": "participant", "version": 1}
+
+
+with engine.begin() as db:
+    db.execute(text("TRUNCATE reservations, reservation_views, activity_seats, activities, users, outbox_events"))
+main.apply_user_events([("created", {**user(1), "username": "organizer", "user_type": "organizer"})] + [("created", user(id)) for id in range(2, REQUESTS + 2)])
+main.apply_activity_events([("created", {
+    "id": 1, "user_id": 1, "category": "sport", "date": datetime(2026, 5, 1, 10, tzinfo=timezone.utc), "price": 10.0,
+    "name": "activity", "description": "", "total_places": REQUESTS, "status": "available", "username": "organizer", "version": 1, "reserved": 0,
+})])
+
+
+async def bookings(client):
+    seconds = []
+    started_at = time.process_time()
+    for id in range(2, REQUESTS + 2):
+        request_started_at = time.perf_counter()
+        response = await client.post("/reservations/", json={"participant_username": f"participant{id}", "activity_id": 1})
+        seconds.append(time.perf_counter() - request_started_at)
+        assert response.status_code == 200, response.text
+    return seconds, time.process_time() - started_at
+
+
+seconds, cpu = run(main, bookings, lifespan=True)
+report("POST /reservations/", seconds)
+print(f"{'POST /reservations/ cpu time':40} {cpu / REQUESTS * 1000:8.2f} ms per request")
+
+method = SimpleNamespace(exchange="user", routing_key="updated", delivery_tag=1, redelivered=False)
+seconds = []
+for index in range(MESSAGES):
+    started_at = time.perf_counter()
+    main.user_callback(None, method, None, {**user(index % REQUESTS + 2), "version": index + 2})
+    seconds.append(time.perf_counter() - started_at)
+report("user_callback", seconds)
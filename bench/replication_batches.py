@@ -0,0 +1,46 @@
+import os
+import time
+from sqlalchemy import text
+from common import load_service
+
+# Replays user events into reservation-service's replicated users table one
+# message per transaction, as user_callback applies them, and in batches, as the
+# batching consumer does.
+#   EVENTS              events to replay, creates of EVENTS / 2 users then an update of each (100000)
+#   BATCH_SIZE          events per batch (100, RABBITMQ_BATCH_SIZE in the services)
+#   PER_MESSAGE_EVENTS  events replayed one at a time, the rate is extrapolated to EVENTS (10000)
+EVENTS = int(os.environ.get("EVENTS", 100000))
+BATCH_SIZE = int(os.environ.get("BATCH_SIZE", 100))
+PER_MESSAGE_EVENTS = min(int(os.environ.get("PER_MESSAGE_EVENTS", 10000)), EVENTS)
+
+main = load_service("reservation")
+from servicekit.database import engine
+
+users = EVENTS // 2
+events = [
+    ("created" if index < users else "updated", {"id": index % users + 1, "username": f"user{index}", "email": f"user{index}@example.com", "user_type": "participant", "version": index // users + 1})
+    for index in range(EVENTS)
+]
+
+
+def empty():
+    with engine.begin() as db:
+        db.execute(text("TRUNCATE users, reservation_views"))
+
+
+def replay(batch_size, count):
+    empty()
+    started_at = time.perf_counter()
+    for start in range(0, count, batch_size):
+        main.apply_user_events(events[start:min(start + batch_size, count)])
+    seconds = time.perf_counter() - started_at
+    with engine.connect() as db:
+        assert db.scalar(text("SELECT count(*) FROM users")) == min(count, users)
+    return count / seconds
+
+
+per_message = replay(1, PER_MESSAGE_EVENTS)
+print(f"{'one message per transaction':32} {per_message:10.0f} events/s  {EVENTS / per_message:8.1f} s for {EVENTS} events" + (" (extrapolated)" if PER_MESSAGE_EVENTS < EVENTS else ""))
+batched = replay(BATCH_SIZE, EVENTS)
+print(f"{f'batches of {BATCH_SIZE}':32} {batched:10.0f} events/s  {EVENTS / batched:8.1f} s for {EVENTS} events")
+print(f"speedup {batched / per_message:.1f}x")
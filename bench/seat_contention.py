@@ -0,0 +1,50 @@
+import asyncio
+import os
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from sqlalchemy import text
+from common import load_service, run
+
+# Parallel bookings of one activity through reservation-service's POST /reservations/,
+# checking that no more places are sold than there are.
+#   PLACES    places of the activity (100)
+#   BOOKINGS  bookings sent at once, each by another participant (500)
+# The app runs with its lifespan, set RABBITMQ_* to a broker to have the outbox
+# relayed, without one the events stay in the outbox table.
+PLACES = int(os.environ.get("PLACES", 100))
+BOOKINGS = int(os.environ.get("BOOKINGS", 500))
+
+main = load_service("reservation")
+from servicekit.database import engine
+
+with engine.begin() as db:
+    db.execute(text("TRUNCATE reservations, reservation_views, activity_seats, activities, users, outbox_events"))
+main.apply_user_events(
+    [("created", {"id": 1, "username": "organizer", "email": "organizer@example.com", "user_type": "organizer", "version": 1})]
+    + [("created", {"id": id, "username": f"participant{id}", "email": f"participant{id}@example.com", "user_type": "participant", "version": 1}) for id in range(2, BOOKINGS + 2)]
+)
+main.apply_activity_events([("created", {
+    "id": 1, "user_id": 1, "category": "sport", "date": datetime(2026, 5, 1, 10, tzinfo=timezone.utc), "price": 10.0,
+    "name": "activity", "description": "", "total_places": PLACES, "status": "available", "username": "organizer", "version": 1, "reserved": 0,
+})])
+
+
+async def bookings(client):
+    started_at = time.perf_counter()
+    responses = await asyncio.gather(*[
+        client.post("/reservations/", json={"participant_username": f"participant{id}", "activity_id": 1})
+        for id in range(2, BOOKINGS + 2)
+    ])
+    return responses, time.perf_counter() - started_at
+
+
+responses, seconds = run(main, bookings, lifespan=True)
+statuses = Counter(response.status_code for response in responses)
+with engine.connect() as db:
+    reserved = db.scalar(text("SELECT count(*) FROM reservations WHERE activity_id = 1"))
+    left = db.scalar(text("SELECT sum(places) FROM activity_seats WHERE activity_id = 1"))
+print(f"{BOOKINGS} bookings for {PLACES} places in {seconds:.2f} s, {BOOKINGS / seconds:.0f} bookings/s")
+print(f"responses {dict(sorted(statuses.items()))}  reservations {reserved}  places left {left}")
+assert statuses[200] == reserved == min(PLACES, BOOKINGS), "places were oversold or lost"
+assert reserved + left == PLACES
@@ -0,0 +1,47 @@
+import os
+import time
+from sqlalchemy import event, text
+from common import load_service, report, run, run_cases
+
+# Database statements and latency of subscription-service's GET /subscriptions/{username},
+# which looks up the participant and every organizer, with the user cache and with
+# entries that expire at once.
+#   ORGANIZERS  subscriptions of the participant, each to another organizer (20)
+#   REQUESTS    requests per case (200)
+ORGANIZERS = int(os.environ.get("ORGANIZERS", 20))
+REQUESTS = int(os.environ.get("REQUESTS", 200))
+
+if run_cases({"user cache": {}, "no user cache": {"USER_CACHE_TTL_SECONDS": "0"}}) is None:
+    raise SystemExit
+
+main = load_service("subscription")
+from servicekit.database import async_engine, engine
+
+with engine.begin() as db:
+    db.execute(text("TRUNCATE subscriptions, users"))
+main.apply_user_events(
+    [("created", {"id": 1, "username": "participant", "email": "participant@example.com", "user_type": "participant", "version": 1})]
+    + [("created", {"id": id, "username": f"organizer{id}", "email": f"organizer{id}@example.com", "user_type": "organizer", "version": 1}) for id in range(2, ORGANIZERS + 2)]
+)
+with engine.begin() as db:
+    db.execute(text("INSERT INTO subscriptions (participant_id, organizer_id, date, active) SELECT 1, g, '2026-05-01T10:00:00', true FROM generate_series(2, :last) g"), {"last": ORGANIZERS + 1})
+
+statements = []
+event.listen(async_engine.sync_engine, "before_cursor_execute", lambda *args: statements.append(1))
+
+
+async def requests(client):
+    seconds = []
+    for _ in range(REQUESTS):
+        started_at = time.perf_counter()
+        response = await client.get("/subscriptions/participant")
+        seconds.append(time.perf_counter() - started_at)
+        assert response.status_code == 200 and len(response.json()) == ORGANIZERS, response.text
+    return seconds
+
+
+seconds = run(main, requests)
+report("GET /subscriptions/participant", seconds)
+print(f"statements per request {len(statements) / REQUESTS:.1f}")
+cache = main.user_cache.snapshot()
+print(f"cache hits {cache['hits']}  misses {cache['misses']}  expirations {cache['expirations']}")
@@ -1,12 +1,10 @@
 import client from './client' // Import your Axios client
+import { getAllPages } from './pages'
 
 const ActivityService = {
   getAll: async (query) => {
     try {
-      const response = await client.get('/activities', {
-        params: query || {} // Use Axios's params option to handle query parameters
-      })
-      const activities = response.data
+      const activities = await getAllPages('/activities', query)
       return activities
     } catch (error) {
       console.error('Get all failed:', error)
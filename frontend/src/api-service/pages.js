@@ -0,0 +1,18 @@
+import client from './client'
+
+// Largest page the list endpoints serve
+const PAGE_SIZE = 500
+
+// Reads every page of a keyset paginated endpoint by following next_cursor
+export const getAllPages = async (url, params) => {
+  const items = []
+  let cursor = null
+  do {
+    const response = await client.get(url, {
+      params: { ...(params || {}), limit: PAGE_SIZE, ...(cursor !== null ? { cursor } : {}) }
+    })
+    items.push(...response.data.items)
+    cursor = response.data.next_cursor ?? null
+  } while (cursor !== null)
+  return items
+}
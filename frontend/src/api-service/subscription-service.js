@@ -1,4 +1,5 @@
 import client from './client' 
+import { getAllPages } from './pages'
 
 const SubscriptionService = {
   getAllSubscriptions: async (username) => {
@@ -15,8 +16,7 @@ const SubscriptionService = {
 
   getAllSubscribers: async (username) => {
     try {
-      const response = await client.get('/subscriptions/subscribers/'+ username)
-      return response.data
+      return await getAllPages('/subscriptions/subscribers/'+ username)
     } catch (error) {
       console.error("Couldn't get subscribers:", error)
       throw error
@@ -0,0 +1,28 @@
+from .codec import JSON, MSGPACK, EventSchema, Field, SchemaError
+from .config import RabbitMQConnectionConfig
+from .connection import RabbitMQConnection
+from .consumer import DEAD_LETTER_EXCHANGE, RabbitMQConsumer, dead_letter_queue, latest_events, message_key
+from .memory import InMemoryBroker
+from .publisher import RabbitMQPublisher
+from .schemas import ACTIVITY_EVENT, RESERVATION_EVENT, SUBSCRIPTION_EVENT, USER_EVENT
+
+__all__ = [
+    "ACTIVITY_EVENT",
+    "DEAD_LETTER_EXCHANGE",
+    "EventSchema",
+    "Field",
+    "InMemoryBroker",
+    "JSON",
+    "MSGPACK",
+    "RESERVATION_EVENT",
+    "RabbitMQConnection",
+    "RabbitMQConnectionConfig",
+    "RabbitMQConsumer",
+    "RabbitMQPublisher",
+    "SUBSCRIPTION_EVENT",
+    "SchemaError",
+    "USER_EVENT",
+    "dead_letter_queue",
+    "latest_events",
+    "message_key",
+]
@@ -0,0 +1,104 @@
+import json
+import os
+from datetime import datetime, timezone
+import msgpack
+
+JSON = "application/json"
+MSGPACK = "application/x-msgpack"
+
+# What producers encode with, consumers read both. Every exchange a Python
+# service publishes to is also consumed by the Go user-service, which only reads
+# JSON, so msgpack is opt-in until all consumers of an exchange understand it.
+DEFAULT_CONTENT_TYPE = os.environ.get('MESSAGE_CONTENT_TYPE', JSON)
+
+REQUIRED = object()
+
+
+class SchemaError(ValueError):
+    pass
+
+
+class Field:
+    def __init__(self, name, kind, default=REQUIRED, nullable=False):
+        self.name = name
+        self.kind = kind
+        self.default = default
+        self.nullable = nullable or default is None
+
+    def check(self, value):
+        if type(value) is self.kind:
+            return value
+        if value is None:
+            if not self.nullable:
+                raise SchemaError(f"{self.name} cannot be null")
+            return None
+        if self.kind is datetime:
+            if isinstance(value, str):
+                # fromisoformat only reads a trailing Z from Python 3.11 on
+                value = datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+            if not isinstance(value, datetime):
+                raise SchemaError(f"{self.name} should be a datetime, got {type(value).__name__}")
+            return value
+        if self.kind is float and isinstance(value, int) and not isinstance(value, bool):
+            return float(value)
+        if not isinstance(value, self.kind) or (self.kind is int and isinstance(value, bool)):
+            raise SchemaError(f"{self.name} should be {self.kind.__name__}, got {type(value).__name__}")
+        return value
+
+
+class EventSchema:
+    # The layout of one event type, shared by its producer and its consumers.
+    # In msgpack an event is the array [version, value, ...] in field order, so
+    # field names are not sent with every message. Fields are only ever appended
+    # and the version bumped: a consumer fills in defaults for fields an older
+    # producer did not send and ignores trailing ones it does not know yet. JSON
+    # events are plain objects, unknown keys are ignored.
+    def __init__(self, name, version, fields):
+        self.name = name
+        self.version = version
+        self.fields = fields
+
+    def encode(self, event, content_type=None):
+        content_type = content_type or DEFAULT_CONTENT_TYPE
+        values = [field.check(event.get(field.name, None if field.default is REQUIRED else field.default)) for field in self.fields]
+        if content_type == MSGPACK:
+            return msgpack.packb([self.version, *map(_utc, values)], datetime=True), content_type
+        if content_type == JSON:
+            event = {field.name: value for field, value in zip(self.fields, values)}
+            return json.dumps(event, default=_isoformat, separators=(',', ':')).encode(), content_type
+        raise SchemaError(f"Unsupported content type {content_type}")
+
+    def decode(self, body, content_type=None):
+        # Messages without a content type come from producers that only spoke JSON
+        if content_type == MSGPACK:
+            version, *values = msgpack.unpackb(body, timestamp=3)
+            if not isinstance(version, int):
+                raise SchemaError(f"{self.name} event has no schema version")
+            event = {field.name: field.check(value) for field, value in zip(self.fields, values)}
+            missing = self.fields[len(values):]
+        elif content_type in (JSON, None):
+            values = json.loads(body)
+            if not isinstance(values, dict):
+                raise SchemaError(f"{self.name} event should be a JSON object")
+            event = {field.name: field.check(values[field.name]) for field in self.fields if field.name in values}
+            missing = [field for field in self.fields if field.name not in values]
+        else:
+            raise SchemaError(f"Unsupported content type {content_type}")
+        for field in missing:
+            if field.default is REQUIRED:
+                raise SchemaError(f"{self.name} event is missing {field.name}")
+            event[field.name] = field.default
+        return event
+
+
+def _utc(value):
+    # msgpack timestamps need an aware datetime, naive ones are taken as UTC
+    if isinstance(value, datetime) and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def _isoformat(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
@@ -0,0 +1,31 @@
+import os
+import pika
+
+
+class RabbitMQConnectionConfig:
+    # A lost connection is retried until the process stops, waiting
+    # backoff_initial seconds at first and doubling up to backoff_max
+    def __init__(self, hostname, port=5672, username="guest", password="guest", heartbeat=60, backoff_initial=0.5, backoff_max=30.0):
+        self.hostname = hostname
+        self.port = int(port) if port else 5672
+        self.username = username
+        self.password = password
+        self.heartbeat = heartbeat
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            os.environ.get('RABBITMQ_HOSTNAME'),
+            os.environ.get('RABBITMQ_PORT'),
+            os.environ.get('RABBITMQ_USERNAME'),
+            os.environ.get('RABBITMQ_PASSWORD'),
+            heartbeat=int(os.environ.get('RABBITMQ_HEARTBEAT', 60)),
+            backoff_initial=float(os.environ.get('RABBITMQ_BACKOFF_INITIAL', 0.5)),
+            backoff_max=float(os.environ.get('RABBITMQ_BACKOFF_MAX', 30)),
+        )
+
+    def parameters(self):
+        credentials = pika.PlainCredentials(self.username, self.password)
+        return pika.ConnectionParameters(host=self.hostname, port=self.port, credentials=credentials, heartbeat=self.heartbeat)
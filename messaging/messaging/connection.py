@@ -0,0 +1,147 @@
+import logging
+import random
+import threading
+import time
+import pika
+from .config import RabbitMQConnectionConfig
+from .metrics import Counters
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionMetrics(Counters):
+    fields = ("connects", "connection_losses", "failed_attempts", "channels_opened")
+
+
+class RabbitMQConnection:
+    # The one broker connection of a process. pika connections are not thread
+    # safe, so a single I/O thread owns it: it opens a channel per publisher and
+    # consumer, delivers messages to the consumers, flushes the publishers and
+    # runs the callbacks other threads hand over with call_soon. When the
+    # connection is lost it reconnects with exponential backoff and every
+    # component sets its channel up again.
+    #
+    # A component has a kind ("publisher" or "consumer") and setup(connection),
+    # poll(), pending(), teardown() and snapshot(), all called on the I/O thread
+    # except snapshot. poll() returns True while it has more work queued.
+    def __init__(self, config: RabbitMQConnectionConfig, connect=None, poll_interval=1.0):
+        self.config = config
+        self.connect = connect or (lambda: pika.BlockingConnection(config.parameters()))
+        self.poll_interval = poll_interval
+        self.components = []
+        self.connection = None
+        self.metrics = ConnectionMetrics()
+        self.stopping = threading.Event()
+        self.deadline = None
+        self.thread = None
+
+    def register(self, component):
+        # Components set up after the connection is open get their channel on the next round
+        self.components.append(component)
+        if self.is_open:
+            self.call_soon(lambda: component.setup(self))
+
+    @property
+    def is_open(self):
+        connection = self.connection
+        return connection is not None and connection.is_open
+
+    def channel(self):
+        channel = self.connection.channel()
+        self.metrics.increment("channels_opened")
+        return channel
+
+    def call_soon(self, callback):
+        # Runs callback on the I/O thread. Returns False when there is no open
+        # connection to run it on.
+        connection = self.connection
+        if connection is None:
+            return False
+        try:
+            connection.add_callback_threadsafe(callback)
+        except pika.exceptions.ConnectionWrongStateError:
+            return False
+        return True
+
+    def wake(self):
+        self.call_soon(lambda: None)
+
+    def start(self):
+        logger.info("Starting RabbitMQ connection thread for %s:%s", self.config.hostname, self.config.port)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def close(self, timeout=10):
+        # Publishers get until the timeout to send what they have queued
+        self.deadline = time.monotonic() + timeout
+        self.stopping.set()
+        self.wake()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        pending = self._pending()
+        if pending:
+            logger.error("RabbitMQ connection closed with %s unsent messages", pending)
+
+    def snapshot(self):
+        return {
+            "host": self.config.hostname,
+            "port": self.config.port,
+            "connected": self.is_open,
+            **self.metrics.counts(),
+            "publishers": [component.snapshot() for component in self.components if component.kind == "publisher"],
+            "consumers": [component.snapshot() for component in self.components if component.kind == "consumer"],
+        }
+
+    def run(self):
+        attempt = 0
+        while not self.stopping.is_set():
+            try:
+                self.connection = self.connect()
+                self.metrics.increment("connects")
+                logger.info("Connected to RabbitMQ at %s:%s", self.config.hostname, self.config.port)
+                attempt = 0
+                for component in self.components:
+                    component.setup(self)
+                self._serve()
+            except Exception as e:
+                if self.connection is None:
+                    self.metrics.increment("failed_attempts")
+                    logger.error("Error connecting to RabbitMQ: %s", e)
+                else:
+                    self.metrics.increment("connection_losses")
+                    logger.error("RabbitMQ connection lost: %s", e)
+            self._disconnect()
+            if not self.stopping.is_set():
+                self.stopping.wait(self._backoff(attempt))
+                attempt += 1
+
+    def _serve(self):
+        while not self._done():
+            busy = False
+            for component in self.components:
+                busy = component.poll() or busy
+            # Returns early when a delivery or a call_soon callback arrives
+            self.connection.process_data_events(time_limit=0 if busy else self.poll_interval)
+
+    def _done(self):
+        if not self.stopping.is_set():
+            return False
+        return not self._pending() or time.monotonic() >= self.deadline
+
+    def _pending(self):
+        return sum(component.pending() for component in self.components)
+
+    def _disconnect(self):
+        connection, self.connection = self.connection, None
+        for component in self.components:
+            component.teardown()
+        if connection is not None and connection.is_open:
+            try:
+                connection.close()
+            except Exception as e:
+                logger.error("Error closing RabbitMQ connection: %s", e)
+
+    def _backoff(self, attempt):
+        delay = min(self.config.backoff_max, self.config.backoff_initial * 2 ** attempt)
+        # Jitter keeps replicas that lost the broker together from reconnecting in step
+        return random.uniform(delay / 2, delay)
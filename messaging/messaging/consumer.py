@@ -0,0 +1,278 @@
+import functools
+import logging
+import queue
+import threading
+import time
+from .connection import RabbitMQConnection
+from .metrics import Counters, Timings
+from .publisher import PUBLISHED_AT_HEADER
+
+logger = logging.getLogger(__name__)
+
+# Messages a named queue gives up on are routed here with the queue name as
+# routing key, into a durable parking queue named <queue>.dead-letter
+DEAD_LETTER_EXCHANGE = "dead-letter"
+
+
+def dead_letter_queue(queue_name):
+    return f"{queue_name}.dead-letter"
+
+
+def latest_events(messages, parse):
+    # Keyed upserts and deletes only need the newest event for each id: the highest
+    # version, a delete on a tie, otherwise the one that arrived last
+    latest = {}
+    for routing_key, body in messages:
+        entity = parse(body)
+        previous = latest.get(entity['id'])
+        if previous is not None:
+            previous_version, version = previous[1].get('version', 0), entity.get('version', 0)
+            if previous_version > version or (previous_version == version and previous[0] == 'deleted'):
+                continue
+            del latest[entity['id']]
+        latest[entity['id']] = (routing_key, entity)
+    return list(latest.values())
+
+
+def published_at(properties):
+    # Seconds since the epoch, None for messages of publishers that do not set the header
+    value = (getattr(properties, "headers", None) or {}).get(PUBLISHED_AT_HEADER)
+    return value / 1000 if isinstance(value, (int, float)) else None
+
+
+def message_key(event):
+    # Events about the same entity go to the same worker so they apply in order
+    return event.get('id') if isinstance(event, dict) else None
+
+
+class ConsumerMetrics(Counters):
+    fields = ("received", "acked", "failed", "retried", "dead_lettered", "batches", "batched", "batch_fallbacks")
+
+    def __init__(self):
+        super().__init__()
+        # Per callback call, a batch counts once
+        self.processing = Timings()
+        # From publish to ack, across hosts this is only as exact as their clocks
+        self.lag = Timings()
+        self.routing_keys = {}
+
+    def record_processed(self, deliveries, seconds):
+        now = time.time()
+        self.processing.record(seconds)
+        sent = [published_at(properties) for _, _, properties, _ in deliveries]
+        self.lag.record(*(max(now - value, 0.0) for value in sent if value is not None))
+        with self.lock:
+            for _, method, _, _ in deliveries:
+                self._routing_key(method.routing_key)["acked"] += 1
+
+    def record_failed(self, routing_key):
+        with self.lock:
+            self._routing_key(routing_key)["failed"] += 1
+
+    def _routing_key(self, routing_key):
+        return self.routing_keys.setdefault(routing_key, {"acked": 0, "failed": 0})
+
+    def record_batch(self, size):
+        with self.lock:
+            self.batches += 1
+            self.batched += size
+            self.acked += size
+
+    def snapshot(self):
+        counts = self.counts()
+        elapsed = self.elapsed()
+        with self.lock:
+            routing_keys = [(routing_key, dict(key_counts)) for routing_key, key_counts in self.routing_keys.items()]
+        return {
+            "received": counts["received"],
+            "acked": counts["acked"],
+            "failed": counts["failed"],
+            "retried": counts["retried"],
+            "dead_lettered": counts["dead_lettered"],
+            "in_flight": counts["received"] - counts["acked"] - counts["failed"],
+            "throughput_per_second": counts["acked"] / elapsed if elapsed > 0 else 0.0,
+            "batches": counts["batches"],
+            "batch_size_avg": counts["batched"] / counts["batches"] if counts["batches"] else 0.0,
+            "batch_fallbacks": counts["batch_fallbacks"],
+            "processing": self.processing.snapshot(),
+            "lag": self.lag.snapshot(),
+            "routing_keys": {
+                routing_key: {**key_counts, "throughput_per_second": key_counts["acked"] / elapsed if elapsed > 0 else 0.0}
+                for routing_key, key_counts in routing_keys
+            },
+        }
+
+
+class RabbitMQConsumer:
+    # With a queue_name the queue is durable and shared by every replica, without one
+    # it is a server-named queue that disappears with the connection. Deliveries are
+    # acked only after the callback returns, so a callback has to raise when its
+    # transaction did not commit. With a batch_callback each worker gathers up to
+    # batch_size messages or waits batch_timeout seconds and applies them together.
+    # With a schema the callbacks get the decoded event instead of the raw body, a
+    # message that does not decode is rejected without being requeued.
+    # A failing callback is retried in its worker up to retries times, waiting
+    # retry_backoff seconds at first and doubling, so later events of the same
+    # entity stay behind it. Messages still failing then, and undecodable ones, are
+    # rejected: a named queue dead-letters them into its parking queue, where they
+    # wait to be inspected and moved back. A server-named queue drops them.
+    # Deliveries still held by the workers when the connection drops cannot be acked
+    # anymore, the broker sends them again once it is back.
+    kind = "consumer"
+
+    def __init__(self, connection: RabbitMQConnection, callback, exchange, routing_keys: list[str], queue_name="", prefetch_count=20, workers=4, key=message_key, batch_callback=None, batch_size=100, batch_timeout=0.05, schema=None, retries=3, retry_backoff=0.5):
+        self.connection = connection
+        self.callback = callback
+        self.exchange = exchange
+        self.routing_keys = routing_keys
+        self.queue_name = queue_name
+        self.prefetch_count = prefetch_count
+        self.key = key
+        self.batch_callback = batch_callback
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.schema = schema
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.channel = None
+        self.worker_queues = [queue.Queue() for _ in range(workers)]
+        self.metrics = ConsumerMetrics()
+        connection.register(self)
+
+    def setup(self, connection):
+        self.channel = connection.channel()
+        self.channel.exchange_declare(exchange=self.exchange, exchange_type='topic', durable=True)
+        if self.queue_name:
+            # RabbitMQ refuses to declare an existing queue with other arguments, a
+            # queue created before dead-lettering has to be deleted once
+            self.channel.exchange_declare(exchange=DEAD_LETTER_EXCHANGE, exchange_type='direct', durable=True)
+            parking = dead_letter_queue(self.queue_name)
+            self.channel.queue_declare(queue=parking, durable=True)
+            self.channel.queue_bind(exchange=DEAD_LETTER_EXCHANGE, queue=parking, routing_key=self.queue_name)
+            result = self.channel.queue_declare(queue=self.queue_name, durable=True, arguments={
+                "x-dead-letter-exchange": DEAD_LETTER_EXCHANGE,
+                "x-dead-letter-routing-key": self.queue_name,
+            })
+        else:
+            result = self.channel.queue_declare(queue="", exclusive=True)
+        queue_name = result.method.queue
+        for routing_key in self.routing_keys:
+            self.channel.queue_bind(exchange=self.exchange, queue=queue_name, routing_key=routing_key)
+        # Caps the unacked deliveries held by the workers
+        self.channel.basic_qos(prefetch_count=self.prefetch_count)
+        self.channel.basic_consume(queue=queue_name, on_message_callback=self.on_message)
+        logger.info("Consuming from exchange:%s", self.exchange)
+
+    def teardown(self):
+        self.channel = None
+
+    def pending(self):
+        return 0
+
+    def poll(self):
+        # A channel the broker closed, after a bad ack for example, is opened again
+        if self.channel is not None and self.channel.is_closed:
+            logger.error("Consumer channel for exchange %s closed, reopening", self.exchange)
+            self.setup(self.connection)
+        return False
+
+    def on_message(self, ch, method, properties, body):
+        self.metrics.increment("received")
+        if self.schema is not None:
+            try:
+                body = self.schema.decode(body, properties.content_type)
+            except Exception as e:
+                logger.error("Rejecting undecodable %s message from exchange %s: %s", self.schema.name, self.exchange, e)
+                self._reject(method)
+                ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+                return
+        worker = hash(self.key(body)) % len(self.worker_queues)
+        self.worker_queues[worker].put((ch, method, properties, body))
+
+    def work(self, worker_queue):
+        while True:
+            batch = self._next_batch(worker_queue)
+            if len(batch) > 1:
+                started_at = time.perf_counter()
+                try:
+                    self.batch_callback([(method.routing_key, body) for _, method, _, body in batch])
+                except Exception as e:
+                    # Retried one by one so a single bad message does not hold back the rest
+                    logger.error("Error applying batch of %s messages from exchange %s: %s", len(batch), self.exchange, e)
+                    self.metrics.increment("batch_fallbacks")
+                else:
+                    self.metrics.record_batch(len(batch))
+                    self.metrics.record_processed(batch, time.perf_counter() - started_at)
+                    self._settle_batch(batch)
+                    continue
+            for delivery in batch:
+                self.handle(*delivery)
+
+    def handle(self, ch, method, properties, body):
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.metrics.increment("retried")
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            started_at = time.perf_counter()
+            try:
+                self.callback(ch, method, properties, body)
+            except Exception as e:
+                logger.error("Error handling message from exchange %s, attempt %s of %s: %s", self.exchange, attempt + 1, self.retries + 1, e)
+            else:
+                self.metrics.increment("acked")
+                self.metrics.record_processed([(ch, method, properties, body)], time.perf_counter() - started_at)
+                self._settle(ch, functools.partial(ch.basic_ack, delivery_tag=method.delivery_tag))
+                return
+        self._reject(method)
+        self._settle(ch, functools.partial(ch.basic_nack, delivery_tag=method.delivery_tag, requeue=False))
+
+    def snapshot(self):
+        return {"exchange": self.exchange, "queue": self.queue_name, "prefetch_count": self.prefetch_count, "workers": len(self.worker_queues), **self.metrics.snapshot()}
+
+    def start_consuming(self):
+        logger.info("Starting consumer workers for exchange:%s", self.exchange)
+        for worker_queue in self.worker_queues:
+            threading.Thread(target=self.work, args=(worker_queue,), daemon=True).start()
+
+    def _next_batch(self, worker_queue):
+        batch = [worker_queue.get()]
+        if self.batch_callback is None:
+            return batch
+        deadline = time.monotonic() + self.batch_timeout
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(worker_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _reject(self, method):
+        self.metrics.increment("failed")
+        self.metrics.record_failed(method.routing_key)
+        if self.queue_name:
+            self.metrics.increment("dead_lettered")
+            logger.error("Dead-lettering %s message from exchange %s into %s", method.routing_key, self.exchange, dead_letter_queue(self.queue_name))
+        else:
+            logger.error("Dropping %s message from exchange %s, its queue has no dead-letter queue", method.routing_key, self.exchange)
+
+    def _settle(self, ch, action):
+        # Channels are not thread safe, the ack runs on the I/O thread. Tags of a
+        # channel that is gone are skipped, acking them on another channel would fail.
+        self.connection.call_soon(lambda: action() if ch.is_open else None)
+
+    def _settle_batch(self, batch):
+        # Each delivery is acked on its own, a multiple ack could cover other workers'
+        # messages. A batch can span a reconnect, so the tags are grouped by channel.
+        tags = {}
+        for ch, method, _, _ in batch:
+            tags.setdefault(ch, []).append(method.delivery_tag)
+        for ch, channel_tags in tags.items():
+            self._settle(ch, functools.partial(self._ack_all, ch, channel_tags))
+
+    @staticmethod
+    def _ack_all(ch, tags):
+        for tag in tags:
+            ch.basic_ack(delivery_tag=tag)
@@ -0,0 +1,272 @@
+import itertools
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+from pika import exceptions
+
+
+def topic_matches(binding_key, routing_key):
+    return _match_words(binding_key.split('.'), routing_key.split('.'))
+
+
+def _match_words(pattern, words):
+    # '*' matches exactly one word and '#' zero or more, as on a RabbitMQ topic exchange
+    if not pattern:
+        return not words
+    if pattern[0] == '#':
+        return any(_match_words(pattern[1:], words[index:]) for index in range(len(words) + 1))
+    return bool(words) and pattern[0] in ('*', words[0]) and _match_words(pattern[1:], words[1:])
+
+
+class InMemoryBroker:
+    # Stand-in for RabbitMQ that runs inside the process, for developing and
+    # checking services without a broker. It covers the part of the pika
+    # BlockingConnection API this package uses: topic exchanges, durable and
+    # exclusive queues, prefetch, acks and nacks, confirms, and dead-lettering of
+    # rejected messages through the x-dead-letter-* queue arguments. Pass
+    # broker.connect as the connect argument of RabbitMQConnection, and
+    # drop_connections() to simulate the broker going away.
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.exchanges = set()
+        self.queues = {}
+        self.bindings = []
+        self.connections = []
+        self.names = itertools.count(1)
+        self.available = True
+
+    def connect(self):
+        with self.condition:
+            if not self.available:
+                raise exceptions.AMQPConnectionError("broker is not available")
+            connection = InMemoryConnection(self)
+            self.connections.append(connection)
+            return connection
+
+    def drop_connections(self, available=True):
+        # Every open connection fails on its next call, like a broker restart
+        with self.condition:
+            self.available = available
+            for connection in self.connections:
+                connection.lost = True
+            self.condition.notify_all()
+
+    def queue_size(self, queue_name):
+        with self.condition:
+            return len(self.queues[queue_name].messages)
+
+    def _route(self, exchange, routing_key, body, properties):
+        if exchange not in self.exchanges:
+            raise exceptions.ChannelClosedByBroker(404, f"NOT_FOUND - no exchange '{exchange}'")
+        self._deliver(exchange, routing_key, body, properties)
+
+    def _dead_letter(self, queue, message):
+        # A rejected message is republished to the queue's dead-letter exchange and
+        # dropped when there is none, as on RabbitMQ
+        exchange = queue.arguments.get("x-dead-letter-exchange")
+        if exchange is not None and exchange in self.exchanges:
+            routing_key = queue.arguments.get("x-dead-letter-routing-key", message.routing_key)
+            self._deliver(exchange, routing_key, message.body, message.properties)
+
+    def _deliver(self, exchange, routing_key, body, properties):
+        queues = {queue_name for bound_exchange, binding_key, queue_name in self.bindings if bound_exchange == exchange and topic_matches(binding_key, routing_key)}
+        for queue_name in queues:
+            self.queues[queue_name].messages.append(SimpleNamespace(exchange=exchange, routing_key=routing_key, body=body, properties=properties, redelivered=False))
+        self.condition.notify_all()
+
+
+class InMemoryQueue:
+    def __init__(self, name, durable, owner, arguments):
+        self.name = name
+        self.durable = durable
+        self.owner = owner
+        self.arguments = arguments
+        self.messages = deque()
+
+
+class InMemoryConnection:
+    def __init__(self, broker):
+        self.broker = broker
+        self.channels = []
+        self.callbacks = deque()
+        self.numbers = itertools.count(1)
+        self.is_open = True
+        self.lost = False
+
+    @property
+    def is_closed(self):
+        return not self.is_open
+
+    def channel(self):
+        self._check()
+        channel = InMemoryChannel(self, next(self.numbers))
+        self.channels.append(channel)
+        return channel
+
+    def add_callback_threadsafe(self, callback):
+        with self.broker.condition:
+            if not self.is_open:
+                raise exceptions.ConnectionWrongStateError("connection is closed")
+            self.callbacks.append(callback)
+            self.broker.condition.notify_all()
+
+    def process_data_events(self, time_limit=0):
+        deadline = time.monotonic() + (time_limit or 0)
+        while True:
+            with self.broker.condition:
+                self._check()
+                callbacks = list(self.callbacks)
+                self.callbacks.clear()
+                deliveries = [delivery for channel in self.channels for delivery in channel._take_deliveries()]
+                if not callbacks and not deliveries:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return
+                    self.broker.condition.wait(remaining)
+                    continue
+            for callback in callbacks:
+                callback()
+            for callback, channel, method, properties, body in deliveries:
+                callback(channel, method, properties, body)
+            return
+
+    def close(self):
+        with self.broker.condition:
+            self._close()
+
+    def _check(self):
+        if self.lost and self.is_open:
+            self._close()
+            raise exceptions.StreamLostError("Stream connection lost")
+        if not self.is_open:
+            raise exceptions.ConnectionWrongStateError("connection is closed")
+
+    def _close(self):
+        for channel in self.channels:
+            channel._close()
+        for name, queue in list(self.broker.queues.items()):
+            if queue.owner is self:
+                del self.broker.queues[name]
+                self.broker.bindings = [binding for binding in self.broker.bindings if binding[2] != name]
+        self.is_open = False
+        if self in self.broker.connections:
+            self.broker.connections.remove(self)
+        self.broker.condition.notify_all()
+
+
+class InMemoryChannel:
+    def __init__(self, connection, channel_number):
+        self.connection = connection
+        self.broker = connection.broker
+        self.channel_number = channel_number
+        self.is_open = True
+        self.prefetch_count = 0
+        self.consumers = []
+        self.unacked = {}
+        self.tags = itertools.count(1)
+        self.confirms = False
+
+    @property
+    def is_closed(self):
+        return not self.is_open
+
+    def exchange_declare(self, exchange, exchange_type='topic', durable=False):
+        with self.broker.condition:
+            self._check()
+            self.broker.exchanges.add(exchange)
+
+    def queue_declare(self, queue, durable=False, exclusive=False, arguments=None):
+        with self.broker.condition:
+            self._check()
+            name = queue or f"amq.gen-{next(self.broker.names)}"
+            existing = self.broker.queues.get(name)
+            if existing is None:
+                self.broker.queues[name] = InMemoryQueue(name, durable, self.connection if exclusive else None, dict(arguments or {}))
+            elif existing.arguments != dict(arguments or {}):
+                self._close()
+                raise exceptions.ChannelClosedByBroker(406, f"PRECONDITION_FAILED - inequivalent arguments for queue '{name}'")
+            return SimpleNamespace(method=SimpleNamespace(queue=name))
+
+    def queue_bind(self, exchange, queue, routing_key=None):
+        with self.broker.condition:
+            self._check()
+            self.broker.bindings.append((exchange, routing_key or queue, queue))
+
+    def basic_qos(self, prefetch_count=0):
+        self.prefetch_count = prefetch_count
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False):
+        with self.broker.condition:
+            self._check()
+            self.consumers.append((queue, on_message_callback))
+            self.broker.condition.notify_all()
+        return f"ctag{self.channel_number}.{len(self.consumers)}"
+
+    def confirm_delivery(self):
+        self.confirms = True
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        with self.broker.condition:
+            self._check()
+            try:
+                self.broker._route(exchange, routing_key, body, properties)
+            except exceptions.ChannelClosedByBroker:
+                self._close()
+                raise
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self._settle(delivery_tag, requeue=False)
+
+    def basic_nack(self, delivery_tag, multiple=False, requeue=True):
+        self._settle(delivery_tag, requeue=requeue, rejected=True)
+
+    def close(self):
+        with self.broker.condition:
+            self._close()
+
+    def _settle(self, delivery_tag, requeue, rejected=False):
+        with self.broker.condition:
+            self._check()
+            if delivery_tag not in self.unacked:
+                # RabbitMQ closes the channel on an unknown delivery tag
+                self._close()
+                raise exceptions.ChannelClosedByBroker(406, f"PRECONDITION_FAILED - unknown delivery tag {delivery_tag}")
+            queue_name, message = self.unacked.pop(delivery_tag)
+            if requeue:
+                self._requeue(queue_name, message)
+            elif rejected and queue_name in self.broker.queues:
+                self.broker._dead_letter(self.broker.queues[queue_name], message)
+            self.broker.condition.notify_all()
+
+    def _check(self):
+        self.connection._check()
+        if not self.is_open:
+            raise exceptions.ChannelWrongStateError("channel is closed")
+
+    def _take_deliveries(self):
+        deliveries = []
+        if not self.is_open:
+            return deliveries
+        for queue_name, callback in self.consumers:
+            queue = self.broker.queues.get(queue_name)
+            while queue is not None and queue.messages and (not self.prefetch_count or len(self.unacked) < self.prefetch_count):
+                message = queue.messages.popleft()
+                tag = next(self.tags)
+                self.unacked[tag] = (queue_name, message)
+                method = SimpleNamespace(delivery_tag=tag, routing_key=message.routing_key, exchange=message.exchange, redelivered=message.redelivered)
+                deliveries.append((callback, self, method, message.properties, message.body))
+        return deliveries
+
+    def _requeue(self, queue_name, message):
+        queue = self.broker.queues.get(queue_name)
+        if queue is not None:
+            message.redelivered = True
+            queue.messages.appendleft(message)
+
+    def _close(self):
+        # Unacked deliveries go back to their queues, as on a real broker
+        for queue_name, message in reversed(list(self.unacked.values())):
+            self._requeue(queue_name, message)
+        self.unacked.clear()
+        self.is_open = False
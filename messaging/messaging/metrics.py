@@ -0,0 +1,63 @@
+import bisect
+import threading
+import time
+
+
+class Counters:
+    # Thread safe counters shared by the connection, publishers and consumers.
+    # Subclasses list their counter names in fields.
+    fields = ()
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.monotonic()
+        for name in self.fields:
+            setattr(self, name, 0)
+
+    def increment(self, name, count=1):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + count)
+
+    def counts(self):
+        with self.lock:
+            return {name: getattr(self, name) for name in self.fields}
+
+    def elapsed(self):
+        return time.monotonic() - self.started_at
+
+
+class Timings:
+    # Thread safe count, sum, max and last of durations in seconds, with counts per
+    # bucket so they can be exported as a histogram
+    def __init__(self, buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = None
+
+    def record(self, *seconds):
+        if not seconds:
+            return
+        with self.lock:
+            for value in seconds:
+                self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += len(seconds)
+            self.total += sum(seconds)
+            self.max = max(self.max, *seconds)
+            self.last = seconds[-1]
+
+    def histogram(self):
+        with self.lock:
+            return list(self.bucket_counts), self.total
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "count": self.count,
+                "avg_ms": self.total / self.count * 1000 if self.count else 0.0,
+                "max_ms": self.max * 1000,
+                "last_ms": self.last * 1000 if self.last is not None else None,
+            }
@@ -0,0 +1,145 @@
+import logging
+import queue
+import time
+from concurrent.futures import Future
+import pika
+from .codec import JSON
+from .connection import RabbitMQConnection
+from .metrics import Counters
+
+logger = logging.getLogger(__name__)
+
+# Milliseconds since the epoch when the message was handed to the publisher,
+# consumers measure their lag from it
+PUBLISHED_AT_HEADER = "published_at"
+
+
+class PublisherMetrics(Counters):
+    fields = ("enqueued", "published", "dropped", "failed", "polls")
+
+    def __init__(self):
+        super().__init__()
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+
+    def record_poll(self, queue_waits):
+        with self.lock:
+            self.polls += 1
+            self.published += len(queue_waits)
+            self.queue_wait_total += sum(queue_waits)
+            self.queue_wait_max = max([self.queue_wait_max, *queue_waits])
+
+    def snapshot(self):
+        counts = self.counts()
+        with self.lock:
+            return {
+                **counts,
+                "messages_per_poll_avg": counts["published"] / counts["polls"] if counts["polls"] else 0.0,
+                "queue_wait_avg_ms": self.queue_wait_total / counts["published"] * 1000 if counts["published"] else 0.0,
+                "queue_wait_max_ms": self.queue_wait_max * 1000,
+            }
+
+
+class RabbitMQPublisher:
+    # publish() only puts the message on a bounded queue, the connection's I/O
+    # thread sends it on this publisher's channel with publisher confirms. The
+    # returned future resolves once the broker confirms the message and fails when
+    # it is nacked or the connection drops before the confirm, callers that need
+    # the message delivered send it again.
+    # pika's BlockingChannel waits for each confirm before the next publish, so
+    # sending costs a broker round trip per message. A poll sends at most
+    # max_per_poll of them, then the I/O thread serves the other components.
+    kind = "publisher"
+
+    def __init__(self, connection: RabbitMQConnection, exchange, max_queue_size=10000, max_per_poll=100):
+        self.connection = connection
+        self.exchange = exchange
+        self.channel = None
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.max_queue_size = max_queue_size
+        self.max_per_poll = max_per_poll
+        self.metrics = PublisherMetrics()
+        connection.register(self)
+
+    def publish(self, message, routing_key, content_type=JSON):
+        future = Future()
+        try:
+            self.queue.put_nowait((message, routing_key, content_type, time.monotonic(), int(time.time() * 1000), future))
+        except queue.Full as e:
+            self.metrics.increment("dropped")
+            logger.error("Publish queue for exchange %s is full, dropping %s message", self.exchange, routing_key)
+            future.set_exception(e)
+            return future
+        self.metrics.increment("enqueued")
+        self.connection.wake()
+        return future
+
+    def snapshot(self):
+        return {"exchange": self.exchange, "queued": self.queue.qsize(), "max_queue_size": self.max_queue_size, **self.metrics.snapshot()}
+
+    def setup(self, connection):
+        # Declares the exchange and enables confirms once per channel instead of per message
+        self.channel = connection.channel()
+        self.channel.exchange_declare(exchange=self.exchange, exchange_type='topic', durable=True)
+        self.channel.confirm_delivery()
+
+    def teardown(self):
+        self.channel = None
+
+    def pending(self):
+        return self.queue.qsize()
+
+    def poll(self):
+        if self.channel is None or self.channel.is_closed:
+            self.setup(self.connection)
+        messages = self._take()
+        if messages:
+            self._publish_each(messages)
+        return not self.queue.empty()
+
+    def _take(self):
+        messages = []
+        while len(messages) < self.max_per_poll:
+            try:
+                messages.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return messages
+
+    def _publish_each(self, messages):
+        queue_waits = []
+        try:
+            for index, (message, routing_key, content_type, enqueued_at, published_at, future) in enumerate(messages):
+                try:
+                    # Returns once the broker confirms the message
+                    self.channel.basic_publish(
+                        exchange=self.exchange,
+                        routing_key=routing_key,
+                        body=message,
+                        properties=pika.BasicProperties(
+                            content_type=content_type,
+                            delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE,
+                            headers={PUBLISHED_AT_HEADER: published_at}
+                        )
+                    )
+                except pika.exceptions.NackError as e:
+                    self.metrics.increment("failed")
+                    logger.error("Broker nacked message for exchange %s: %s", self.exchange, e)
+                    future.set_exception(e)
+                    continue
+                queue_waits.append(time.monotonic() - enqueued_at)
+                future.set_result(None)
+        except Exception as e:
+            # The unconfirmed rest of the messages fails, a lost channel is reopened on the
+            # next poll and a lost connection is handled by the connection
+            unconfirmed = messages[index:]
+            self.metrics.increment("failed", len(unconfirmed))
+            logger.error("Failed to publish %s messages to exchange %s: %s", len(unconfirmed), self.exchange, e)
+            for *_, future in unconfirmed:
+                future.set_exception(e)
+            if not isinstance(e, pika.exceptions.AMQPChannelError):
+                raise
+        finally:
+            if queue_waits:
+                self.metrics.record_poll(queue_waits)
+                logger.debug("Sent %s messages to exchange %s", len(queue_waits), self.exchange)
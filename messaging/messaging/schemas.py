@@ -0,0 +1,47 @@
+from datetime import datetime
+from .codec import EventSchema, Field
+
+# Published by user-service (Go) as JSON, version is not sent yet
+USER_EVENT = EventSchema("user", 1, [
+    Field("id", int),
+    Field("username", str),
+    Field("email", str),
+    Field("user_type", str),
+    Field("version", int, default=0),
+])
+
+# reserved (version 2) is how many reservations total_places already accounts for,
+# None from producers that do not send it
+ACTIVITY_EVENT = EventSchema("activity", 2, [
+    Field("id", int),
+    Field("user_id", int),
+    Field("category", str),
+    Field("date", datetime),
+    Field("price", float),
+    Field("name", str),
+    Field("description", str, default=None),
+    Field("total_places", int),
+    Field("status", str),
+    Field("username", str, default=None),
+    Field("version", int, default=0),
+    Field("reserved", int, default=None),
+])
+
+RESERVATION_EVENT = EventSchema("reservation", 1, [
+    Field("id", int),
+    Field("participant_id", int),
+    Field("activity_id", int),
+    Field("date", str, default=None),
+    Field("participant_username", str, default=None),
+    Field("activity_name", str, default=None),
+    Field("category", str, default=None),
+    Field("price", float, default=None),
+    Field("organizer", str, default=None),
+])
+
+SUBSCRIPTION_EVENT = EventSchema("subscription", 1, [
+    Field("id", int),
+    Field("participant_id", int),
+    Field("organizer_id", int),
+    Field("date", str),
+])
@@ -0,0 +1,39 @@
+import time
+import pytest
+from messaging import InMemoryBroker, RabbitMQConnection, RabbitMQConnectionConfig
+
+# Everything runs against InMemoryBroker, no RabbitMQ is needed. Backoffs and poll
+# intervals are short so a lost connection is back within a fraction of a second.
+
+
+@pytest.fixture
+def broker():
+    return InMemoryBroker()
+
+
+@pytest.fixture
+def connect(broker):
+    # Opens RabbitMQConnections to the broker, closed again after the test
+    connections = []
+
+    def open_connection():
+        config = RabbitMQConnectionConfig("memory", backoff_initial=0.02, backoff_max=0.1)
+        connection = RabbitMQConnection(config, connect=broker.connect, poll_interval=0.05)
+        connections.append(connection)
+        return connection
+    yield open_connection
+    for connection in connections:
+        connection.close(timeout=1)
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() >= deadline:
+            raise AssertionError("timed out waiting for the broker")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def wait():
+    return wait_until
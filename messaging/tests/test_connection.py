@@ -0,0 +1,96 @@
+import json
+import threading
+from messaging import RabbitMQConnection, RabbitMQConnectionConfig, RabbitMQConsumer, RabbitMQPublisher
+
+
+def test_publishers_and_consumers_share_one_connection(broker, connect, wait):
+    connection = connect()
+    RabbitMQPublisher(connection, "activity")
+    consumers = [RabbitMQConsumer(connection, None, exchange, ["#"], f"svc.{exchange}") for exchange in ("user", "reservation")]
+    connection.start()
+
+    wait(lambda: all(consumer.channel is not None for consumer in consumers))
+    assert len(broker.connections) == 1
+    assert connection.metrics.counts()["channels_opened"] == 3
+
+
+def test_unacked_delivery_is_redelivered_after_reconnect(broker, connect, wait):
+    deliveries = []
+    release = threading.Event()
+
+    def callback(ch, method, properties, body):
+        deliveries.append(method.redelivered)
+        # The first delivery is still being handled when the broker goes away,
+        # its ack has no channel left to go to
+        if len(deliveries) == 1:
+            release.wait(5)
+    connection = connect()
+    consumer = RabbitMQConsumer(connection, callback, "activity", ["#"], "svc.activity", workers=1)
+    publisher = RabbitMQPublisher(connection, "activity")
+    consumer.start_consuming()
+    connection.start()
+    wait(lambda: consumer.channel is not None and consumer.channel.consumers)
+    publisher.publish(json.dumps({"id": 1}), "created").result(timeout=5)
+    wait(lambda: deliveries)
+
+    broker.drop_connections()
+    wait(lambda: connection.metrics.counts()["connects"] == 2 and connection.is_open)
+    release.set()
+
+    wait(lambda: len(deliveries) == 2)
+    assert deliveries == [False, True]
+    wait(lambda: consumer.channel.consumers and not consumer.channel.unacked)
+    assert broker.queue_size("svc.activity") == 0
+    assert connection.metrics.counts()["connection_losses"] == 1
+
+
+def test_publisher_holds_messages_until_the_broker_is_back(broker, connect, wait):
+    received = []
+    connection = connect()
+    consumer = RabbitMQConsumer(connection, lambda ch, method, properties, body: received.append(json.loads(body)["id"]), "activity", ["#"], "svc.activity", workers=1)
+    publisher = RabbitMQPublisher(connection, "activity")
+    consumer.start_consuming()
+    connection.start()
+    wait(lambda: consumer.channel is not None and consumer.channel.consumers)
+
+    broker.drop_connections(available=False)
+    wait(lambda: connection.metrics.counts()["failed_attempts"] >= 2)
+    futures = [publisher.publish(json.dumps({"id": id}), "created") for id in range(3)]
+    assert not any(future.done() for future in futures)
+    assert publisher.snapshot()["queued"] == 3
+
+    broker.drop_connections(available=True)
+    for future in futures:
+        future.result(timeout=5)
+    wait(lambda: len(received) == 3)
+    assert received == [0, 1, 2]
+
+
+def test_publisher_sends_at_most_max_per_poll_messages_a_poll(broker, connect, wait):
+    received = []
+    connection = connect()
+    consumer = RabbitMQConsumer(connection, lambda ch, method, properties, body: received.append(json.loads(body)["id"]), "activity", ["#"], "svc.activity", workers=1)
+    publisher = RabbitMQPublisher(connection, "activity", max_per_poll=2)
+    consumer.start_consuming()
+    connection.start()
+    wait(lambda: consumer.channel is not None and consumer.channel.consumers)
+
+    broker.drop_connections(available=False)
+    wait(lambda: connection.metrics.counts()["failed_attempts"] >= 1)
+    futures = [publisher.publish(json.dumps({"id": id}), "created") for id in range(5)]
+    broker.drop_connections(available=True)
+    for future in futures:
+        future.result(timeout=5)
+
+    # Each message is confirmed on its own, the queue is drained over three polls
+    snapshot = publisher.snapshot()
+    assert (snapshot["published"], snapshot["polls"], snapshot["messages_per_poll_avg"]) == (5, 3, 5 / 3)
+    wait(lambda: len(received) == 5)
+    assert received == [0, 1, 2, 3, 4]
+
+
+def test_reconnect_backoff_doubles_up_to_the_maximum():
+    connection = RabbitMQConnection(RabbitMQConnectionConfig("memory", backoff_initial=1, backoff_max=8))
+    for attempt, delay in enumerate([1, 2, 4, 8, 8]):
+        for _ in range(20):
+            assert delay / 2 <= connection._backoff(attempt) <= delay
@@ -0,0 +1,150 @@
+import json
+import threading
+from messaging import ACTIVITY_EVENT, RabbitMQConsumer, RabbitMQPublisher, dead_letter_queue
+
+
+def publish(connect, exchange, events, routing_key="created"):
+    # Sends the events from a connection of their own, as an upstream service would
+    connection = connect()
+    publisher = RabbitMQPublisher(connection, exchange)
+    connection.start()
+    for future in [publisher.publish(json.dumps(event), routing_key) for event in events]:
+        future.result(timeout=5)
+
+
+def single(apply):
+    # A batch of one goes to the single message callback
+    return lambda ch, method, properties, body: apply([(method.routing_key, body)])
+
+
+def start(connection, consumer, broker, wait):
+    consumer.start_consuming()
+    connection.start()
+    wait(lambda: consumer.channel is not None and consumer.channel.consumers)
+
+
+def parked(broker, queue_name):
+    return [json.loads(message.body)["id"] for message in broker.queues[dead_letter_queue(queue_name)].messages]
+
+
+def test_batched_deliveries_are_applied_together_and_acked(broker, connect, wait):
+    lock = threading.Lock()
+    applied = []
+    batch_sizes = []
+
+    def apply(messages):
+        with lock:
+            batch_sizes.append(len(messages))
+            applied.extend(json.loads(body)["id"] for _, body in messages)
+    connection = connect()
+    consumer = RabbitMQConsumer(connection, single(apply), "activity", ["#"], "svc.activity", prefetch_count=100, workers=2, batch_callback=apply, batch_size=20, batch_timeout=0.05)
+    start(connection, consumer, broker, wait)
+    publish(connect, "activity", [{"id": id} for id in range(200)])
+
+    wait(lambda: consumer.metrics.counts()["acked"] == 200)
+    assert sorted(applied) == list(range(200))
+    assert max(batch_sizes) > 1
+    assert max(batch_sizes) <= 20
+    snapshot = consumer.snapshot()
+    assert snapshot["batches"] == len(batch_sizes)
+    assert snapshot["in_flight"] == 0
+    wait(lambda: not consumer.channel.unacked)
+    assert broker.queue_size("svc.activity") == 0
+
+
+def test_events_of_one_entity_stay_in_order(broker, connect, wait):
+    lock = threading.Lock()
+    applied = []
+
+    def apply(messages):
+        with lock:
+            applied.extend((event["id"], event["version"]) for event in map(json.loads, (body for _, body in messages)))
+    connection = connect()
+    consumer = RabbitMQConsumer(connection, single(apply), "activity", ["#"], "svc.activity", workers=4, batch_callback=apply, batch_size=7)
+    start(connection, consumer, broker, wait)
+    publish(connect, "activity", [{"id": id, "version": version} for version in range(10) for id in range(5)])
+
+    wait(lambda: len(applied) == 50)
+    for id in range(5):
+        assert [version for event_id, version in applied if event_id == id] == list(range(10))
+
+
+def test_failing_batch_is_applied_one_message_at_a_time(broker, connect, wait):
+    applied = []
+
+    def apply(messages):
+        raise ValueError("batch failed")
+
+    def callback(ch, method, properties, body):
+        event = json.loads(body)
+        if event["bad"]:
+            raise ValueError("bad event")
+        applied.append(event["id"])
+    connection = connect()
+    consumer = RabbitMQConsumer(connection, callback, "activity", ["#"], "svc.activity", workers=1, batch_callback=apply, batch_size=10, batch_timeout=0.2, retries=1, retry_backoff=0.01)
+    start(connection, consumer, broker, wait)
+    publish(connect, "activity", [{"id": id, "bad": id == 3} for id in range(6)])
+
+    wait(lambda: broker.queue_size(dead_letter_queue("svc.activity")) == 1)
+    wait(lambda: len(applied) == 5)
+    assert applied == [0, 1, 2, 4, 5]
+    assert parked(broker, "svc.activity") == [3]
+    counts = consumer.metrics.counts()
+    assert counts["batch_fallbacks"] >= 1
+    assert counts["dead_lettered"] == 1
+
+
+def test_failing_message_is_retried_then_dead_lettered(broker, connect, wait):
+    attempts = {}
+    applied = []
+
+    def callback(ch, method, properties, body):
+        # Event n fails its first n attempts
+        event = json.loads(body)
+        attempts[event["id"]] = attempts.get(event["id"], 0) + 1
+        if attempts[event["id"]] <= event["id"]:
+            raise ValueError("not yet")
+        applied.append(event["id"])
+    connection = connect()
+    consumer = RabbitMQConsumer(connection, callback, "activity", ["#"], "svc.activity", workers=2, retries=2, retry_backoff=0.01)
+    start(connection, consumer, broker, wait)
+    publish(connect, "activity", [{"id": id} for id in range(5)])
+
+    wait(lambda: broker.queue_size(dead_letter_queue("svc.activity")) == 2)
+    wait(lambda: len(applied) == 3)
+    assert sorted(applied) == [0, 1, 2]
+    assert attempts == {0: 1, 1: 2, 2: 3, 3: 3, 4: 3}
+    assert sorted(parked(broker, "svc.activity")) == [3, 4]
+    snapshot = consumer.snapshot()
+    assert (snapshot["acked"], snapshot["failed"], snapshot["retried"], snapshot["dead_lettered"]) == (3, 2, 7, 2)
+    assert broker.queue_size("svc.activity") == 0
+
+
+def test_undecodable_message_is_dead_lettered_without_retries(broker, connect, wait):
+    events = []
+    connection = connect()
+    consumer = RabbitMQConsumer(connection, lambda ch, method, properties, body: events.append(body), "activity", ["#"], "svc.activity", workers=1, schema=ACTIVITY_EVENT)
+    start(connection, consumer, broker, wait)
+    event = {"id": 1, "user_id": 2, "category": "sport", "date": "2026-05-01T10:00:00Z", "price": 10.0, "name": "run", "total_places": 10, "status": "available"}
+    publish(connect, "activity", [dict(event, id="one"), event])
+
+    wait(lambda: len(events) == 1)
+    assert events[0]["id"] == 1
+    assert events[0]["reserved"] is None
+    assert parked(broker, "svc.activity") == ["one"]
+    assert consumer.metrics.counts()["retried"] == 0
+
+
+def test_server_named_queue_drops_failing_messages(broker, connect, wait):
+    def callback(ch, method, properties, body):
+        raise ValueError("always fails")
+    connection = connect()
+    consumer = RabbitMQConsumer(connection, callback, "activity", ["#"], workers=1, retries=0)
+    start(connection, consumer, broker, wait)
+    publish(connect, "activity", [{"id": 1}])
+
+    wait(lambda: consumer.metrics.counts()["failed"] == 1)
+    wait(lambda: not consumer.channel.unacked)
+    assert consumer.metrics.counts()["dead_lettered"] == 0
+    assert not any(name.endswith(".dead-letter") for name in broker.queues)
+    assert all(not queue.messages for queue in broker.queues.values())
@@ -0,0 +1,7 @@
+#!/bin/sh
+# Runs once when the primary's data directory is created: a role the replica
+# streams WAL with, allowed to connect for replication from the compose network
+set -e
+psql -v ON_ERROR_STOP=1 --username "$POSTGRES_USER" --dbname "$POSTGRES_DB" \
+    -c "CREATE ROLE replicator WITH REPLICATION LOGIN PASSWORD '$REPLICATION_PASSWORD'"
+echo "host replication replicator all scram-sha-256" >> "$PGDATA/pg_hba.conf"
@@ -1,352 +1,425 @@
 from contextlib import asynccontextmanager
-import json
 import os
-from fastapi import FastAPI, HTTPException, Query, Depends
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session
+from fastapi import FastAPI, HTTPException, Query, Depends, Response
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
 from typing import List, Optional
 from datetime import datetime
 import logging
-from consumer import RabbitMQConsumer
-from publisher import RabbitMQPublisher
-from models import Activity, Reservation, ReservationDTO, User, UserType
-from connection_manager import RabbitMQConnectionManager
-from config import RabbitMQConnectionConfig
-logging.basicConfig(level=logging.INFO, format='%(levelname)s:   %(message)s')
+from messaging import ACTIVITY_EVENT, RESERVATION_EVENT, USER_EVENT, RabbitMQConnection, RabbitMQConnectionConfig, RabbitMQConsumer, RabbitMQPublisher, latest_events
+from servicekit.outbox import Outbox, OutboxRelay
+from seats import release_seat, seat_error, seed_seats, take_seat
+from servicekit.user_cache import UserCache
+from models import Activity, Reservation, ReservationDTO, ReservationView, User, UserType, OutboxEvent, Page
+from servicekit.logs import LogSample, configure_logging
+from servicekit.instrumentation import PROMETHEUS, InstrumentationMiddleware, render_consumers, request_metrics
+from servicekit.database import SessionLocal, async_engine, get_db, get_async_db, get_read_db, replicas, upsert, pool_metrics, async_pool_metrics
+configure_logging()
 logger = logging.getLogger(__name__)
-pika_logger = logging.getLogger("pika")
-pika_logger.setLevel(logging.WARNING)
+message_log = LogSample(logger)
 
 
-RABBITMQ_HOSTNAME=os.environ.get('RABBITMQ_HOSTNAME')
-RABBITMQ_PORT=os.environ.get('RABBITMQ_PORT')
-RABBITMQ_USERNAME=os.environ.get('RABBITMQ_USERNAME')
-RABBITMQ_PASSWORD=os.environ.get('RABBITMQ_PASSWORD')
-DATABASE_URL = f"postgresql://{os.getenv('DATABASE_USERNAME')}:{os.getenv('DATABASE_PASSWORD')}@{os.getenv('DATABASE_HOSTNAME')}:{os.getenv('DATABASE_PORT')}/{os.getenv('DATABASE_NAME')}"
-
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+RABBITMQ_PREFETCH_COUNT=int(os.environ.get('RABBITMQ_PREFETCH_COUNT', 400))
+RABBITMQ_CONSUMER_WORKERS=int(os.environ.get('RABBITMQ_CONSUMER_WORKERS', 4))
+RABBITMQ_BATCH_SIZE=int(os.environ.get('RABBITMQ_BATCH_SIZE', 100))
+RABBITMQ_BATCH_TIMEOUT=int(os.environ.get('RABBITMQ_BATCH_TIMEOUT_MS', 50)) / 1000
+USER_CACHE_SIZE=int(os.environ.get('USER_CACHE_SIZE', 10000))
+USER_CACHE_TTL=int(os.environ.get('USER_CACHE_TTL_SECONDS', 60))
 
+connection = None
 publisher = None
-
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+outbox_relay = None
+consumers = []
+user_cache = UserCache(User, USER_CACHE_SIZE, USER_CACHE_TTL)
+outbox = Outbox(OutboxEvent)
+
+
+async def paginate(db, query, id_column, cursor, limit):
+    # Keyset pagination: rows after the cursor id in id order, plus one extra row
+    # to find out whether there is a next page
+    if cursor is not None:
+        query = query.where(id_column > cursor)
+    rows = (await db.scalars(query.order_by(id_column).limit(limit + 1))).all()
+    return rows[:limit], len(rows) > limit
+
+
+def refresh_reservation_views(condition):
+    # Rewrites the view rows of the reservations matching condition in one
+    # INSERT ... SELECT ... ON CONFLICT, run by whoever changed one of the joined tables
+    participant = aliased(User)
+    organizer = aliased(User)
+    rows = (
+        select(
+            Reservation.id,
+            Reservation.participant_id,
+            participant.username,
+            Reservation.activity_id,
+            Activity.name,
+            Activity.category,
+            Activity.price,
+            Activity.user_id,
+            organizer.username,
+            Reservation.date,
+        )
+        .outerjoin(participant, participant.id == Reservation.participant_id)
+        .outerjoin(Activity, Activity.id == Reservation.activity_id)
+        .outerjoin(organizer, organizer.id == Activity.user_id)
+        .where(condition)
+    )
+    columns = [column.name for column in ReservationView.__table__.columns]
+    statement = insert(ReservationView).from_select(columns, rows)
+    return statement.on_conflict_do_update(
+        index_elements=[ReservationView.reservation_id],
+        set_={column: statement.excluded[column] for column in columns if column != 'reservation_id'},
+    )
 
 
 @asynccontextmanager
 async def lifespan(app):
-    global publisher
-    config = RabbitMQConnectionConfig(RABBITMQ_HOSTNAME, RABBITMQ_PORT, RABBITMQ_USERNAME, RABBITMQ_PASSWORD)
-    user_consuming_manager = RabbitMQConnectionManager(config)
-    reservation_consuming_manager = RabbitMQConnectionManager(config)
-    publishing_manager = RabbitMQConnectionManager(config)
-    user_consumer = RabbitMQConsumer(user_consuming_manager, user_callback, 'user', ['created', 'updated', 'deleted'])
-    reservation_consumer = RabbitMQConsumer(reservation_consuming_manager, activity_callback, 'activity', ['created', 'updated', 'deleted', 'cancelled'])
-    publisher = RabbitMQPublisher(publishing_manager, 'reservation')
-    user_consumer.start_consuming()
-    reservation_consumer.start_consuming()
+    global connection, publisher, outbox_relay, consumers
+    # One broker connection for the publisher and every consumer, each on its own channel
+    connection = RabbitMQConnection(RabbitMQConnectionConfig.from_env())
+    publisher = RabbitMQPublisher(connection, 'reservation')
+    outbox_relay = OutboxRelay(SessionLocal, publisher, outbox)
+    consumers = [
+        RabbitMQConsumer(connection, user_callback, 'user', ['created', 'updated', 'deleted'], 'reservation-service.user', RABBITMQ_PREFETCH_COUNT, RABBITMQ_CONSUMER_WORKERS, batch_callback=apply_user_events, batch_size=RABBITMQ_BATCH_SIZE, batch_timeout=RABBITMQ_BATCH_TIMEOUT, schema=USER_EVENT),
+        RabbitMQConsumer(connection, activity_callback, 'activity', ['created', 'updated', 'deleted', 'cancelled'], 'reservation-service.activity', RABBITMQ_PREFETCH_COUNT, RABBITMQ_CONSUMER_WORKERS, batch_callback=apply_activity_events, batch_size=RABBITMQ_BATCH_SIZE, batch_timeout=RABBITMQ_BATCH_TIMEOUT, schema=ACTIVITY_EVENT),
+    ]
+    for consumer in consumers:
+        consumer.start_consuming()
+    connection.start()
+    outbox_relay.start_relaying()
     try:
         yield
     finally:
-        user_consuming_manager.close()
-        reservation_consuming_manager.close()
-        publishing_manager.close()
+        outbox_relay.close()
+        connection.close()
+        await async_engine.dispose()
+        await replicas.dispose()
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(InstrumentationMiddleware)
 
 
 
-def user_callback(ch, method, properties, body):
-    logger.info(f"Message recieved")
-    logger.info(f"Method:{method}")
-    logger.info(f"Properties:{properties}")
-    user = parse_user_message(body)
-    if method.routing_key == 'created':
-        logger.info(f"User created")
-        save_user(user)
-    elif method.routing_key == 'updated':
-        logger.info(f"User updated")
-        update_user(user)
-    elif method.routing_key == 'deleted':
-        logger.info(f"User deleted")
-        delete_user(user)
+def user_callback(ch, method, properties, event):
+    if message_log():
+        logger.debug("Message received from exchange %s with routing key %s", method.exchange, method.routing_key)
+    apply_user_events([(method.routing_key, event)])
 
 
-def delete_user(user):
+def apply_user_events(messages):
+    events = latest_events(messages, parse_user_message)
+    users = [user for routing_key, user in events if routing_key != 'deleted']
+    deleted = [user for routing_key, user in events if routing_key == 'deleted']
+    logger.debug("Applying %s user upserts and %s deletes", len(users), len(deleted))
     db = next(get_db())
     try:
-        db.query(User).filter(User.id == user.id).delete()
-        reservation = db.query(Reservation).filter(Reservation.participant_id == user.id).delete()
-        dto = ReservationDTO(
-            participant_id=reservation.participant_id,
-            activity_id=reservation.activity_id,
-            date=reservation.date
-        )
-        db.query(Reservation).filter(Reservation.participant_id == user.id).delete()
+        if users:
+            stale = len(users) - upsert(db, User, users)
+            if stale:
+                logger.debug("Skipped %s stale user events", stale)
+        removed = delete_users(db, deleted) if deleted else 0
+        # Reservations of deleted participants are gone, the rest pick up new or missing usernames
+        ids = [user['id'] for user in users + deleted]
+        db.execute(refresh_reservation_views(Reservation.participant_id.in_(ids)))
+        db.execute(refresh_reservation_views(Activity.user_id.in_(ids)))
         db.commit()
-        publisher.publish(dto.model_dump_json(), 'deleted')
     except Exception as e:
         db.rollback()
-        logger.error(f"Error deleting user from database: {e}")
+        logger.error("Error applying user events to database: %s", e)
+        raise
     finally:
         db.close()
+    user_cache.invalidate([user['id'] for user in users + deleted])
+    if removed:
+        outbox_relay.notify()
 
 
-def update_user(user):
-    db = next(get_db())
-    try:
-        db.query(User).filter(User.id == user.id).update({User.username: user.username, User.email: user.email, User.user_type: user.user_type})
-        db.commit()
-    except Exception as e:
-        db.rollback()
-        logger.error(f"Error updating user in database: {e}")
-    finally:
-        db.close()
+def delete_users(db, users):
+    # Removes the users with their reservations, and queues a deleted event for
+    # each reservation
+    usernames = {user['id']: user['username'] for user in users}
+    ids = list(usernames)
+    reservations = db.query(Reservation).filter(Reservation.participant_id.in_(ids)).all()
+    for reservation in reservations:
+        dto = ReservationDTO(
+            id=reservation.id,
+            participant_id=reservation.participant_id,
+            activity_id=reservation.activity_id,
+            participant_username=usernames[reservation.participant_id],
+            date=reservation.date
+        )
+        outbox.add_event(db, 'deleted', RESERVATION_EVENT, dto.model_dump())
+    db.query(Reservation).filter(Reservation.participant_id.in_(ids)).delete()
+    db.query(User).filter(User.id.in_(ids)).delete()
+    return len(reservations)
+
+
+def parse_user_message(event):
+    # USER_EVENT fields are the users columns
+    return dict(event, user_type=UserType(event['user_type']))
 
 
-def save_user(user):
+def activity_callback(ch, method, properties, event):
+    if message_log():
+        logger.debug("Message received from exchange %s with routing key %s", method.exchange, method.routing_key)
+    apply_activity_events([(method.routing_key, event)])
+
+
+def apply_activity_events(messages):
+    events = latest_events(messages, parse_activity_message)
+    activities = [activity for routing_key, activity in events if routing_key != 'deleted']
+    deleted = [activity['id'] for routing_key, activity in events if routing_key == 'deleted']
+    logger.debug("Applying %s activity upserts and %s deletes", len(activities), len(deleted))
     db = next(get_db())
     try:
-        db.add(user)
+        if activities:
+            places = [(activity['id'], activity.pop('total_places'), activity.pop('reserved'), activity['version']) for activity in activities]
+            stale = len(activities) - upsert(db, Activity, activities)
+            if stale:
+                logger.debug("Skipped %s stale activity events", stale)
+            seed_seats(db, places)
+            db.execute(refresh_reservation_views(Reservation.activity_id.in_([activity['id'] for activity in activities])))
+        if deleted:
+            db.query(Reservation).filter(Reservation.activity_id.in_(deleted)).delete()
+            db.query(Activity).filter(Activity.id.in_(deleted)).delete()
         db.commit()
-        db.refresh(user)
     except Exception as e:
         db.rollback()
-        logger.error(f"Error adding user to database: {e}")
+        logger.error("Error applying activity events to database: %s", e)
+        raise
     finally:
         db.close()
 
 
-def parse_user_message(body):
-    user_data = json.loads(body)
-    return User(id = user_data['id'],username=user_data['username'], email=user_data['email'], user_type=UserType(user_data['user_type']))
+def parse_activity_message(event):
+    return dict(
+        id=event['id'],
+        user_id=event['user_id'],
+        category=event['category'],
+        date=event['date'],
+        price=event['price'],
+        name=event['name'],
+        description=event['description'],
+        total_places=event['total_places'],
+        reserved=event['reserved'],
+        version=event['version']
+    )
 
 
-def activity_callback(ch, method, properties, body):
-    logger.info(f"Message recieved")
-    logger.info(f"Method:{method}")
-    logger.info(f"Properties:{properties}")
-    activity = parse_activity_message(body)
-    if method.routing_key == 'created':
-        logger.info(f"Activity created")
-        save_activity(activity)
-    elif method.routing_key == 'updated':
-        logger.info(f"Activity updated")
-        update_activity(activity)
-    elif method.routing_key == 'deleted':
-        logger.info(f"Activity deleted")
-        delete_activity(activity)
+@app.get("/metrics")
+async def read_metrics():
+    return Response(request_metrics.render() + render_consumers(consumers), media_type=PROMETHEUS)
 
-def delete_activity(activity):
-    db = next(get_db())
-    try:
-        db.query(Activity).filter(Activity.id == activity.id).delete()
-        db.query(Reservation).filter(Reservation.activity_id == activity.id).delete()
-        db.commit()
-    except Exception as e:
-        db.rollback()
-        logger.error(f"Error deleting activity from database: {e}")
-    finally:
-        db.close()
 
+@app.get("/metrics/messaging")
+async def read_messaging_metrics():
+    return connection.snapshot()
 
-def update_activity(activity):
-    db = next(get_db())
-    try:
-        db.query(Activity).filter(Activity.id == activity.id).update({Activity.user_id: activity.user_id, Activity.category: activity.category, Activity.date: activity.date, Activity.price: activity.price, Activity.name: activity.name})
-        db.commit()
-    except Exception as e:
-        db.rollback()
-        logger.error(f"Error updating activity in database: {e}")
-    finally:
-        db.close()
 
+@app.get("/metrics/outbox")
+async def read_outbox_metrics(db: AsyncSession = Depends(get_async_db)):
+    return {**outbox_relay.metrics.snapshot(), **(await outbox.backlog(db))}
 
-def save_activity(activity):
-    db = next(get_db())
-    try:
-        db.add(activity)
-        db.commit()
-        db.refresh(activity)
-    except Exception as e:
-        db.rollback()
-        logger.error(f"Error adding activity to database: {e}")
-    finally:
-        db.close()
 
+@app.get("/metrics/pool")
+async def read_pool_metrics():
+    return {"sync": pool_metrics.snapshot(), "async": async_pool_metrics.snapshot(), **replicas.snapshot()}
 
-def parse_activity_message(body):
-    activity_data = json.loads(body)
-    return Activity(id = activity_data['id'],user_id=activity_data['user_id'], category=activity_data['category'], date=activity_data['date'], price=activity_data['price'], name=activity_data['name'])
+
+@app.get("/metrics/user-cache")
+async def read_user_cache_metrics():
+    return user_cache.snapshot()
 
 
 @app.get("/reservations/")
-def read(
+async def read(
     participant_id: Optional[int] = None,
-    activity_id: Optional[List[str]] = Query(None),
+    activity_id: Optional[List[int]] = Query(None),
     participant: Optional[str] = None,
     organizer: Optional[str] = None,
     activity_name: Optional[str] = None,
     from_date: Optional[str] = None,
     to_date: Optional[str] = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[int] = None,
 ):
-    query = db.query(Reservation)
+    query = select(Reservation)
 
 
     if participant_id is not None:
-        query = query.filter(Reservation.participant_id == participant_id)
+        query = query.where(Reservation.participant_id == participant_id)
 
-    # Filter by multiple categories
+    # Filter by multiple activities
     if activity_id is not None:
-        query = query.filter(Reservation.activity_id == activity_id)
-
-    # Filter by date range
-    if from_date is not None:
-        from_date_dt = datetime.strptime(from_date, "%Y-%m-%dT%H:%M:%S")
-        query = query.filter(Reservation.date >= from_date_dt)
-
-    if to_date is not None:
-        to_date_dt = datetime.strptime(to_date, "%Y-%m-%dT%H:%M:%S")
-        query = query.filter(Reservation.date <= to_date_dt)
-    else:
-        filtered_reservations = query.all()
-    if len(filtered_reservations) == 0:
-        raise HTTPException(status_code=400, detail="No activities found")
-    return [ReservationDTO.model_validate(reservation) for reservation in filtered_reservations]
+        query = query.where(Reservation.activity_id.in_(activity_id))
+
+    # Filter by date range. Reservation dates are strings in one fixed-width format,
+    # so they compare in time order as strings and the bounds are bound as strings
+    # in that format too
+    try:
+        if from_date is not None:
+            from_date_dt = datetime.strptime(from_date, "%Y-%m-%dT%H:%M:%S")
+            query = query.where(Reservation.date >= from_date_dt.strftime("%Y-%m-%dT%H:%M:%S"))
+
+        if to_date is not None:
+            to_date_dt = datetime.strptime(to_date, "%Y-%m-%dT%H:%M:%S")
+            query = query.where(Reservation.date <= to_date_dt.strftime("%Y-%m-%dT%H:%M:%S"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DDTHH:MM:SS")
+
+    reservations, has_more = await paginate(db, query, Reservation.id, cursor, limit)
+    return Page(
+        items=[ReservationDTO.model_validate(reservation) for reservation in reservations],
+        next_cursor=reservations[-1].id if has_more else None
+    )
 
 @app.get("/reservations/{participant_username}")
-def read(participant_username: str, db: Session = Depends(get_db)):
-    participant = db.query(User).filter(User.username == participant_username).first()
-    if participant is None:
-        raise HTTPException(status_code=400, detail="Participant not found")
-    reservations = db.query(Reservation).filter(Reservation.participant_id == participant.id).all()
-    if len(reservations) == 0:
+async def read(participant_username: str, db: AsyncSession = Depends(get_async_db)):
+    views = (await db.scalars(
+        select(ReservationView)
+        .where(ReservationView.participant_username == participant_username)
+        .order_by(ReservationView.reservation_id)
+    )).all()
+    if len(views) == 0:
+        if await user_cache.get_by_username(db, participant_username) is None:
+            raise HTTPException(status_code=400, detail="Participant not found")
         raise HTTPException(status_code=400, detail="No reservations found")
     dtos = []
-    for reservation in reservations:
-        activity = db.query(Activity).filter(Activity.id == reservation.activity_id).first()
-        if activity is None:
+    for view in views:
+        if view.organizer_id is None:
             raise HTTPException(status_code=400, detail="Activity not found")
-        organizer = db.query(User).filter(User.id == activity.user_id).first()
-        if organizer is None:
+        if view.organizer_username is None:
             raise HTTPException(status_code=400, detail="Organizer not found")
         dto = ReservationDTO(
-            participant_id=reservation.participant_id,
-            activity_id=reservation.activity_id,
-            participant_username=participant_username,
-            activity_name=activity.name,
-            category=activity.category,
-            price=activity.price,
-            organizer=organizer.username,
-            date=reservation.date,
-            id=reservation.id
+            participant_id=view.participant_id,
+            activity_id=view.activity_id,
+            participant_username=view.participant_username,
+            activity_name=view.activity_name,
+            category=view.category,
+            price=view.price,
+            organizer=view.organizer_username,
+            date=view.date,
+            id=view.reservation_id
         )
         dtos.append(dto)
     return dtos
 
 @app.post("/reservations/")
-def create(reservation: ReservationDTO, db: Session = Depends(get_db)):
+async def create(reservation: ReservationDTO, db: AsyncSession = Depends(get_async_db)):
     if reservation is None:
         raise HTTPException(status_code=400, detail="Invalid request body")
     if reservation.participant_username is None or reservation.activity_id is None:
         raise HTTPException(status_code=400, detail="Invalid request body")
-    participant = db.query(User).filter(User.username == reservation.participant_username).first()
-    activity = db.query(Activity).filter(Activity.id == reservation.activity_id).first()
+    participant = await user_cache.get_by_username(db, reservation.participant_username)
     if participant is None:
         raise HTTPException(status_code=400, detail="Participant not found")
-    if activity is None:
-        raise HTTPException(status_code=400, detail="Activity not found")
-    logger.info("Participant and activity found")
     reservation_date = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
-    logger.info(f"Reservation date: {reservation_date}")
-    logger.info(f"Reservation date type: {type(reservation_date)}")
     db_reservation = Reservation(
         participant_id=participant.id,
         activity_id=reservation.activity_id,
         date=reservation_date
     )
     db.add(db_reservation)
-    db.commit()
-    db.refresh(db_reservation)
-    logger.info("Reservation added to the database")
-    logger.info(f"Participant ID: {db_reservation.participant_id}")
-    logger.info(f"Activity ID: {db_reservation.activity_id}")
-    logger.info(f"Date: {db_reservation.date}")
-    logger.info(f"Date object type:{type(db_reservation.date)}")
-    logger.info(f"Participant username: {reservation.participant_username}")
+    await db.flush()
+    await db.execute(refresh_reservation_views(Reservation.id == db_reservation.id))
     dto = ReservationDTO(
+        id=db_reservation.id,
         participant_id=db_reservation.participant_id,
         activity_id=db_reservation.activity_id,
         participant_username=reservation.participant_username,
         date=db_reservation.date
     )
-    logger.info("Created dto")
-    publisher.publish(dto.model_dump_json(), 'created')
+    outbox.add_event(db, 'created', RESERVATION_EVENT, dto.model_dump())
+    # Last statement before the commit, so the seat row stays locked as briefly as possible
+    if not await take_seat(db, reservation.activity_id):
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=await seat_error(db, reservation.activity_id))
+    await db.commit()
+    outbox_relay.notify()
+    logger.debug("Reservation %s created for participant %s on activity %s", dto.id, dto.participant_id, dto.activity_id)
     return dto
 
 @app.delete("/reservations/{reservation_id}")
-def delete(reservation_id: int, db: Session = Depends(get_db)):
+async def delete(reservation_id: int, db: AsyncSession = Depends(get_async_db)):
     if reservation_id is None:
         raise HTTPException(status_code=400, detail="Reservation ID is required")
-    reservation = db.query(Reservation).filter(Reservation.id == reservation_id).first()
+    reservation = await db.scalar(select(Reservation).where(Reservation.id == reservation_id))
     if reservation is None:
         raise HTTPException(status_code=400, detail="Reservation not found")
-    db.delete(reservation)
-    db.commit()
-    publisher.publish(json.dumps({"reservation_id": reservation_id}), 'deleted')
+    dto = ReservationDTO(
+        id=reservation.id,
+        participant_id=reservation.participant_id,
+        activity_id=reservation.activity_id,
+        date=reservation.date
+    )
+    outbox.add_event(db, 'deleted', RESERVATION_EVENT, dto.model_dump())
+    await db.delete(reservation)
+    await release_seat(db, reservation.activity_id)
+    await db.commit()
+    outbox_relay.notify()
     return {"message": "Reservation deleted successfully"}
 
 
 @app.put("/reservation/{reservation_id}")
-def update(reservation_id: int, reservation: ReservationDTO, db: Session = Depends(get_db)):
+async def update(reservation_id: int, reservation: ReservationDTO, db: AsyncSession = Depends(get_async_db)):
     if reservation_id is None:
         raise HTTPException(status_code=400, detail="Reservation ID is required")
     if reservation is None:
         raise HTTPException(status_code=400, detail="Invalid request body")
         
-    db_reservation = db.query(Reservation).filter(Reservation.id == reservation_id).first()
+    db_reservation = await db.scalar(select(Reservation).where(Reservation.id == reservation_id))
     if db_reservation is None:
         raise HTTPException(status_code=400, detail="Reservation not found")
     
-    user = db.query(User).filter(User.username == reservation.participant_username).first()
+    user = await user_cache.get_by_username(db, reservation.participant_username)
     if user is None:
         raise HTTPException(status_code=400, detail="User not found")
 
+    previous_activity_id = db_reservation.activity_id
     db_reservation.participant_id = user.id
     db_reservation.activity_id = reservation.activity_id
-    db.commit()
-    db.refresh(db_reservation)
+    await db.flush()
+    await db.execute(refresh_reservation_views(Reservation.id == reservation_id))
     dto = ReservationDTO(
+        id=db_reservation.id,
         participant_id=db_reservation.participant_id,
         activity_id=db_reservation.activity_id,
+        participant_username=user.username,
         date=db_reservation.date
     )
-    publisher.publish(dto.model_dump_json(), 'updated')
+    outbox.add_event(db, 'updated', RESERVATION_EVENT, dto.model_dump())
+    if reservation.activity_id != previous_activity_id:
+        # Moving to another activity takes a place there and gives the old one back
+        if not await take_seat(db, reservation.activity_id):
+            await db.rollback()
+            raise HTTPException(status_code=400, detail=await seat_error(db, reservation.activity_id))
+        await release_seat(db, previous_activity_id)
+    await db.commit()
+    outbox_relay.notify()
     return dto
 
 @app.put("/reservations/cancel/{id}")
-def cancel_reservation(id: int, db: Session = Depends(get_db)):
+async def cancel_reservation(id: int, db: AsyncSession = Depends(get_async_db)):
     if id is None:
         raise HTTPException(status_code=400, detail="Reservation ID is required")
-    reservation = db.query(Reservation).filter(Reservation.id == id).first()
+    reservation = await db.scalar(select(Reservation).where(Reservation.id == id))
     if reservation is None:
         raise HTTPException(status_code=400, detail="Reservation not found")
-    db.delete(reservation)
-    db.commit()
     dto = ReservationDTO(
+        id=reservation.id,
         participant_id=reservation.participant_id,
         activity_id=reservation.activity_id,
         date=reservation.date
     )
-    publisher.publish(dto.model_dump_json(), 'cancelled')
+    outbox.add_event(db, 'cancelled', RESERVATION_EVENT, dto.model_dump())
+    await db.delete(reservation)
+    await release_seat(db, reservation.activity_id)
+    await db.commit()
+    outbox_relay.notify()
     return {"message": "Reservation cancelled successfully"}
 
@@ -0,0 +1,32 @@
+"""indexes for listing and replication filters
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 11:00:00
+
+"""
+from alembic import op
+
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+INDEXES = [
+    ('ix_reservations_participant_id_id', 'reservations', ['participant_id', 'id']),
+    ('ix_reservations_activity_id_id', 'reservations', ['activity_id', 'id']),
+    ('ix_activities_user_id', 'activities', ['user_id']),
+    ('ix_users_username', 'users', ['username']),
+]
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, if_not_exists=True)
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table, if_exists=True)
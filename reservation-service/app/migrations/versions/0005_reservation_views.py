@@ -0,0 +1,47 @@
+"""denormalized reservation views
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 15:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not sa.inspect(op.get_bind()).has_table('reservation_views'):
+        op.create_table(
+            'reservation_views',
+            sa.Column('reservation_id', sa.Integer(), sa.ForeignKey('reservations.id', ondelete='CASCADE'), primary_key=True),
+            sa.Column('participant_id', sa.Integer()),
+            sa.Column('participant_username', sa.String()),
+            sa.Column('activity_id', sa.Integer()),
+            sa.Column('activity_name', sa.String()),
+            sa.Column('category', sa.String()),
+            sa.Column('price', sa.Float()),
+            sa.Column('organizer_id', sa.Integer()),
+            sa.Column('organizer_username', sa.String()),
+            sa.Column('date', sa.String()),
+        )
+    op.create_index('ix_reservation_views_participant_username_id', 'reservation_views', ['participant_username', 'reservation_id'], if_not_exists=True)
+    # Existing reservations, later writes and replicated events keep the rows current
+    op.execute("""
+        INSERT INTO reservation_views (reservation_id, participant_id, participant_username, activity_id, activity_name, category, price, organizer_id, organizer_username, date)
+        SELECT r.id, r.participant_id, p.username, r.activity_id, a.name, a.category, a.price, a.user_id, o.username, r.date
+        FROM reservations r
+        LEFT JOIN users p ON p.id = r.participant_id
+        LEFT JOIN activities a ON a.id = r.activity_id
+        LEFT JOIN users o ON o.id = a.user_id
+        ON CONFLICT (reservation_id) DO NOTHING
+    """)
+
+
+def downgrade():
+    op.drop_table('reservation_views')
@@ -0,0 +1,33 @@
+"""sharded free places of activities
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 16:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Starts empty. This service has no capacities to fill it from, activity-service's
+    # migration 0006 republishes every activity with its reserved places and the
+    # events seed the rows.
+    if not sa.inspect(op.get_bind()).has_table('activity_seats'):
+        op.create_table(
+            'activity_seats',
+            sa.Column('activity_id', sa.Integer(), sa.ForeignKey('activities.id', ondelete='CASCADE'), primary_key=True),
+            sa.Column('shard', sa.Integer(), primary_key=True),
+            sa.Column('places', sa.Integer(), nullable=False),
+            sa.Column('version', sa.Integer(), nullable=False),
+        )
+
+
+def downgrade():
+    op.drop_table('activity_seats')
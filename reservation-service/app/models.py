@@ -1,33 +1,29 @@
 from enum import Enum
-import os
-from typing import Optional
+from typing import Generic, List, Optional, TypeVar
 from pydantic import BaseModel
-from sqlalchemy import Column, Integer, String, Float, DateTime, Enum as SQLAlchemyEnum, create_engine
+from sqlalchemy import BigInteger, Column, ForeignKey, Index, Integer, String, Float, DateTime, LargeBinary, Enum as SQLAlchemyEnum, func
 from sqlalchemy.ext.declarative import declarative_base
+from servicekit.database import engine
 
 
 
-DATABASE_HOSTNAME=os.environ.get('DATABASE_HOSTNAME')
-DATABASE_PORT=os.environ.get('DATABASE_PORT')
-DATABASE_NAME=os.environ.get('DATABASE_NAME')
-DATABASE_USERNAME=os.environ.get('DATABASE_USERNAME')
-DATABASE_PASSWORD=os.environ.get('DATABASE_PASSWORD')
-DATABASE_URL=f"postgresql://{DATABASE_USERNAME}:{DATABASE_PASSWORD}@{DATABASE_HOSTNAME}:{DATABASE_PORT}/{DATABASE_NAME}"
-engine = create_engine(DATABASE_URL)
 
 Base = declarative_base()
 
+T = TypeVar("T")
+
 
 class Activity(Base):
     __tablename__ = "activities"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer)
+    user_id = Column(Integer, index=True)
     category = Column(String)
     date = Column(DateTime)
     price = Column(Float)
     name = Column(String)
     description = Column(String)
+    version = Column(Integer, nullable=False, server_default="0")
 
 
 
@@ -45,6 +41,11 @@ class ReservationDTO(BaseModel):
     class Config:
         from_attributes = True
 
+
+class Page(BaseModel, Generic[T]):
+    items: List[T]
+    next_cursor: Optional[int] = None
+
 class UserType(str, Enum):
     PARTICIPANT = "participant"
     ORGANIZER = "organizer"
@@ -53,12 +54,19 @@ class User(Base):
     __tablename__ = "users"
 
     id = Column(Integer, primary_key=True)
-    username = Column(String)
+    username = Column(String, index=True)
     email = Column(String)
     user_type = Column(SQLAlchemyEnum(UserType))
+    # Version of the last applied user event, 0 when the event carried none
+    version = Column(Integer, nullable=False, server_default="0")
 
 class Reservation(Base):
     __tablename__ = "reservations"
+    # Listing filters paired with id so keyset pages come straight off the index
+    __table_args__ = (
+        Index("ix_reservations_participant_id_id", "participant_id", "id"),
+        Index("ix_reservations_activity_id_id", "activity_id", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     participant_id = Column(Integer)
@@ -66,4 +74,47 @@ class Reservation(Base):
     date = Column(String)
 
 
+class ReservationView(Base):
+    __tablename__ = "reservation_views"
+    # Denormalized read model of a participant's reservations, rewritten from
+    # reservations, activities and users whenever one of them changes. Rows go
+    # away with their reservation.
+    __table_args__ = (
+        Index("ix_reservation_views_participant_username_id", "participant_username", "reservation_id"),
+    )
+
+    reservation_id = Column(Integer, ForeignKey("reservations.id", ondelete="CASCADE"), primary_key=True)
+    participant_id = Column(Integer)
+    participant_username = Column(String)
+    activity_id = Column(Integer)
+    activity_name = Column(String)
+    category = Column(String)
+    price = Column(Float)
+    organizer_id = Column(Integer)
+    organizer_username = Column(String)
+    date = Column(String)
+
+
+class ActivitySeat(Base):
+    __tablename__ = "activity_seats"
+    # Free places of an activity split over a few rows, so concurrent bookings
+    # lock different rows. Seeded from the activity event that set them.
+
+    activity_id = Column(Integer, ForeignKey("activities.id", ondelete="CASCADE"), primary_key=True)
+    shard = Column(Integer, primary_key=True)
+    places = Column(Integer, nullable=False)
+    version = Column(Integer, nullable=False)
+
+
+class OutboxEvent(Base):
+    __tablename__ = "outbox_events"
+    # Written in the same transaction as the change it describes, the relay
+    # drains it in id order
+    id = Column(BigInteger, primary_key=True)
+    routing_key = Column(String)
+    payload = Column(LargeBinary)
+    content_type = Column(String, nullable=False, server_default="application/json")
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
 Base.metadata.create_all(bind=engine)
\ No newline at end of file
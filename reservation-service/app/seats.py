@@ -0,0 +1,90 @@
+import os
+from sqlalchemy import Integer, column, delete, func, select, update, values
+from sqlalchemy.dialects.postgresql import insert
+from models import Activity, ActivitySeat, Reservation
+
+# Bookings take a place with one conditional UPDATE ... WHERE places > 0, so the
+# last place goes to exactly one of them. A single counter row would make every
+# booking of a popular activity wait for the one before it to commit, so the
+# places are spread over SEAT_SHARDS rows and a booking takes a row nobody else
+# has locked. Activities without seat rows cannot be booked until an activity
+# event carrying reserved seeds them; activity-service's migration 0006
+# republishes every activity for that.
+SEAT_SHARDS = int(os.environ.get('SEAT_SHARDS', 8))
+
+
+def seed_seats(db, activities):
+    # activities are (id, total_places, reserved, version) from activity events.
+    # total_places is what the activity service has left after the reserved
+    # reservations it has seen, so together they are the capacity. Seat rows are
+    # replaced only by a newer version, with the capacity less the reservations
+    # made here, which counts the bookings the event did not know about yet.
+    # Replays keep the places taken since. Events without reserved cannot tell
+    # the capacity and only seed activities that have no seat rows.
+    ids = [id for id, _, _, _ in activities]
+    recount = [(id, version) for id, _, reserved, version in activities if reserved is not None]
+    if recount:
+        # Waits for bookings holding a seat row, so they are in the count below
+        events = values(column('id', Integer), column('version', Integer), name='events').data(recount)
+        db.execute(delete(ActivitySeat).where(ActivitySeat.activity_id == events.c.id, ActivitySeat.version < events.c.version))
+    seeded = set(db.scalars(select(ActivitySeat.activity_id).where(ActivitySeat.activity_id.in_(ids)).distinct()))
+    booked = dict(db.execute(
+        select(Reservation.activity_id, func.count()).where(Reservation.activity_id.in_(set(ids) - seeded)).group_by(Reservation.activity_id)
+    ).all())
+    rows = [
+        dict(activity_id=id, shard=shard, places=places, version=version)
+        for id, total_places, reserved, version in activities if id not in seeded
+        for shard, places in enumerate(split_places(
+            total_places if reserved is None else max(total_places + reserved - booked.get(id, 0), 0)))
+    ]
+    if rows:
+        db.execute(insert(ActivitySeat).values(rows).on_conflict_do_nothing())
+
+
+def split_places(total_places):
+    shards = max(1, min(SEAT_SHARDS, total_places))
+    return [total_places // shards + (1 if shard < total_places % shards else 0) for shard in range(shards)]
+
+
+async def take_seat(db, activity_id):
+    # Returns False when the activity is full, unknown or has no seat rows yet, the
+    # caller rolls back
+    taken = await db.scalar(_take(activity_id, skip_locked=True))
+    while taken is None:
+        # Every shard with places left is locked by another booking, wait for one
+        if not await db.scalar(select(func.count()).where(ActivitySeat.activity_id == activity_id, ActivitySeat.places > 0)):
+            break
+        taken = await db.scalar(_take(activity_id, skip_locked=False))
+    return taken is not None
+
+
+async def release_seat(db, activity_id):
+    shard = select(ActivitySeat.shard).where(ActivitySeat.activity_id == activity_id).order_by(ActivitySeat.places).limit(1)
+    await db.execute(
+        update(ActivitySeat)
+        .where(ActivitySeat.activity_id == activity_id, ActivitySeat.shard == shard.scalar_subquery())
+        .values(places=ActivitySeat.places + 1)
+    )
+
+
+async def seat_error(db, activity_id):
+    # Only runs after take_seat failed, to tell the two cases apart
+    if await db.scalar(select(Activity.id).where(Activity.id == activity_id)) is None:
+        return "Activity not found"
+    if await db.scalar(select(ActivitySeat.shard).where(ActivitySeat.activity_id == activity_id).limit(1)) is None:
+        return "Places of the activity are not known yet"
+    return "No places left"
+
+
+def _take(activity_id, skip_locked):
+    # The shard is picked and locked by the subquery, the UPDATE checks places
+    # again in case a blocking pick waited for a booking that took the last one
+    shard = select(ActivitySeat.shard).where(ActivitySeat.activity_id == activity_id, ActivitySeat.places > 0).limit(1)
+    if skip_locked:
+        shard = shard.with_for_update(skip_locked=True)
+    return (
+        update(ActivitySeat)
+        .where(ActivitySeat.activity_id == activity_id, ActivitySeat.shard == shard.scalar_subquery(), ActivitySeat.places > 0)
+        .values(places=ActivitySeat.places - 1)
+        .returning(ActivitySeat.shard)
+    )
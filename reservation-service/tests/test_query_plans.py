@@ -0,0 +1,30 @@
+import pytest
+from sqlalchemy import text
+
+
+@pytest.mark.parametrize("url, params, index", [
+    ("/reservations/", {}, None),
+    ("/reservations/", {"participant_id": 1}, "ix_reservations_participant_id_id"),
+    ("/reservations/", {"activity_id": [1]}, "ix_reservations_activity_id_id"),
+    ("/reservations/", {"participant_id": 1, "cursor": 10}, "ix_reservations_participant_id_id"),
+    ("/reservations/participant1", {}, "ix_reservation_views_participant_username_id"),
+])
+def test_listing_queries_do_not_scan_tables(main, db, client, query_plans, url, params, index):
+    # Enough participants and activities, analyzed, that the planner sees the
+    # filters as selective, as they are in production
+    db.add_all(main.User(id=id, username=f"participant{id}", email=f"participant{id}@example.com", user_type=main.UserType.PARTICIPANT) for id in range(1, 51))
+    db.add(main.User(id=100, username="organizer", email="organizer@example.com", user_type=main.UserType.ORGANIZER))
+    db.add_all(main.Activity(id=id, user_id=100, category="sport", price=10.0, name=f"activity {id}", description="") for id in range(1, 21))
+    db.add_all(main.Reservation(id=id, participant_id=id % 50 + 1, activity_id=id % 20 + 1, date="2026-05-01T10:00:00") for id in range(1, 1001))
+    db.flush()
+    db.execute(main.refresh_reservation_views(main.Reservation.id > 0))
+    db.commit()
+    db.execute(text("ANALYZE users, activities, reservations, reservation_views"))
+    db.commit()
+    plans = query_plans(lambda: client("GET", url, params=params))
+    for statement, plan in plans:
+        assert "Seq Scan" not in plan, f"{statement}\n{plan}"
+    # An id order scan that filters every row is no seq scan either, so the
+    # single column filters must use their own index
+    if index is not None:
+        assert any(f" {index} " in plan for _, plan in plans), "\n\n".join(plan for _, plan in plans)
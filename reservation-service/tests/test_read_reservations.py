@@ -0,0 +1,26 @@
+import pytest
+
+
+def add_reservations(main, db):
+    # One reservation a day through May 2026, at 10:00
+    db.add_all(main.Reservation(id=day, participant_id=1, activity_id=1, date=f"2026-05-{day:02d}T10:00:00") for day in range(1, 32))
+    db.commit()
+
+
+@pytest.mark.parametrize("params, days", [
+    ({"from_date": "2026-05-10T10:00:00", "to_date": "2026-05-12T10:00:00"}, [10, 11, 12]),
+    ({"from_date": "2026-05-10T10:00:01"}, list(range(11, 32))),
+    ({"to_date": "2026-05-03T09:59:59"}, [1, 2]),
+    ({"participant_id": 1, "from_date": "2026-05-30T00:00:00", "to_date": "2026-06-30T00:00:00"}, [30, 31]),
+])
+def test_listing_filters_by_date_range(main, db, client, params, days):
+    add_reservations(main, db)
+
+    response = client("GET", "/reservations/", params=params)
+    assert response.status_code == 200
+    assert [item["date"] for item in response.json()["items"]] == [f"2026-05-{day:02d}T10:00:00" for day in days]
+
+
+def test_malformed_date_is_rejected(main, db, client):
+    response = client("GET", "/reservations/", params={"from_date": "2026-05-10"})
+    assert response.status_code == 400
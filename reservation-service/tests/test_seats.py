@@ -0,0 +1,57 @@
+from datetime import datetime, timezone
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def outbox_relay(main, monkeypatch):
+    # Not started, the events booking writes stay in the outbox
+    monkeypatch.setattr(main, "outbox_relay", main.OutboxRelay(main.SessionLocal, None, main.outbox))
+
+
+def add_users(main, count):
+    main.apply_user_events(
+        [("created", {"id": 1, "username": "organizer", "email": "organizer@example.com", "user_type": "organizer", "version": 1})]
+        + [("created", {"id": id, "username": f"participant{id}", "email": f"participant{id}@example.com", "user_type": "participant", "version": 1}) for id in range(2, count + 2)]
+    )
+
+
+def activity(total_places, reserved, version=1):
+    return {
+        "id": 1, "user_id": 1, "category": "sport", "date": datetime(2026, 5, 1, 10, tzinfo=timezone.utc), "price": 10.0,
+        "name": "activity", "description": "", "total_places": total_places, "status": "available", "username": "organizer",
+        "version": version, "reserved": reserved,
+    }
+
+
+def book(client, participant):
+    return client("POST", "/reservations/", json={"participant_username": f"participant{participant}", "activity_id": 1})
+
+
+def test_activity_without_seat_rows_is_not_booked(main, db, client):
+    add_users(main, 3)
+    # Replicated before the events carried reserved: known, but its places are not
+    main.apply_activity_events([("created", activity(3, None))])
+    from models import ActivitySeat
+    db.execute(ActivitySeat.__table__.delete())
+    db.commit()
+
+    response = book(client, 2)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Places of the activity are not known yet"
+
+    # The event activity-service's migration republishes, at the same version,
+    # seeds the rows
+    main.apply_activity_events([("updated", activity(3, 0))])
+    assert [book(client, participant).status_code for participant in (2, 3, 4)] == [200, 200, 200]
+    assert book(client, 2).json()["detail"] == "No places left"
+
+
+def test_seeded_places_count_reservations_made_here(main, db, client):
+    add_users(main, 4)
+    main.apply_activity_events([("created", activity(4, 0))])
+    assert [book(client, participant).status_code for participant in (2, 3)] == [200, 200]
+
+    # activity-service has seen one of the two bookings, so it sends 3 left and 1
+    # reserved: the capacity is still 4, two places are left here
+    main.apply_activity_events([("updated", activity(3, 1, version=2))])
+    assert [book(client, participant).status_code for participant in (4, 5, 2)] == [200, 200, 400]
@@ -1,32 +1,39 @@
-import os
-from fastapi import FastAPI, Query, Depends
-from pydantic import BaseModel
-from sqlalchemy import create_engine, Column, Integer, String, Float, Date, or_
+from fastapi import FastAPI, HTTPException, Query, Depends, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import select, Column, Index, Integer, String, Float, Date, or_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
 from fuzzywuzzy import fuzz
-from typing import List, Optional
-from datetime import datetime
-
-DATABASE_HOSTNAME=os.environ.get('DATABASE_HOSTNAME')
-DATABASE_PORT=os.environ.get('DATABASE_PORT')
-DATABASE_NAME=os.environ.get('DATABASE_NAME')
-DATABASE_USERNAME=os.environ.get('DATABASE_USERNAME')
-DATABASE_PASSWORD=os.environ.get('DATABASE_PASSWORD')
-DATABASE_URL=f"postgresql://{DATABASE_USERNAME}:{DATABASE_PASSWORD}@{DATABASE_HOSTNAME}:{DATABASE_PORT}/{DATABASE_NAME}"
-
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+from typing import Dict, Generic, List, Optional, TypeVar
+from collections import Counter
+from datetime import date, datetime
+import logging
+from servicekit.logs import configure_logging
+from servicekit.instrumentation import PROMETHEUS, InstrumentationMiddleware, request_metrics, run_in_threadpool
+from servicekit.database import engine, get_async_db, get_read_db, read_session, replicas, pool_metrics, async_pool_metrics
+from servicekit.bulk import bulk_report, read_chunks, validation_detail
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
 Base = declarative_base()
 
 app = FastAPI()
+app.add_middleware(InstrumentationMiddleware)
+
+T = TypeVar("T")
+
+STREAM_BATCH_SIZE = 500
+STARS = range(1, 6)
 
 class ReviewDTO(BaseModel):
     text: str
     rating: int
     reviewer: int
     reviewee: int
-    date: str
+    date: date
 
     class Config:
         from_attributes = True
@@ -37,13 +44,29 @@ class ActivityReviewDTO(BaseModel):
     rating: int
     reviewer: int
     activity_id: int
-    date: str
+    date: date
 
     class Config:
         from_attributes = True
 
+class RatingDTO(BaseModel):
+    id: int
+    count: int
+    average: Optional[float] = None
+    histogram: Dict[int, int]
+
+
+class Page(BaseModel, Generic[T]):
+    items: List[T]
+    next_cursor: Optional[int] = None
+
 class ActivityReview(Base):
     __tablename__ = "activity_reviews"
+    # Listing filters paired with id so keyset pages come straight off the index
+    __table_args__ = (
+        Index("ix_activity_reviews_activity_id_id", "activity_id", "id"),
+        Index("ix_activity_reviews_reviewer_id", "reviewer", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     reviewer = Column(Integer)
@@ -55,6 +78,10 @@ class ActivityReview(Base):
 # SQLAlchemy model
 class UserReview(Base):
     __tablename__ = "user_reviews"
+    __table_args__ = (
+        Index("ix_user_reviews_reviewee_id", "reviewee", "id"),
+        Index("ix_user_reviews_reviewer_id", "reviewer", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     reviewer = Column(Integer)
@@ -63,215 +90,390 @@ class UserReview(Base):
     reviewee = Column(Integer)
     date = Column(Date)
 
+# Running totals of the reviews of a user or an activity, kept by the endpoints
+# that write reviews in the same transaction. subject is "user" or "activity".
+# Ratings outside 1-5 count towards count and sum only.
+class RatingSummary(Base):
+    __tablename__ = "rating_summaries"
+
+    subject = Column(String, primary_key=True)
+    subject_id = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    sum = Column(Integer, nullable=False, default=0)
+    stars_1 = Column(Integer, nullable=False, default=0)
+    stars_2 = Column(Integer, nullable=False, default=0)
+    stars_3 = Column(Integer, nullable=False, default=0)
+    stars_4 = Column(Integer, nullable=False, default=0)
+    stars_5 = Column(Integer, nullable=False, default=0)
+
 # Create tables if they don't exist
 Base.metadata.create_all(bind=engine)
 
-# Dependency to get the database session
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Fuzzy scoring is CPU bound, so a whole batch is scored in a worker thread and
+# the event loop keeps serving other requests meanwhile
+async def matching(batch, predicate):
+    if predicate is None:
+        return batch
+    return await run_in_threadpool(lambda: [review for review in batch if predicate(review)])
+
+
+# Keyset pagination on id. Rows rejected by the predicate (fuzzy search) are skipped
+# and the next batch is fetched until the page is full or the table runs out
+async def paginate(db, query, model, cursor, limit, predicate=None):
+    reviews = []
+    while len(reviews) <= limit:
+        batch_query = query if cursor is None else query.where(model.id > cursor)
+        batch = (await db.scalars(batch_query.order_by(model.id).limit(limit + 1))).all()
+        reviews.extend(await matching(batch, predicate))
+        if len(batch) <= limit:
+            break
+        cursor = batch[-1].id
+    next_cursor = reviews[limit - 1].id if len(reviews) > limit else None
+    return reviews[:limit], next_cursor
+
+
+# Adds (change=1) or takes back (change=-1) ratings, given as (subject_id, rating)
+# pairs, with a single upsert, so concurrent reviews of the same subject do not
+# lose updates
+async def count_ratings(db, subject, ratings, change=1):
+    counts = {}
+    for subject_id, rating in ratings:
+        row = counts.setdefault(subject_id, Counter())
+        row.update({"count": change, "sum": change * rating})
+        if rating in STARS:
+            row[f"stars_{rating}"] += change
+    columns = ["count", "sum", *(f"stars_{star}" for star in STARS)]
+    statement = insert(RatingSummary).values([
+        dict(subject=subject, subject_id=subject_id, **{column: row[column] for column in columns})
+        for subject_id, row in counts.items()
+    ])
+    await db.execute(statement.on_conflict_do_update(
+        index_elements=[RatingSummary.subject, RatingSummary.subject_id],
+        set_={column: getattr(RatingSummary, column) + statement.excluded[column] for column in columns},
+    ))
+
+
+async def read_ratings(db, subject, ids):
+    summaries = {summary.subject_id: summary for summary in await db.scalars(
+        select(RatingSummary).where(RatingSummary.subject == subject, RatingSummary.subject_id.in_(ids)))}
+    ratings = []
+    for id in dict.fromkeys(ids):
+        summary = summaries.get(id)
+        count = summary.count if summary is not None else 0
+        ratings.append(RatingDTO(
+            id=id,
+            count=count,
+            average=summary.sum / count if count else None,
+            histogram={star: getattr(summary, f"stars_{star}") if summary is not None else 0 for star in STARS},
+        ))
+    return ratings
+
+
+# Bulk create behind /reviews/user/bulk and /reviews/activity/bulk: a JSON array or
+# NDJSON of reviews, answered with a status per item. Every BULK_CHUNK_SIZE reviews
+# go in with one multi-row INSERT and one rating summary upsert and are committed
+# together, a failing chunk does not undo the others.
+async def create_reviews(request, db, model, dto, subject, subject_column):
+    report = []
+    async for chunk in read_chunks(request):
+        rows = []
+        for index, item in chunk:
+            try:
+                if isinstance(item, ValueError):
+                    raise HTTPException(status_code=400, detail="Invalid JSON")
+                review = dto.model_validate(item)
+                rows.append((index, review.model_dump()))
+            except ValidationError as e:
+                report.append({"index": index, "status": 400, "detail": validation_detail(e)})
+            except HTTPException as e:
+                report.append({"index": index, "status": e.status_code, "detail": e.detail})
+        if not rows:
+            continue
+        try:
+            ids = (await db.scalars(insert(model).returning(model.id, sort_by_parameter_order=True), [row for _, row in rows])).all()
+            await count_ratings(db, subject, [(row[subject_column], row["rating"]) for _, row in rows])
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            logger.error("Error saving %s reviews: %s", len(rows), e)
+            report.extend({"index": index, "status": 500, "detail": "Could not save review"} for index, _ in rows)
+            continue
+        report.extend({"index": index, "status": 201, "id": id} for (index, _), id in zip(rows, ids))
+    return bulk_report(report)
+
+
+# NDJSON stream of every review after the cursor. The request session is closed by
+# get_read_db before the body is sent, so the stream reads through its own session
+# with a server-side cursor
+async def stream_reviews(query, model, dto, cursor, predicate=None):
+    async with read_session() as db:
+        if cursor is not None:
+            query = query.where(model.id > cursor)
+        reviews = await db.stream_scalars(query.order_by(model.id).execution_options(yield_per=STREAM_BATCH_SIZE))
+        async for batch in reviews.partitions():
+            for review in await matching(batch, predicate):
+                yield dto.model_validate(review).model_dump_json() + "\n"
+
+
+@app.get("/metrics")
+async def read_metrics():
+    return Response(request_metrics.render(), media_type=PROMETHEUS)
+
+
+@app.get("/metrics/pool")
+async def read_pool_metrics():
+    return {"sync": pool_metrics.snapshot(), "async": async_pool_metrics.snapshot(), **replicas.snapshot()}
+
+
+@app.get("/reviews/user/ratings")
+async def read_user_ratings(ids: List[int] = Query(..., max_length=500), db: AsyncSession = Depends(get_read_db)):
+    return await read_ratings(db, "user", ids)
+
+
+@app.get("/reviews/activity/ratings")
+async def read_activity_ratings(ids: List[int] = Query(..., max_length=500), db: AsyncSession = Depends(get_read_db)):
+    return await read_ratings(db, "activity", ids)
 
 
 @app.get("/reviews/user")
-def read(
+async def read(
     reviewer: Optional[int] = None,
     reviewee: Optional[int] = None,
     from_rating: Optional[int] = None,
-    to_rating: Optional[str] = None,
+    to_rating: Optional[int] = None,
     from_date: Optional[str] = None,
     to_date: Optional[str] = None,
     search: Optional[str] = None,
     similarity_threshold: int = 70,
-    db: Session = Depends(get_db)
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[int] = None,
+    stream: bool = False,
+    db: AsyncSession = Depends(get_read_db)
 ):
-    query = db.query(UserReview)
+    query = select(UserReview)
 
     # Filter by user_id
     if reviewer is not None:
-        query = query.filter(UserReview.reviewer == reviewer)
+        query = query.where(UserReview.reviewer == reviewer)
 
     # Filter by multiple categories
     if reviewee is not None:
-        query = query.filter(UserReview.reviewee == reviewee)
+        query = query.where(UserReview.reviewee == reviewee)
 
     # Filter by date range
     if from_date is not None:
         from_date_dt = datetime.strptime(from_date, "%Y-%m-%d")
-        query = query.filter(UserReview.date >= from_date_dt)
+        query = query.where(UserReview.date >= from_date_dt)
 
     if to_date is not None:
         to_date_dt = datetime.strptime(to_date, "%Y-%m-%d")
-        query = query.filter(UserReview.date <= to_date_dt)
+        query = query.where(UserReview.date <= to_date_dt)
 
     # Filter by price range
     if from_rating is not None:
-        query = query.filter(UserReview.rating >= from_rating)
+        query = query.where(UserReview.rating >= from_rating)
 
     if to_rating is not None:
-        query = query.filter(UserReview.rating <= to_rating)
+        query = query.where(UserReview.rating <= to_rating)
 
     # Fuzzy search in name and description
+    predicate = None
     if search is not None:
-        reviews = query.all()
-        filtered_reviews = list(filter(
-            lambda x: fuzz.partial_ratio(search.lower(), x.text.lower()) >= similarity_threshold, 
-            reviews
-        ))
-    else:
-        filtered_reviews = query.all()
+        predicate = lambda x: fuzz.partial_ratio(search.lower(), x.text.lower()) >= similarity_threshold
 
-    return [ReviewDTO.model_validate(review) for review in filtered_reviews]
+    if stream:
+        return StreamingResponse(
+            stream_reviews(query, UserReview, ReviewDTO, cursor, predicate),
+            media_type="application/x-ndjson"
+        )
+    reviews, next_cursor = await paginate(db, query, UserReview, cursor, limit, predicate)
+    return Page(items=[ReviewDTO.model_validate(review) for review in reviews], next_cursor=next_cursor)
 
 
 # ovo treba da publishuje event UserReviewCreated koji se prima od strane Notification servisa i onda notification servis tipa preko websocketa salje notifikaciju korisnicima
 @app.post("/reviews/user")
-def create(review: ReviewDTO, db: Session = Depends(get_db)):
+async def create(review: ReviewDTO, db: AsyncSession = Depends(get_async_db)):
     db_review = UserReview(
         reviewer=review.reviewer,
         reviewee=review.reviewee,
-        date=datetime.strptime(review.date, "%Y-%m-%d"),
+        date=review.date,
         rating=review.rating,
         text=review.text,
     )
     db.add(db_review)
-    db.commit()
-    db.refresh(db_review)
+    await count_ratings(db, "user", [(review.reviewee, review.rating)])
+    await db.commit()
+    await db.refresh(db_review)
     # TODO: Publish event UserReviewCreated
     return review
 
 
+@app.post("/reviews/user/bulk")
+async def create_bulk(request: Request, db: AsyncSession = Depends(get_async_db)):
+    return await create_reviews(request, db, UserReview, ReviewDTO, "user", "reviewee")
+
+
 # ovo treba da publishuje event UserReviewDeleted koji se prima od strane Notification servisa
 @app.delete("/reviews/user/{review_id}")
-def delete(review_id: int, db: Session = Depends(get_db)):
-    db_review = db.query(UserReview).filter(UserReview.id == review_id).first()
-    db.delete(db_review)
-    db.commit()
+async def delete(review_id: int, db: AsyncSession = Depends(get_async_db)):
+    # The row stays locked until commit, so a concurrent update or delete of the same
+    # review cannot take its old rating back twice
+    db_review = await db.scalar(select(UserReview).where(UserReview.id == review_id).with_for_update())
+    if db_review is None:
+        raise HTTPException(status_code=404, detail="Review not found")
+    await count_ratings(db, "user", [(db_review.reviewee, db_review.rating)], -1)
+    await db.delete(db_review)
+    await db.commit()
     return {"message": f"Review with id: [{review_id}] deleted successfully"}
 
 
 
 @app.put("/reviews/user/{review_id}")
-def update(review_id: int, review: ReviewDTO, db: Session = Depends(get_db)):
-    db_review = db.query(UserReview).filter(UserReview.id == review_id).first()
+async def update(review_id: int, review: ReviewDTO, db: AsyncSession = Depends(get_async_db)):
+    db_review = await db.scalar(select(UserReview).where(UserReview.id == review_id).with_for_update())
+    if db_review is None:
+        raise HTTPException(status_code=404, detail="Review not found")
+    await count_ratings(db, "user", [(db_review.reviewee, db_review.rating)], -1)
+    await count_ratings(db, "user", [(review.reviewee, review.rating)])
     db_review.reviewer = review.reviewer
     db_review.reviewee = review.reviewee
-    db_review.date = datetime.strptime(review.date, "%Y-%m-%d")
+    db_review.date = review.date
     db_review.rating = review.rating
     db_review.text = review.text
-    db.commit()
-    db.refresh(db_review)
+    await db.commit()
+    await db.refresh(db_review)
     return review
 
 
 
 @app.get("/reviews/activity")
-def read(
+async def read(
     reviewer: Optional[int] = None,
     activity_id: Optional[int] = None,
     from_rating: Optional[int] = None,
-    to_rating: Optional[str] = None,
+    to_rating: Optional[int] = None,
     from_date: Optional[str] = None,
     to_date: Optional[str] = None,
     search: Optional[str] = None,
     similarity_threshold: int = 70,
-    db: Session = Depends(get_db)
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[int] = None,
+    stream: bool = False,
+    db: AsyncSession = Depends(get_read_db)
 ):
-    query = db.query(ActivityReview)
+    query = select(ActivityReview)
 
     # Filter by user_id
     if reviewer is not None:
-        query = query.filter(ActivityReview.reviewer == reviewer)
+        query = query.where(ActivityReview.reviewer == reviewer)
 
     # Filter by multiple categories
     if activity_id is not None:
-        query = query.filter(ActivityReview.activity_id == activity_id)
+        query = query.where(ActivityReview.activity_id == activity_id)
 
     # Filter by date range
     if from_date is not None:
         from_date_dt = datetime.strptime(from_date, "%Y-%m-%d")
-        query = query.filter(ActivityReview.date >= from_date_dt)
+        query = query.where(ActivityReview.date >= from_date_dt)
 
     if to_date is not None:
         to_date_dt = datetime.strptime(to_date, "%Y-%m-%d")
-        query = query.filter(ActivityReview.date <= to_date_dt)
+        query = query.where(ActivityReview.date <= to_date_dt)
 
     # Filter by price range
     if from_rating is not None:
-        query = query.filter(ActivityReview.rating >= from_rating)
+        query = query.where(ActivityReview.rating >= from_rating)
 
     if to_rating is not None:
-        query = query.filter(ActivityReview.rating <= to_rating)
+        query = query.where(ActivityReview.rating <= to_rating)
 
     # Fuzzy search in name and description
+    predicate = None
     if search is not None:
-        reviews = query.all()
-        filtered_reviews = list(filter(
-            lambda x: fuzz.partial_ratio(search.lower(), x.text.lower()) >= similarity_threshold, 
-            reviews
-        ))
-    else:
-        filtered_reviews = query.all()
+        predicate = lambda x: fuzz.partial_ratio(search.lower(), x.text.lower()) >= similarity_threshold
 
-    return [ActivityReviewDTO.model_validate(review) for review in filtered_reviews]
+    if stream:
+        return StreamingResponse(
+            stream_reviews(query, ActivityReview, ActivityReviewDTO, cursor, predicate),
+            media_type="application/x-ndjson"
+        )
+    reviews, next_cursor = await paginate(db, query, ActivityReview, cursor, limit, predicate)
+    return Page(items=[ActivityReviewDTO.model_validate(review) for review in reviews], next_cursor=next_cursor)
 
 
 # ovo treba da publishuje event ActivityReviewCreated koji se prima od strane Notification servisa
 @app.post("/reviews/activity")
-def create(review: ActivityReviewDTO, db: Session = Depends(get_db)):
+async def create(review: ActivityReviewDTO, db: AsyncSession = Depends(get_async_db)):
     db_review = ActivityReview(
         reviewer=review.reviewer,
         activity_id=review.activity_id,
-        date=datetime.strptime(review.date, "%Y-%m-%d"),
+        date=review.date,
         rating=review.rating,
         text=review.text,
     )
     db.add(db_review)
-    db.commit()
-    db.refresh(db_review)
+    await count_ratings(db, "activity", [(review.activity_id, review.rating)])
+    await db.commit()
+    await db.refresh(db_review)
     # TODO: Publish event ActivityReviewCreated
     return review
 
 
+@app.post("/reviews/activity/bulk")
+async def create_bulk(request: Request, db: AsyncSession = Depends(get_async_db)):
+    return await create_reviews(request, db, ActivityReview, ActivityReviewDTO, "activity", "activity_id")
+
+
 # ovo treba da publishuje event ActivityReviewDeleted koji se prima od strane Notification servisa
 @app.delete("/reviews/activity/{review_id}")
-def delete(review_id: int, db: Session = Depends(get_db)):
-    db_review = db.query(ActivityReview).filter(ActivityReview.id == review_id).first()
-    db.delete(db_review)
-    db.commit()
+async def delete(review_id: int, db: AsyncSession = Depends(get_async_db)):
+    db_review = await db.scalar(select(ActivityReview).where(ActivityReview.id == review_id).with_for_update())
+    if db_review is None:
+        raise HTTPException(status_code=404, detail="Review not found")
+    await count_ratings(db, "activity", [(db_review.activity_id, db_review.rating)], -1)
+    await db.delete(db_review)
+    await db.commit()
     return {"message": f"Review with id: [{review_id}] deleted successfully"}
 
 
 
 @app.put("/reviews/activity/{review_id}")
-def update(review_id: int, review: ActivityReviewDTO, db: Session = Depends(get_db)):
-    db_review = db.query(ActivityReview).filter(ActivityReview.id == review_id).first()
+async def update(review_id: int, review: ActivityReviewDTO, db: AsyncSession = Depends(get_async_db)):
+    db_review = await db.scalar(select(ActivityReview).where(ActivityReview.id == review_id).with_for_update())
+    if db_review is None:
+        raise HTTPException(status_code=404, detail="Review not found")
+    await count_ratings(db, "activity", [(db_review.activity_id, db_review.rating)], -1)
+    await count_ratings(db, "activity", [(review.activity_id, review.rating)])
     db_review.reviewer = review.reviewer
     db_review.activity_id = review.activity_id
-    db_review.date = datetime.strptime(review.date, "%Y-%m-%d")
+    db_review.date = review.date
     db_review.rating = review.rating
     db_review.text = review.text
-    db.commit()
-    db.refresh(db_review)
+    await db.commit()
+    await db.refresh(db_review)
     return review
 
 # ovo treba da publishuje event ActivityReviewsDeleted koji se prima od strane Activity servisa
 # i da se pokrece kada se pozove delete na /activities/{activity_id} odnosno da je subscriber na event StartActivityDelete
 @app.delete("/reviews/activity/{activity_id}")
-def delete_reviews_activity(activity_id: int, db: Session = Depends(get_db)):
-    db_activity = db.query(ActivityReview).filter(ActivityReview.activity_id == activity_id).first()
-    db.delete(db_activity)
-    db.commit()
+async def delete_reviews_activity(activity_id: int, db: AsyncSession = Depends(get_async_db)):
+    db_activity = await db.scalar(select(ActivityReview).where(ActivityReview.activity_id == activity_id).with_for_update())
+    if db_activity is None:
+        raise HTTPException(status_code=404, detail="Review not found")
+    await count_ratings(db, "activity", [(db_activity.activity_id, db_activity.rating)], -1)
+    await db.delete(db_activity)
+    await db.commit()
     return {"message": f"Activity reviews with id: [{activity_id}] deleted successfully"}
 
 # ovo treba da publishuje event UserReviewsDeleted koji se prima od strane User servisa
 # i da se pokrece kada se pozove delete na /users/{user_id} odnosno da je subscriber na event StartUserDelete
 @app.delete("/reviews/user/{user_id}")
-def delete_reviews_user(user_id: int, db: Session = Depends(get_db)):
-    db_user = db.query(UserReview).filter(UserReview.reviewee == user_id).first()
-    db.delete(db_user)
-    db.commit()
+async def delete_reviews_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    db_user = await db.scalar(select(UserReview).where(UserReview.reviewee == user_id).with_for_update())
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="Review not found")
+    await count_ratings(db, "user", [(db_user.reviewee, db_user.rating)], -1)
+    await db.delete(db_user)
+    await db.commit()
     return {"message": f"User reviews with id: [{user_id}] deleted successfully"}
 
@@ -0,0 +1,32 @@
+"""indexes for listing and replication filters
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 11:00:00
+
+"""
+from alembic import op
+
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+INDEXES = [
+    ('ix_user_reviews_reviewee_id', 'user_reviews', ['reviewee', 'id']),
+    ('ix_user_reviews_reviewer_id', 'user_reviews', ['reviewer', 'id']),
+    ('ix_activity_reviews_activity_id_id', 'activity_reviews', ['activity_id', 'id']),
+    ('ix_activity_reviews_reviewer_id', 'activity_reviews', ['reviewer', 'id']),
+]
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, if_not_exists=True)
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table, if_exists=True)
@@ -0,0 +1,48 @@
+"""rating summaries of users and activities
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 17:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+SUBJECTS = [
+    ('user', 'user_reviews', 'reviewee'),
+    ('activity', 'activity_reviews', 'activity_id'),
+]
+
+
+def upgrade():
+    if not sa.inspect(op.get_bind()).has_table('rating_summaries'):
+        op.create_table(
+            'rating_summaries',
+            sa.Column('subject', sa.String(), primary_key=True),
+            sa.Column('subject_id', sa.Integer(), primary_key=True),
+            sa.Column('count', sa.Integer(), nullable=False),
+            sa.Column('sum', sa.Integer(), nullable=False),
+            *[sa.Column(f'stars_{star}', sa.Integer(), nullable=False) for star in range(1, 6)],
+        )
+    # Totals of the reviews written so far, the endpoints keep them up to date from here on
+    for subject, table, column in SUBJECTS:
+        stars = ', '.join(f'count(*) FILTER (WHERE rating = {star})' for star in range(1, 6))
+        op.execute(f"""
+            INSERT INTO rating_summaries (subject, subject_id, count, sum, stars_1, stars_2, stars_3, stars_4, stars_5)
+            SELECT '{subject}', {column}, count(*), coalesce(sum(rating), 0), {stars}
+            FROM {table}
+            WHERE {column} IS NOT NULL
+            GROUP BY {column}
+            ON CONFLICT (subject, subject_id) DO NOTHING
+        """)
+
+
+def downgrade():
+    op.drop_table('rating_summaries')
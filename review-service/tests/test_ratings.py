@@ -0,0 +1,45 @@
+import asyncio
+import httpx
+import pytest
+
+
+def review(url, rating):
+    subject = {"/reviews/user": {"reviewee": 1}, "/reviews/activity": {"activity_id": 1}}[url]
+    return {"text": "review", "rating": rating, "reviewer": 2, "date": "2026-05-01", **subject}
+
+
+def send_together(main, async_engine, requests):
+    # Sends the requests at once on one event loop, so their transactions overlap
+    async def send():
+        try:
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+                return await asyncio.gather(*[client.request(method, url, **kwargs) for method, url, kwargs in requests])
+        finally:
+            await async_engine.dispose()
+    return asyncio.run(send())
+
+
+@pytest.mark.parametrize("url", ["/reviews/user", "/reviews/activity"])
+def test_summary_follows_updates_and_deletes(main, db, client, url):
+    for rating in (5, 3):
+        assert client("POST", url, json=review(url, rating)).status_code == 200
+    assert client("PUT", f"{url}/1", json=review(url, 1)).status_code == 200
+    assert client("DELETE", f"{url}/2").status_code == 200
+
+    ratings = client("GET", f"{url}/ratings", params={"ids": [1]}).json()
+    assert ratings == [{"id": 1, "count": 1, "average": 1.0, "histogram": {"1": 1, "2": 0, "3": 0, "4": 0, "5": 0}}]
+
+
+@pytest.mark.parametrize("url", ["/reviews/user", "/reviews/activity"])
+def test_missing_review_is_not_found(main, db, client, url):
+    assert client("PUT", f"{url}/1", json=review(url, 4)).status_code == 404
+    assert client("DELETE", f"{url}/1").status_code == 404
+
+
+@pytest.mark.parametrize("url", ["/reviews/user", "/reviews/activity"])
+def test_concurrent_deletes_take_the_rating_back_once(main, async_engine, db, client, url):
+    assert client("POST", url, json=review(url, 5)).status_code == 200
+
+    responses = send_together(main, async_engine, [("DELETE", f"{url}/1", {})] * 5)
+    assert sorted(response.status_code for response in responses) == [200, 404, 404, 404, 404]
+    assert client("GET", f"{url}/ratings", params={"ids": [1]}).json()[0]["count"] == 0
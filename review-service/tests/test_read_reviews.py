@@ -0,0 +1,57 @@
+import json
+from datetime import date
+import pytest
+
+
+def add_reviews(main, db, count):
+    # Half of the reviews are of user and activity 1, the listings below ask for those
+    db.add_all(main.UserReview(reviewer=id + 10, reviewee=id % 2 + 1, text=f"review {id}", rating=id % 5 + 1, date=date(2026, 5, id % 28 + 1)) for id in range(count))
+    db.add_all(main.ActivityReview(reviewer=id + 10, activity_id=id % 2 + 1, text=f"review {id}", rating=id % 5 + 1, date=date(2026, 5, id % 28 + 1)) for id in range(count))
+    db.commit()
+
+
+@pytest.mark.parametrize("url, params", [
+    ("/reviews/user", {"reviewee": 1}),
+    ("/reviews/activity", {"activity_id": 1}),
+])
+def test_page_and_stream_return_the_matching_reviews(main, db, client, url, params):
+    add_reviews(main, db, 40)
+    expected = [
+        {"text": f"review {id}", "rating": id % 5 + 1, "reviewer": id + 10, **{key: 1 for key in params}, "date": f"2026-05-{id % 28 + 1:02d}"}
+        for id in range(0, 40, 2)
+    ]
+
+    page = client("GET", url, params=params)
+    assert page.status_code == 200
+    assert page.json() == {"items": expected, "next_cursor": None}
+
+    stream = client("GET", url, params={**params, "stream": True})
+    assert stream.status_code == 200
+    assert [json.loads(line) for line in stream.text.splitlines()] == expected
+
+
+@pytest.mark.parametrize("url, params", [
+    ("/reviews/user", {"reviewee": 1}),
+    ("/reviews/activity", {"activity_id": 1}),
+    # The search drops most rows of each batch, pages are filled from further batches
+    ("/reviews/user", {"search": "review 1", "similarity_threshold": 100}),
+])
+def test_pages_follow_next_cursor_to_the_last_review(main, db, client, url, params):
+    add_reviews(main, db, 250)
+    every = client("GET", url, params={**params, "stream": True})
+    expected = [json.loads(line) for line in every.text.splitlines()]
+    assert len(expected) > 30
+
+    items, pages, cursor = [], 0, None
+    while True:
+        response = client("GET", url, params={**params, "limit": 7, **({"cursor": cursor} if cursor is not None else {})})
+        assert response.status_code == 200
+        page = response.json()
+        assert len(page["items"]) == 7 or page["next_cursor"] is None
+        items.extend(page["items"])
+        pages += 1
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert items == expected
+    assert pages == -(-len(expected) // 7)
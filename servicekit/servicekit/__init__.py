@@ -0,0 +1,2 @@
+# Modules are imported one by one: servicekit.database creates its engines from
+# the DATABASE_* variables when it is imported
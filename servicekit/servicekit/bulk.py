@@ -0,0 +1,65 @@
+import json
+import os
+from fastapi import HTTPException
+
+NDJSON = "application/x-ndjson"
+BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE', 500))
+
+
+async def read_items(request):
+    # A JSON array, or NDJSON read off the request stream line by line so a large
+    # import is never held in memory as one body. Lines that are not JSON come
+    # through as ValueError so they get a status of their own.
+    if request.headers.get("content-type", "").startswith(NDJSON):
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield _parse_line(line)
+        if buffer.strip():
+            yield _parse_line(buffer)
+        return
+    try:
+        items = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid request body")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array or NDJSON")
+    for item in items:
+        yield item
+
+
+async def read_chunks(request, size=BULK_CHUNK_SIZE):
+    # Lists of (index, item), each one is validated and written in its own transaction
+    chunk = []
+    index = 0
+    async for item in read_items(request):
+        chunk.append((index, item))
+        index += 1
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _parse_line(line):
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return e
+
+
+def validation_detail(error):
+    return "; ".join(f"{'.'.join(map(str, detail['loc'])) or 'item'}: {detail['msg']}" for detail in error.errors())
+
+
+def bulk_report(items):
+    items.sort(key=lambda item: item["index"])
+    return {
+        "created": sum(item["status"] == 201 for item in items),
+        "failed": sum(item["status"] != 201 for item in items),
+        "items": items,
+    }
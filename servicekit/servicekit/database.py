@@ -0,0 +1,268 @@
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from .instrumentation import instrument_engine
+
+
+DATABASE_HOSTNAME=os.environ.get('DATABASE_HOSTNAME')
+DATABASE_PORT=os.environ.get('DATABASE_PORT')
+DATABASE_NAME=os.environ.get('DATABASE_NAME')
+DATABASE_USERNAME=os.environ.get('DATABASE_USERNAME')
+DATABASE_PASSWORD=os.environ.get('DATABASE_PASSWORD')
+# The driver is named, SQLAlchemy 2.1 picks psycopg 3 for a bare postgresql://
+DATABASE_URL=f"postgresql+psycopg2://{DATABASE_USERNAME}:{DATABASE_PASSWORD}@{DATABASE_HOSTNAME}:{DATABASE_PORT}/{DATABASE_NAME}"
+ASYNC_DATABASE_URL = DATABASE_URL.replace("postgresql+psycopg2://", "postgresql+asyncpg://", 1)
+# Comma separated postgresql:// URLs of read replicas, empty to read from the primary only
+DATABASE_REPLICA_URLS = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+DATABASE_REPLICA_RETRY_SECONDS = float(os.environ.get('DATABASE_REPLICA_RETRY_SECONDS', 10))
+
+logger = logging.getLogger(__name__)
+
+
+class PoolConfig:
+    # Every process holds one sync and one async pool, so the connections a
+    # replica can open are 2 * (pool_size + max_overflow)
+    def __init__(self, pool_size=5, max_overflow=10, pool_timeout=30, pool_recycle=1800, pool_pre_ping=True):
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_timeout = pool_timeout
+        self.pool_recycle = pool_recycle
+        self.pool_pre_ping = pool_pre_ping
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            pool_size=int(os.environ.get('DATABASE_POOL_SIZE', 5)),
+            max_overflow=int(os.environ.get('DATABASE_MAX_OVERFLOW', 10)),
+            pool_timeout=float(os.environ.get('DATABASE_POOL_TIMEOUT', 30)),
+            pool_recycle=int(os.environ.get('DATABASE_POOL_RECYCLE', 1800)),
+            pool_pre_ping=os.environ.get('DATABASE_POOL_PRE_PING', 'true').lower() == 'true',
+        )
+
+
+class PoolMetrics:
+    def __init__(self, name):
+        self.name = name
+        self.engine = None
+        self.max_overflow = 0
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+        self.connections_opened = 0
+        self.connections_closed = 0
+        self.connections_invalidated = 0
+
+    def attach(self, engine, config):
+        self.engine = engine
+        self.max_overflow = config.max_overflow
+        event.listen(engine, "connect", self._on_connect)
+        event.listen(engine, "close", self._on_close)
+        event.listen(engine, "close_detached", self._on_close)
+        event.listen(engine, "invalidate", self._on_invalidate)
+
+    def record_checkout(self, seconds):
+        with self.lock:
+            self.checkouts += 1
+            self.checkout_wait_total += seconds
+            self.checkout_wait_max = max(self.checkout_wait_max, seconds)
+
+    def snapshot(self):
+        pool = self.engine.pool
+        capacity = pool.size() + self.max_overflow
+        checked_out = pool.checkedout()
+        with self.lock:
+            return {
+                "pool_size": pool.size(),
+                "max_overflow": self.max_overflow,
+                "checked_out": checked_out,
+                "checked_in": pool.checkedin(),
+                "overflow": max(pool.overflow(), 0),
+                "saturation": checked_out / capacity if capacity > 0 else 0.0,
+                "checkouts": self.checkouts,
+                "checkout_wait_avg_ms": self.checkout_wait_total / self.checkouts * 1000 if self.checkouts else 0.0,
+                "checkout_wait_max_ms": self.checkout_wait_max * 1000,
+                "connections_opened": self.connections_opened,
+                "connections_closed": self.connections_closed,
+                "connections_invalidated": self.connections_invalidated,
+            }
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self.lock:
+            self.connections_opened += 1
+
+    def _on_close(self, dbapi_connection, *args):
+        with self.lock:
+            self.connections_closed += 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self.lock:
+            self.connections_invalidated += 1
+
+
+def _timed_pool(pool_class, metrics):
+    # Times Pool.connect, which is what a session waits on for a connection,
+    # including queueing for a free slot, pre-ping and opening new connections
+    class TimedPool(pool_class):
+        def connect(self):
+            start = time.perf_counter()
+            try:
+                return super().connect()
+            finally:
+                metrics.record_checkout(time.perf_counter() - start)
+    return TimedPool
+
+
+def _pool_arguments(config, pool_class, metrics):
+    return dict(
+        poolclass=_timed_pool(pool_class, metrics),
+        pool_size=config.pool_size,
+        max_overflow=config.max_overflow,
+        pool_timeout=config.pool_timeout,
+        pool_recycle=config.pool_recycle,
+        pool_pre_ping=config.pool_pre_ping,
+    )
+
+
+def create_db_engine(url, config, metrics):
+    engine = create_engine(url, **_pool_arguments(config, QueuePool, metrics))
+    metrics.attach(engine, config)
+    instrument_engine(engine)
+    return engine
+
+
+def create_async_db_engine(url, config, metrics):
+    engine = create_async_engine(url, **_pool_arguments(config, AsyncAdaptedQueuePool, metrics))
+    metrics.attach(engine.sync_engine, config)
+    instrument_engine(engine.sync_engine)
+    return engine
+
+
+class Replica:
+    def __init__(self, url, config, name):
+        self.host = urlsplit(url).hostname
+        self.metrics = PoolMetrics(name)
+        self.engine = create_async_db_engine(url.replace("postgresql://", "postgresql+asyncpg://", 1), config, self.metrics)
+        self.sessionmaker = async_sessionmaker(self.engine, autoflush=False, expire_on_commit=False)
+        self.down_until = 0.0
+        self.failures = 0
+
+    def healthy(self):
+        return self.down_until <= time.monotonic()
+
+    def mark_down(self, error, retry_seconds):
+        # Skipped until retry_seconds have passed, the next request that picks it is the probe
+        self.down_until = time.monotonic() + retry_seconds
+        self.failures += 1
+        logger.error("Replica %s is unavailable, retrying in %ss: %s", self.host, retry_seconds, error)
+
+    def snapshot(self):
+        return {"host": self.host, "healthy": self.healthy(), "failures": self.failures, **self.metrics.snapshot()}
+
+
+class ReplicaSet:
+    # Read-only sessions go round robin over the replicas that are up. A replica
+    # that fails to hand out a connection is marked down and the read moves on to
+    # the next one, then to the primary, so reads keep working without replicas.
+    # Replicas lag behind the primary, handlers that read their own writes stay
+    # on get_async_db.
+    def __init__(self, urls, config, retry_seconds=DATABASE_REPLICA_RETRY_SECONDS):
+        self.replicas = [Replica(url, config, f"replica-{index}") for index, url in enumerate(urls)]
+        self.retry_seconds = retry_seconds
+        self.turns = itertools.count()
+        self.primary_reads = 0
+
+    def candidates(self):
+        if not self.replicas:
+            return []
+        start = next(self.turns)
+        ordered = [self.replicas[(start + offset) % len(self.replicas)] for offset in range(len(self.replicas))]
+        return [replica for replica in ordered if replica.healthy()]
+
+    @asynccontextmanager
+    async def session(self, fallback):
+        for replica in self.candidates():
+            db = replica.sessionmaker()
+            try:
+                # Checks a connection out now, so a dead replica fails here and not in the handler
+                await db.connection()
+            except Exception as e:
+                await db.close()
+                replica.mark_down(e, self.retry_seconds)
+                continue
+            # Lets caches of primary data tell that the rows may be behind
+            db.info["replica"] = replica.host
+            try:
+                yield db
+            finally:
+                await db.close()
+            return
+        self.primary_reads += 1
+        async with fallback() as db:
+            yield db
+
+    def snapshot(self):
+        return {"primary_reads": self.primary_reads, "replicas": [replica.snapshot() for replica in self.replicas]}
+
+    async def dispose(self):
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+
+pool_config = PoolConfig.from_env()
+pool_metrics = PoolMetrics("sync")
+async_pool_metrics = PoolMetrics("async")
+
+# Consumer threads, create_all and migrations use the blocking engine,
+# request handlers use asyncpg
+engine = create_db_engine(DATABASE_URL, pool_config, pool_metrics)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_db_engine(ASYNC_DATABASE_URL, pool_config, async_pool_metrics)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+replicas = ReplicaSet(DATABASE_REPLICA_URLS, pool_config)
+
+
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def read_session():
+    # Session on a replica for reads that can be a little behind, the primary when none is up
+    return replicas.session(AsyncSessionLocal)
+
+
+async def get_read_db():
+    async with read_session() as db:
+        yield db
+
+
+def upsert(db, model, rows):
+    # One INSERT ... ON CONFLICT (id) DO UPDATE for all rows, ids have to be unique.
+    # Rows carrying a version only replace rows with the same or an older one, so
+    # redelivered and out of order events are skipped by the same statement.
+    # Returns how many rows were written.
+    statement = insert(model).values(rows)
+    where = model.__table__.c.version <= statement.excluded.version if 'version' in rows[0] else None
+    return len(db.execute(statement.on_conflict_do_update(
+        index_elements=[model.id],
+        set_={column: statement.excluded[column] for column in rows[0] if column != 'id'},
+        where=where,
+    ).returning(model.id)).all())
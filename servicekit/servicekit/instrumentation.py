@@ -0,0 +1,230 @@
+import bisect
+import contextvars
+import os
+import threading
+import time
+from sqlalchemy import event
+from starlette.concurrency import run_in_threadpool as starlette_run_in_threadpool
+
+
+# Adds a Server-Timing header with the handler, SQL and threadpool wait times to every response
+SERVER_TIMING = os.environ.get('SERVER_TIMING', 'false').lower() == 'true'
+PROMETHEUS = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+
+current_request = contextvars.ContextVar("current_request", default=None)
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _header(name, type, help):
+    return [f"# HELP {name} {help}", f"# TYPE {name} {type}"]
+
+
+def _histogram_series(name, label_names, values, buckets, counts, total):
+    lines = []
+    cumulative = 0
+    for bound, count in zip([*buckets, "+Inf"], counts):
+        cumulative += count
+        labels = _labels(label_names, values, f'le="{bound}"')
+        lines.append(f"{name}_bucket{labels} {cumulative}")
+    lines.append(f"{name}_sum{_labels(label_names, values)} {total}")
+    lines.append(f"{name}_count{_labels(label_names, values)} {cumulative}")
+    return lines
+
+
+class Histogram:
+    def __init__(self, name, help, label_names, buckets):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        # label values -> (count per bucket with one for +Inf, sum)
+        self.series = {}
+
+    def observe(self, values, amount):
+        index = bisect.bisect_left(self.buckets, amount)
+        with self.lock:
+            counts, total = self.series.get(values) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[index] += 1
+            self.series[values] = (counts, total + amount)
+
+    def render(self):
+        lines = _header(self.name, "histogram", self.help)
+        with self.lock:
+            series = [(values, list(counts), total) for values, (counts, total) in self.series.items()]
+        for values, counts, total in sorted(series):
+            lines.extend(_histogram_series(self.name, self.label_names, values, self.buckets, counts, total))
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help, label_names=()):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def increment(self, values=(), amount=1):
+        with self.lock:
+            self.values[values] = self.values.get(values, 0) + amount
+
+    def render(self):
+        lines = _header(self.name, "counter", self.help)
+        with self.lock:
+            values = sorted(self.values.items())
+        lines.extend(f"{self.name}{_labels(self.label_names, labels)} {value}" for labels, value in values)
+        return lines
+
+
+class RequestStats:
+    # What one request spent in SQL and waiting for a threadpool worker, filled in
+    # by the engine hooks and run_in_threadpool through current_request
+    def __init__(self):
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.queue_seconds = 0.0
+
+    def server_timing(self, seconds):
+        return (
+            f"app;dur={seconds * 1000:.1f}, "
+            f"db;dur={self.sql_seconds * 1000:.1f};desc=\"{self.sql_statements} statements\", "
+            f"queue;dur={self.queue_seconds * 1000:.1f}"
+        )
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.latency = Histogram("http_request_duration_seconds", "Time until the response body was sent", ("method", "route", "status"), LATENCY_BUCKETS)
+        self.sql_statements = Histogram("http_request_sql_statements", "SQL statements executed per request", ("method", "route"), COUNT_BUCKETS)
+        self.sql_duration = Histogram("http_request_sql_duration_seconds", "Time per request spent executing SQL", ("method", "route"), LATENCY_BUCKETS)
+        self.queue_wait = Histogram("threadpool_queue_wait_seconds", "Time a call waited for a threadpool worker", (), WAIT_BUCKETS)
+        # Statements of consumer threads and background tasks are only in the totals
+        self.statements_total = Counter("sql_statements_total", "SQL statements executed")
+        self.sql_seconds_total = Counter("sql_duration_seconds_total", "Time spent executing SQL")
+
+    def observe_request(self, method, route, status, seconds, stats):
+        self.latency.observe((method, route, str(status)), seconds)
+        self.sql_statements.observe((method, route), stats.sql_statements)
+        self.sql_duration.observe((method, route), stats.sql_seconds)
+
+    def observe_statement(self, seconds):
+        self.statements_total.increment()
+        self.sql_seconds_total.increment(amount=seconds)
+        stats = current_request.get()
+        if stats is not None:
+            stats.sql_statements += 1
+            stats.sql_seconds += seconds
+
+    def observe_queue_wait(self, seconds):
+        self.queue_wait.observe((), seconds)
+        stats = current_request.get()
+        if stats is not None:
+            stats.queue_seconds += seconds
+
+    def render(self):
+        metrics = [self.latency, self.sql_statements, self.sql_duration, self.queue_wait, self.statements_total, self.sql_seconds_total]
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+request_metrics = RequestMetrics()
+
+
+class InstrumentationMiddleware:
+    # Plain ASGI middleware, so streamed bodies are timed until their last chunk
+    # and the request stats stay visible to the handler's tasks and threads.
+    # Routes are labelled with their path template, unmatched paths share a label.
+    def __init__(self, app, metrics=request_metrics, server_timing=SERVER_TIMING):
+        self.app = app
+        self.metrics = metrics
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = current_request.set(stats)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_timed(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    header = stats.server_timing(time.perf_counter() - start).encode()
+                    message = {**message, "headers": [*message.get("headers", []), (b"server-timing", header)]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            current_request.reset(token)
+            route = scope.get("route")
+            self.metrics.observe_request(scope["method"], getattr(route, "path", "unmatched"), status, time.perf_counter() - start, stats)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["statement_started_at"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started_at = conn.info.pop("statement_started_at", None)
+    if started_at is not None:
+        request_metrics.observe_statement(time.perf_counter() - started_at)
+
+
+def instrument_engine(engine):
+    # Counts and times every statement, async engines pass their sync_engine
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+async def run_in_threadpool(func, *args, **kwargs):
+    # starlette's run_in_threadpool, also recording how long the call waited for a worker
+    submitted_at = time.perf_counter()
+
+    def timed():
+        request_metrics.observe_queue_wait(time.perf_counter() - submitted_at)
+        return func(*args, **kwargs)
+    return await starlette_run_in_threadpool(timed)
+
+
+
+def render_consumers(consumers):
+    # The RabbitMQConsumer metrics of the messaging package, labelled by exchange
+    messages = _header("messaging_consumer_messages_total", "counter", "Messages acked or failed by the consumer")
+    in_flight = _header("messaging_consumer_in_flight", "gauge", "Messages received and not settled yet")
+    processing = _header("messaging_consumer_processing_seconds", "histogram", "Time per callback call, a batch counts once")
+    lag = _header("messaging_consumer_lag_seconds", "histogram", "Time from publish to ack of a message")
+    last_lag = _header("messaging_consumer_last_lag_seconds", "gauge", "Lag of the last acked message with a publish time")
+    for consumer in consumers:
+        snapshot = consumer.metrics.snapshot()
+        exchange = _labels(("exchange",), (consumer.exchange,))
+        for routing_key, counts in sorted(snapshot["routing_keys"].items()):
+            for outcome in ("acked", "failed"):
+                labels = _labels(("exchange", "routing_key", "outcome"), (consumer.exchange, routing_key, outcome))
+                messages.append(f"messaging_consumer_messages_total{labels} {counts[outcome]}")
+        in_flight.append(f"messaging_consumer_in_flight{exchange} {snapshot['in_flight']}")
+        timings = consumer.metrics.processing
+        processing.extend(_histogram_series("messaging_consumer_processing_seconds", ("exchange",), (consumer.exchange,), timings.buckets, *timings.histogram()))
+        timings = consumer.metrics.lag
+        lag.extend(_histogram_series("messaging_consumer_lag_seconds", ("exchange",), (consumer.exchange,), timings.buckets, *timings.histogram()))
+        if snapshot["lag"]["last_ms"] is not None:
+            last_lag.append(f"messaging_consumer_last_lag_seconds{exchange} {snapshot['lag']['last_ms'] / 1000}")
+    return "\n".join([*messages, *in_flight, *processing, *lag, *last_lag]) + "\n"
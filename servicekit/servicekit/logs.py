@@ -0,0 +1,98 @@
+import atexit
+import itertools
+import json
+import logging
+import os
+import queue
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# json for one object per line, text for the plain format used during development
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+# Per-message logs are written for one in this many messages, 0 turns them off
+LOG_SAMPLE_EVERY = int(os.environ.get('LOG_SAMPLE_EVERY', 100))
+
+# Attributes every LogRecord has, anything else was passed as extra
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update((name, value) for name, value in vars(record).items() if name not in RECORD_ATTRIBUTES)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    # Hands records to the listener thread as they are, so message arguments are
+    # only formatted there and only when the record gets written. A full queue
+    # drops the record instead of blocking, the count is logged once there is room.
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            try:
+                self.queue.put_nowait(logging.makeLogRecord(dict(
+                    name=__name__, levelno=logging.WARNING, levelname="WARNING",
+                    msg="Dropped %d log records, the log queue was full", args=(dropped,)
+                )))
+            except queue.Full:
+                self.dropped = dropped
+
+
+class LogSample:
+    # True for one in every `every` calls while the logger is enabled for level,
+    # per-message logs go through it so a busy consumer does not log each delivery
+    def __init__(self, logger, level=logging.DEBUG, every=LOG_SAMPLE_EVERY):
+        self.logger = logger
+        self.level = level
+        self.every = every
+        self.calls = itertools.count()
+
+    def __call__(self):
+        return self.every > 0 and self.logger.isEnabledFor(self.level) and next(self.calls) % self.every == 0
+
+
+def configure_logging():
+    # The root logger only puts records on a queue, a listener thread formats and
+    # writes them. uvicorn's loggers are routed through it as well.
+    global listener
+    if listener is not None:
+        return
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else logging.Formatter('%(levelname)s:   %(message)s'))
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    root = logging.getLogger()
+    root.handlers = [DroppingQueueHandler(log_queue)]
+    root.setLevel(LOG_LEVEL)
+    for name in ("uvicorn", "uvicorn.access"):
+        logging.getLogger(name).handlers = []
+        logging.getLogger(name).propagate = True
+    logging.getLogger("pika").setLevel(logging.WARNING)
+    listener = QueueListener(log_queue, stream)
+    listener.start()
+    atexit.register(listener.stop)
@@ -0,0 +1,135 @@
+import logging
+import threading
+from datetime import datetime, timezone
+from sqlalchemy import delete, func, select
+
+logger = logging.getLogger(__name__)
+
+
+class Outbox:
+    # The outbox table of a service, model is its OutboxEvent model with the
+    # id, routing_key, payload, content_type and created_at columns
+    def __init__(self, model):
+        self.model = model
+
+    def add_event(self, db, routing_key, schema, event):
+        # Encoded right away but only staged on the session, it is committed together
+        # with the caller's changes
+        payload, content_type = schema.encode(event)
+        db.add(self.model(routing_key=routing_key, payload=payload, content_type=content_type))
+
+    async def backlog(self, db):
+        # Rows still waiting for the relay and the age of the oldest one
+        pending, oldest = (await db.execute(select(func.count(self.model.id), func.min(self.model.created_at)))).one()
+        age = (datetime.now(timezone.utc) - oldest).total_seconds() * 1000 if oldest is not None else 0.0
+        return {"pending": pending, "oldest_pending_ms": age}
+
+
+class OutboxMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.relayed = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+        self.last_lag = 0.0
+
+    def record_batch(self, lags):
+        with self.lock:
+            self.batches += 1
+            self.relayed += len(lags)
+            self.lag_total += sum(lags)
+            self.lag_max = max([self.lag_max, *lags])
+            self.last_lag = lags[-1]
+
+    def record_failure(self):
+        with self.lock:
+            self.failed_batches += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "relayed": self.relayed,
+                "batches": self.batches,
+                "failed_batches": self.failed_batches,
+                "lag_avg_ms": self.lag_total / self.relayed * 1000 if self.relayed else 0.0,
+                "lag_max_ms": self.lag_max * 1000,
+                "last_lag_ms": self.last_lag * 1000,
+            }
+
+
+class OutboxRelay:
+    # Moves committed outbox rows to the broker. Rows are locked with SKIP LOCKED so
+    # several replicas can relay side by side, and only deleted once confirmed.
+    # Delivery is at least once, a row whose confirm timed out is sent again.
+    def __init__(self, session_factory, publisher, outbox, batch_size=100, poll_interval=1.0, confirm_timeout=30):
+        self.session_factory = session_factory
+        self.publisher = publisher
+        self.model = outbox.model
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.confirm_timeout = confirm_timeout
+        self.metrics = OutboxMetrics()
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def notify(self):
+        self.wakeup.set()
+
+    def start_relaying(self):
+        logger.info("Starting outbox relay for exchange:%s", self.publisher.exchange)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def close(self, timeout=10):
+        self.stopping.set()
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def run(self):
+        while not self.stopping.is_set():
+            try:
+                relayed = self.relay_batch()
+            except Exception as e:
+                logger.error("Error relaying outbox events: %s", e)
+                relayed = 0
+            if relayed < self.batch_size:
+                self.wakeup.wait(self.poll_interval)
+                self.wakeup.clear()
+
+    def relay_batch(self):
+        db = self.session_factory()
+        try:
+            events = db.scalars(
+                select(self.model)
+                .order_by(self.model.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            ).all()
+            futures = [self.publisher.publish(event.payload, event.routing_key, event.content_type) for event in events]
+            confirmed = []
+            for event, future in zip(events, futures):
+                try:
+                    future.result(timeout=self.confirm_timeout)
+                except Exception as e:
+                    # Stop at the first failure so the rest keep their order for the next round
+                    logger.error("Outbox event %s was not confirmed: %s", event.id, e)
+                    self.metrics.record_failure()
+                    break
+                confirmed.append(event)
+            if confirmed:
+                now = datetime.now(timezone.utc)
+                lags = [(now - event.created_at).total_seconds() for event in confirmed]
+                db.execute(delete(self.model).where(self.model.id.in_([event.id for event in confirmed])))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        if confirmed:
+            self.metrics.record_batch(lags)
+        return len(confirmed) if len(confirmed) == len(events) else 0
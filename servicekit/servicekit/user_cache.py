@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import select
+
+
+class UserCacheMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def increment(self, name, count=1):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + count)
+
+    def snapshot(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+class UserCache:
+    # Read-through LRU cache of the replicated users table, keyed by id with a
+    # username index. The user consumer invalidates the ids it wrote after its
+    # commit. Other replicas do not see that event, so ttl bounds how long they
+    # keep serving a changed or deleted user. Missing users are never cached, and
+    # neither are users read on a replica session, which can be older than what
+    # the consumer wrote and invalidated on the primary. model is the service's
+    # User model.
+    def __init__(self, model, max_size=10000, ttl=60):
+        self.model = model
+        self.columns = [column.key for column in model.__table__.columns]
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.users = OrderedDict()
+        self.ids = {}
+        self.generation = 0
+        self.metrics = UserCacheMetrics()
+
+    async def get_by_id(self, db, user_id):
+        user = self._get(user_id)
+        if user is not None:
+            return user
+        generation = self.generation
+        return self._put(await db.scalar(select(self.model).where(self.model.id == user_id)), generation, db)
+
+    async def get_by_username(self, db, username):
+        with self.lock:
+            user_id = self.ids.get(username)
+        user = self._get(user_id) if user_id is not None else None
+        if user is not None:
+            return user
+        if user_id is None:
+            self.metrics.increment("misses")
+        generation = self.generation
+        return self._put(await db.scalar(select(self.model).where(self.model.username == username)), generation, db)
+
+    def invalidate(self, user_ids):
+        with self.lock:
+            self.generation += 1
+            for user_id in user_ids:
+                if self._remove(user_id):
+                    self.metrics.increment("invalidations")
+
+    def snapshot(self):
+        with self.lock:
+            size = len(self.users)
+        return {"size": size, "max_size": self.max_size, "ttl_seconds": self.ttl, **self.metrics.snapshot()}
+
+    def _get(self, user_id):
+        with self.lock:
+            entry = self.users.get(user_id)
+            if entry is None:
+                self.metrics.increment("misses")
+                return None
+            user, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._remove(user_id)
+                self.metrics.increment("expirations")
+                self.metrics.increment("misses")
+                return None
+            self.users.move_to_end(user_id)
+            self.metrics.increment("hits")
+            return user
+
+    def _put(self, user, generation, db):
+        if user is None:
+            return None
+        # A copy that belongs to no session, so it can be shared between requests
+        user = self.model(**{column: getattr(user, column) for column in self.columns})
+        with self.lock:
+            # An invalidation that ran during the query may have been for this row
+            if generation != self.generation or "replica" in db.info:
+                return user
+            self._remove(user.id)
+            self.users[user.id] = (user, time.monotonic() + self.ttl)
+            self.ids[user.username] = user.id
+            while len(self.users) > self.max_size:
+                self._remove(next(iter(self.users)))
+                self.metrics.increment("evictions")
+        return user
+
+    def _remove(self, user_id):
+        entry = self.users.pop(user_id, None)
+        if entry is None:
+            return False
+        if self.ids.get(entry[0].username) == user_id:
+            del self.ids[entry[0].username]
+        return True
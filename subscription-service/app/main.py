@@ -1,152 +1,158 @@
 # TODO: Implement the subscription service
 
 from contextlib import asynccontextmanager
-import json
 import os
-from fastapi import FastAPI, HTTPException, Query, Depends
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session, aliased
+from fastapi import FastAPI, HTTPException, Query, Depends, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
 from typing import List, Optional
 from datetime import datetime
 import logging
-from consumer import RabbitMQConsumer
-from publisher import RabbitMQPublisher
-from models import SubscriptionDTO, User, UserType, Subscription, SubscriptionMessage
-from connection_manager import RabbitMQConnectionManager
-from config import RabbitMQConnectionConfig
-logging.basicConfig(level=logging.INFO, format='%(levelname)s:   %(message)s')
+from messaging import SUBSCRIPTION_EVENT, USER_EVENT, RabbitMQConnection, RabbitMQConnectionConfig, RabbitMQConsumer, RabbitMQPublisher, latest_events
+from servicekit.outbox import Outbox, OutboxRelay
+from servicekit.user_cache import UserCache
+from models import SubscriptionDTO, User, UserType, Subscription, SubscriptionMessage, OutboxEvent, Page
+from servicekit.logs import LogSample, configure_logging
+from servicekit.instrumentation import PROMETHEUS, InstrumentationMiddleware, render_consumers, request_metrics
+from servicekit.database import SessionLocal, async_engine, get_db, get_async_db, get_read_db, replicas, upsert, pool_metrics, async_pool_metrics
+configure_logging()
 logger = logging.getLogger(__name__)
-pika_logger = logging.getLogger("pika")
-pika_logger.setLevel(logging.WARNING)
+message_log = LogSample(logger)
 
 
-RABBITMQ_HOSTNAME=os.environ.get('RABBITMQ_HOSTNAME')
-RABBITMQ_PORT=os.environ.get('RABBITMQ_PORT')
-RABBITMQ_USERNAME=os.environ.get('RABBITMQ_USERNAME')
-RABBITMQ_PASSWORD=os.environ.get('RABBITMQ_PASSWORD')
-DATABASE_URL = f"postgresql://{os.getenv('DATABASE_USERNAME')}:{os.getenv('DATABASE_PASSWORD')}@{os.getenv('DATABASE_HOSTNAME')}:{os.getenv('DATABASE_PORT')}/{os.getenv('DATABASE_NAME')}"
-
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+RABBITMQ_PREFETCH_COUNT=int(os.environ.get('RABBITMQ_PREFETCH_COUNT', 400))
+RABBITMQ_CONSUMER_WORKERS=int(os.environ.get('RABBITMQ_CONSUMER_WORKERS', 4))
+RABBITMQ_BATCH_SIZE=int(os.environ.get('RABBITMQ_BATCH_SIZE', 100))
+RABBITMQ_BATCH_TIMEOUT=int(os.environ.get('RABBITMQ_BATCH_TIMEOUT_MS', 50)) / 1000
+USER_CACHE_SIZE=int(os.environ.get('USER_CACHE_SIZE', 10000))
+USER_CACHE_TTL=int(os.environ.get('USER_CACHE_TTL_SECONDS', 60))
 
+connection = None
 publisher = None
+outbox_relay = None
+consumers = []
+user_cache = UserCache(User, USER_CACHE_SIZE, USER_CACHE_TTL)
+outbox = Outbox(OutboxEvent)
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+async def paginate(db, query, id_column, cursor, limit):
+    # Keyset pagination: rows after the cursor id in id order, plus one extra row
+    # to find out whether there is a next page
+    if cursor is not None:
+        query = query.where(id_column > cursor)
+    rows = (await db.execute(query.order_by(id_column).limit(limit + 1))).all()
+    return rows[:limit], len(rows) > limit
 
 
 @asynccontextmanager
 async def lifespan(app):
-    global publisher
-    config = RabbitMQConnectionConfig(RABBITMQ_HOSTNAME, RABBITMQ_PORT, RABBITMQ_USERNAME, RABBITMQ_PASSWORD)
-    user_consuming_manager = RabbitMQConnectionManager(config)
-    publishing_manager = RabbitMQConnectionManager(config)
-    user_consumer = RabbitMQConsumer(user_consuming_manager, user_callback, 'user', ['created', 'updated', 'deleted'])
-    publisher = RabbitMQPublisher(publishing_manager, 'subscription')
-    user_consumer.start_consuming()
+    global connection, publisher, outbox_relay, consumers
+    # One broker connection for the publisher and every consumer, each on its own channel
+    connection = RabbitMQConnection(RabbitMQConnectionConfig.from_env())
+    publisher = RabbitMQPublisher(connection, 'subscription')
+    outbox_relay = OutboxRelay(SessionLocal, publisher, outbox)
+    consumers = [
+        RabbitMQConsumer(connection, user_callback, 'user', ['created', 'updated', 'deleted'], 'subscription-service.user', RABBITMQ_PREFETCH_COUNT, RABBITMQ_CONSUMER_WORKERS, batch_callback=apply_user_events, batch_size=RABBITMQ_BATCH_SIZE, batch_timeout=RABBITMQ_BATCH_TIMEOUT, schema=USER_EVENT),
+    ]
+    for consumer in consumers:
+        consumer.start_consuming()
+    connection.start()
+    outbox_relay.start_relaying()
     try:
         yield
     finally:
         logger.info('Closing connection')
-        user_consuming_manager.close()
-        publishing_manager.close()
+        outbox_relay.close()
+        connection.close()
+        await async_engine.dispose()
+        await replicas.dispose()
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(InstrumentationMiddleware)
 
 
 
-def user_callback(ch, method, properties, body):
-    logger.info(f"Message recieved")
-    logger.info(f"Method:{method}")
-    logger.info(f"Properties:{properties}")
-    user = parse_user_message(body)
-    if method.routing_key == 'created':
-        logger.info(f"Parsing user created message")
-        save_user(user)
-    elif method.routing_key == 'updated':
-        logger.info(f"Parsing user updated message")
-        update_user(user)
-    elif method.routing_key == 'deleted':
-        logger.info(f"Parsing user deleted message")
-        delete_user(user)
-    save_user(user)
-    logger.info(f"User {user.username} added to the database")
-
-def delete_user(user):
-    db = next(get_db())
-    try:
-        db.query(User).filter(User.id == user.id).delete()
-        db.query(Subscription).filter(Subscription.participant_id == user.id).delete()
-        db.commit()
-    except Exception as e:
-        db.rollback()
-        logger.error(f"Error deleting user from database: {e}")
-    finally:
-        db.close()
+def user_callback(ch, method, properties, event):
+    if message_log():
+        logger.debug("Message received from exchange %s with routing key %s", method.exchange, method.routing_key)
+    apply_user_events([(method.routing_key, event)])
 
-def update_user(user):
+def apply_user_events(messages):
+    events = latest_events(messages, parse_user_message)
+    users = [user for routing_key, user in events if routing_key != 'deleted']
+    deleted = [user['id'] for routing_key, user in events if routing_key == 'deleted']
+    logger.debug("Applying %s user upserts and %s deletes", len(users), len(deleted))
     db = next(get_db())
     try:
-        db.query(User).filter(User.id == user.id).update(
-            {
-                User.username: user.username,
-                User.email: user.email,
-                User.user_type: user.user_type
-            }
-        )
+        if users:
+            stale = len(users) - upsert(db, User, users)
+            if stale:
+                logger.debug("Skipped %s stale user events", stale)
+        if deleted:
+            db.query(Subscription).filter(Subscription.participant_id.in_(deleted)).delete()
+            db.query(User).filter(User.id.in_(deleted)).delete()
         db.commit()
     except Exception as e:
         db.rollback()
-        logger.error(f"Error updating user in database: {e}")
+        logger.error("Error applying user events to database: %s", e)
+        raise
     finally:
         db.close()
+    user_cache.invalidate([user['id'] for user in users] + deleted)
+
+def parse_user_message(event):
+    # USER_EVENT fields are the users columns
+    return dict(event, user_type=UserType(event['user_type']))
+
+
+@app.get("/metrics")
+async def read_metrics():
+    return Response(request_metrics.render() + render_consumers(consumers), media_type=PROMETHEUS)
+
+
+@app.get("/metrics/messaging")
+async def read_messaging_metrics():
+    return connection.snapshot()
+
+
+@app.get("/metrics/outbox")
+async def read_outbox_metrics(db: AsyncSession = Depends(get_async_db)):
+    return {**outbox_relay.metrics.snapshot(), **(await outbox.backlog(db))}
 
-def save_user(user):
-    db = next(get_db())
-    try:
-        db.add(user)
-        db.commit()
-        db.refresh(user)
-    except Exception as e:
-        db.rollback()
-        logger.error(f"Error adding user to database: {e}")
-    finally:
-        db.close()
-    
-def parse_user_message(body):
-    user_data = json.loads(body)
-    return User(id = user_data['id'],username=user_data['username'], email=user_data['email'], user_type=UserType(user_data['user_type']))
+
+@app.get("/metrics/pool")
+async def read_pool_metrics():
+    return {"sync": pool_metrics.snapshot(), "async": async_pool_metrics.snapshot(), **replicas.snapshot()}
+
+
+@app.get("/metrics/user-cache")
+async def read_user_cache_metrics():
+    return user_cache.snapshot()
 
 
 @app.post("/subscriptions/subscribe/{organizer}/{username}")
-async def create_subscription(organizer: str, username, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == username).first()
+async def create_subscription(organizer: str, username, db: AsyncSession = Depends(get_async_db)):
+    user = await user_cache.get_by_username(db, username)
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
-    organizer = db.query(User).filter(User.username == organizer).first()
+    organizer = await user_cache.get_by_username(db, organizer)
     if organizer is None:
         raise HTTPException(status_code=404, detail="Organizer not found")
-    found = db.query(Subscription).filter(Subscription.participant_id == user.id, Subscription.organizer_id == organizer.id).first()
+    found = await db.scalar(select(Subscription).where(Subscription.participant_id == user.id, Subscription.organizer_id == organizer.id))
     if found is not None:
         raise HTTPException(status_code=400, detail="Subscription already exists")
     subscription = Subscription(participant_id=user.id, organizer_id=organizer.id, date=datetime.now().strftime("%Y-%m-%dT%H:%M:%S"))
     db.add(subscription)
-    db.commit()
-    db.refresh(subscription)
+    await db.flush()
     message = SubscriptionMessage(
         id=subscription.id,
         participant_id=subscription.participant_id,
         organizer_id=subscription.organizer_id,
         date=subscription.date,
     )
-    publisher.publish(message.model_dump_json(), 'created')
+    outbox.add_event(db, 'created', SUBSCRIPTION_EVENT, message.model_dump())
+    await db.commit()
+    outbox_relay.notify()
     return SubscriptionDTO(
         participant=user.username, 
         organizer=organizer.username, 
@@ -154,64 +160,66 @@ async def create_subscription(organizer: str, username, db: Session = Depends(ge
     )
 
 @app.get("/subscriptions/{username}")
-async def get_subscriptions(username: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == username).first()
+async def get_subscriptions(username: str, db: AsyncSession = Depends(get_async_db)):
+    user = await user_cache.get_by_username(db, username)
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
-    subscriptions = db.query(Subscription).filter(Subscription.participant_id == user.id).all()
+    subscriptions = (await db.scalars(select(Subscription).where(Subscription.participant_id == user.id))).all()
     subs = []
     for subscription in subscriptions:
-        organizer = db.query(User).filter(User.id == subscription.organizer_id).first()
+        organizer = await user_cache.get_by_id(db, subscription.organizer_id)
         if organizer is None:
             raise HTTPException(status_code=500, detail="Organizer not found")
         subs.append(SubscriptionDTO(participant=user.username, organizer=organizer.username, date=subscription.date))
     return subs
 
 @app.post("/subscriptions/cancel/{organizer}/{username}")
-async def cancel_subscription(organizer: str, username: str, db: Session = Depends(get_db)):
+async def cancel_subscription(organizer: str, username: str, db: AsyncSession = Depends(get_async_db)):
     Participant = aliased(User)
     Organizer = aliased(User)
     
-    subscription = (
-        db.query(Subscription)
+    subscription = await db.scalar(
+        select(Subscription)
         .join(Participant, Subscription.participant_id == Participant.id)
         .join(Organizer, Subscription.organizer_id == Organizer.id)
-        .filter(Participant.username == username, Organizer.username == organizer)
-        .first()
+        .where(Participant.username == username, Organizer.username == organizer)
     )
     
     if subscription is None:
         raise HTTPException(status_code=400, detail="Subscription not found")
     
     subscription.active = False
-    db.commit()
-    db.refresh(subscription)
-    
     message = SubscriptionMessage(
         id=subscription.id,
         participant_id=subscription.participant_id,
         organizer_id=subscription.organizer_id,
         date=subscription.date,
     )
-    
-    publisher.publish(message.model_dump_json(), 'canceled')
+    outbox.add_event(db, 'canceled', SUBSCRIPTION_EVENT, message.model_dump())
+    await db.commit()
+    outbox_relay.notify()
     
     return {"message": "Subscription canceled"}
 
 
 @app.get("/subscriptions/subscribers/{organizer}")
-async def get_organizer_subscriptions(organizer: str, db: Session = Depends(get_db)):
-    organizer = db.query(User).filter(User.username == organizer).first()
-    logger.info(f"Organizer: {organizer.email}")
+async def get_organizer_subscriptions(
+    organizer: str,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[int] = None,
+    db: AsyncSession = Depends(get_read_db)
+):
+    organizer = await user_cache.get_by_username(db, organizer)
     if organizer is None:
         raise HTTPException(status_code=400, detail="Organizer not found")
-    subscriptions = db.query(Subscription).filter(Subscription.organizer_id == organizer.id).all()
-    logger.info(f"Subscriptions: {subscriptions}")
-    subs = []
-    for subscription in subscriptions:
-        participant = db.query(User).filter(User.id == subscription.participant_id).first()
-        if participant is None:
-            raise HTTPException(status_code=500, detail="Participant not found")
-        subs.append(SubscriptionDTO(participant=participant.username, organizer=organizer.username, date=subscription.date))
-    logger.info(f"Subs: {subs}")
-    return subs
+    query = (
+        select(Subscription, User.username)
+        .join(User, User.id == Subscription.participant_id)
+        .where(Subscription.organizer_id == organizer.id)
+    )
+    rows, has_more = await paginate(db, query, Subscription.id, cursor, limit)
+    subs = [
+        SubscriptionDTO(participant=participant, organizer=organizer.username, date=subscription.date)
+        for subscription, participant in rows
+    ]
+    return Page(items=subs, next_cursor=rows[-1].Subscription.id if has_more else None)
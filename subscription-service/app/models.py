@@ -1,24 +1,26 @@
 from enum import Enum
-import os
+from typing import Generic, List, Optional, TypeVar
 from pydantic import BaseModel
-from sqlalchemy import Boolean, Column, Integer, String, Enum as SQLAlchemyEnum, create_engine
+from sqlalchemy import BigInteger, Boolean, Column, DateTime, Index, Integer, String, LargeBinary, Enum as SQLAlchemyEnum, func
 from sqlalchemy.ext.declarative import declarative_base
+from servicekit.database import engine
 
 
 
-DATABASE_HOSTNAME=os.environ.get('DATABASE_HOSTNAME')
-DATABASE_PORT=os.environ.get('DATABASE_PORT')
-DATABASE_NAME=os.environ.get('DATABASE_NAME')
-DATABASE_USERNAME=os.environ.get('DATABASE_USERNAME')
-DATABASE_PASSWORD=os.environ.get('DATABASE_PASSWORD')
-DATABASE_URL=f"postgresql://{DATABASE_USERNAME}:{DATABASE_PASSWORD}@{DATABASE_HOSTNAME}:{DATABASE_PORT}/{DATABASE_NAME}"
-engine = create_engine(DATABASE_URL)
 
 Base = declarative_base()
 
+T = TypeVar("T")
+
 
 class Subscription(Base):
     __tablename__ = "subscriptions"
+    # (participant, organizer) backs the duplicate check and a participant's list,
+    # (organizer, id) backs the keyset-paged subscribers listing
+    __table_args__ = (
+        Index("ix_subscriptions_participant_id_organizer_id", "participant_id", "organizer_id"),
+        Index("ix_subscriptions_organizer_id_id", "organizer_id", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     participant_id = Column(Integer)
@@ -44,6 +46,10 @@ class SubscriptionDTO(BaseModel):
     class Config:
         from_attributes = True
 
+class Page(BaseModel, Generic[T]):
+    items: List[T]
+    next_cursor: Optional[int] = None
+
 class UserType(str, Enum):
     PARTICIPANT = "participant"
     ORGANIZER = "organizer"
@@ -52,9 +58,22 @@ class User(Base):
     __tablename__ = "users"
 
     id = Column(Integer, primary_key=True)
-    username = Column(String)
+    username = Column(String, index=True)
     email = Column(String)
     user_type = Column(SQLAlchemyEnum(UserType))
+    # Version of the last applied user event, 0 when the event carried none
+    version = Column(Integer, nullable=False, server_default="0")
+
+class OutboxEvent(Base):
+    __tablename__ = "outbox_events"
+    # Written in the same transaction as the change it describes, the relay
+    # drains it in id order
+    id = Column(BigInteger, primary_key=True)
+    routing_key = Column(String)
+    payload = Column(LargeBinary)
+    content_type = Column(String, nullable=False, server_default="application/json")
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
 
 Base.metadata.create_all(bind=engine)
 
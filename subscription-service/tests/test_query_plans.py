@@ -0,0 +1,25 @@
+import pytest
+from sqlalchemy import text
+
+
+@pytest.mark.parametrize("url, params, index", [
+    ("/subscriptions/participant1", {}, "ix_subscriptions_participant_id_organizer_id"),
+    ("/subscriptions/subscribers/organizer52", {}, "ix_subscriptions_organizer_id_id"),
+    ("/subscriptions/subscribers/organizer52", {"cursor": 10}, "ix_subscriptions_organizer_id_id"),
+])
+def test_listing_queries_do_not_scan_tables(main, db, client, query_plans, url, params, index):
+    # Enough participants and organizers, analyzed, that the planner sees the
+    # filters as selective, as they are in production
+    db.add_all(main.User(id=id, username=f"participant{id}", email=f"participant{id}@example.com", user_type=main.UserType.PARTICIPANT) for id in range(1, 51))
+    db.add_all(main.User(id=id, username=f"organizer{id}", email=f"organizer{id}@example.com", user_type=main.UserType.ORGANIZER) for id in range(51, 101))
+    db.add_all(main.Subscription(id=id, participant_id=id % 50 + 1, organizer_id=id // 20 % 50 + 51, date="2026-05-01T10:00:00") for id in range(1, 1001))
+    db.commit()
+    db.execute(text("ANALYZE users, subscriptions"))
+    db.commit()
+    plans = query_plans(lambda: client("GET", url, params=params))
+    for statement, plan in plans:
+        assert "Seq Scan" not in plan, f"{statement}\n{plan}"
+    # An id order scan that filters every row is no seq scan either, so the
+    # single column filters must use their own index
+    if index is not None:
+        assert any(f" {index} " in plan for _, plan in plans), "\n\n".join(plan for _, plan in plans)
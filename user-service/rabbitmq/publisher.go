@@ -2,6 +2,7 @@ package rabbitmq
 
 import (
 	"log"
+	"time"
 
 	amqp "github.com/rabbitmq/amqp091-go"
 )
@@ -53,6 +54,8 @@ func (r *RabbitMQPublisher) Publish(message []byte, routingKey string) error {
 			ContentType: "application/json",
 			Body:        message,
 			DeliveryMode: amqp.Persistent,
+			// Milliseconds since the epoch, the Python consumers measure their lag from it
+			Headers: amqp.Table{"published_at": time.Now().UnixMilli()},
 		},
 	)
 	if err != nil {
@@ -62,6 +65,6 @@ func (r *RabbitMQPublisher) Publish(message []byte, routingKey string) error {
 		return r.Publish(message, routingKey) // Retry publishing
 	}
 
-	log.Printf(" [x] Sent message: %s", string(message))
+	log.Printf(" [x] Sent %d byte message to exchange %s with routing key %s", len(message), r.exchange, routingKey)
 	return nil
 }
\ No newline at end of file